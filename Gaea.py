@@ -14,36 +14,131 @@ import argparse
 import requests
 import uuid
 import xml.etree.ElementTree as ET
+import io
 import gzip
+import sys
+import atexit
+import threading
+import collections
+import concurrent.futures
+import hashlib
+import sqlite3
+import re
+import getpass
+import select
+# pynacl is only required for Crypt4GH encryption
+try:
+    from nacl.bindings import crypto_aead_chacha20poly1305_ietf_encrypt
+except ImportError:
+    crypto_aead_chacha20poly1305_ietf_encrypt = None
+
+
+# credentials parsed from each credential file {credential_file: {key: value}}
+parsed_credentials = {}
+
+# idle database connections kept open for reuse within the current process
+# {(pid, DbHost, DbUser, database): [connections]}
+connection_pool = {}
+# maximum number of idle connections kept for each database
+max_pooled_connections = 4
+# number of connections opened to the database server during the current run
+opened_connections = {'count': 0}
+
+# alias to accession maps loaded from the EGA metadata database during the current run
+# {(credential_file, database, box, table): {alias: accession}}
+accession_index = {}
+# accessions of registered objects and of their dependencies loaded during the current run
+# {(credential_file, database, box): set of accessions}
+accession_sets = {}
+
+# extension of the encrypted files for each encryption method
+encryption_extensions = {'gpg': '.gpg', 'crypt4gh': '.c4gh'}
+
+# EGA enumerations downloaded during the current run {URL: (download time, enumerations)}
+enumeration_cache = {}
+# directory with the enumerations shared between runs
+enumeration_cache_dir = os.path.join(os.path.expanduser('~'), '.gaea', 'enumerations')
+# number of seconds after which cached enumerations are downloaded again
+enumeration_cache_ttl = 86400
+# number of seconds to connect to the metadata API and to wait for data before a request fails
+api_timeout = (30, 600)
+
+# backend running the encryption, upload and check jobs. Accepted values: uge or local
+# jobs run by the local backend inherit the backend through the environment
+executor = {'backend': os.environ.get('GAEA_EXECUTOR', 'uge'), 'workers': os.cpu_count() or 1}
+# pool running the jobs of the local backend
+local_pool = {'executor': None}
+# jobs submitted to the local backend during the current run {job name: future}
+local_jobs = {}
+# tasks of the array jobs submitted to the local backend {array job name: [task names]}
+local_arrays = {}
+# directory with the exit codes of the local jobs shared with the check jobs
+local_job_dir = os.path.join(os.path.expanduser('~'), '.gaea', 'jobs')
+
+# sessions to the staging servers opened during the current run {(pid, host, box): session}
+staging_sessions = {}
+# number of seconds without output after which a session to a staging server is considered stalled
+staging_timeout = 300
+# directory with the control sockets of the ssh connections to the xfer host
+ssh_control_dir = os.path.join(os.path.expanduser('~'), '.gaea', 'ssh')
+# number of seconds the ssh connection to the xfer host stays open after the last command
+ssh_control_persist = 600
+# number of seconds during which a listing of a stage path is shared by the upload checks
+staging_listing_ttl = 300
+# local directory standing in for the staging servers in listings and mkdir, with a sub-directory for each box
+staging_root = {'path': os.environ.get('GAEA_STAGING_ROOT')}
+
+# directory with the UGE accounting files
+accounting_dir = '/oicr/cluster/uge-8.6/default/common'
+# local index of the jobs recorded in the UGE accounting files
+# kept on local disk, sqlite locking is not reliable on NFS
+accounting_index = os.environ.get('GAEA_ACCOUNTING_INDEX', os.path.join('/var/tmp', 'gaea-' + getpass.getuser(), 'accounting.sqlite'))
+# time after which a job neither queued nor in the accounting is considered deleted (in seconds)
+completion_timeout = 12 * 3600
 
 
 def extract_credentials(credential_file):
     '''
     (str) -> dict
-    
-    Returns a dictionary with the database and EGA boxes credentials
-    
+
+    Returns a dictionary with the database and EGA boxes credentials.
+    The credential file is parsed only once per process
+
     Parameters
     ----------
     - credential_file (str): Path to the file with the database and EGA box credentials
     '''
-    
-    D = {}            
-    infile = open(credential_file)            
-    for line in infile:
-        if line.rstrip() != '':
-            line = line.rstrip().split('=')
-            D[line[0].strip()] = line[1].strip()
-    infile.close()        
-    return D
+
+    if credential_file not in parsed_credentials:
+        D = {}
+        infile = open(credential_file)
+        for line in infile:
+            if line.rstrip() != '':
+                line = line.rstrip().split('=')
+                D[line[0].strip()] = line[1].strip()
+        infile.close()
+        parsed_credentials[credential_file] = D
+    # return a copy so that callers cannot alter the cached credentials
+    return dict(parsed_credentials[credential_file])
 
 
-def connect_to_database(credential_file, database):
+class PooledConnection(pymysql.connections.Connection):
     '''
-    (str, str) -> pymysql.connections.Connection
-    
-    Open a connection to the EGA database by parsing the CredentialFile
-    
+    A pymysql connection returned to the connection pool instead of being closed
+    when close() is called
+    '''
+
+    def close(self):
+        release_connection(self)
+
+
+def open_connection(credential_file, database):
+    '''
+    (str, str) -> PooledConnection
+
+    Opens a new connection to database on the database server and updates
+    the count of connections opened during the run
+
     Parameters
     ----------
     - credential_file (str): Path to the file with the database and EGA box credentials
@@ -54,18 +149,130 @@ def connect_to_database(credential_file, database):
     credentials = extract_credentials(credential_file)
     DbHost = credentials['DbHost']
     DbUser, DbPasswd = credentials['DbUser'], credentials['DbPasswd']
-    
+
     try:
-        conn = pymysql.connect(host = DbHost, user = DbUser, password = DbPasswd,
-                               db = database, charset = "utf8", port=3306)
+        conn = PooledConnection(host = DbHost, user = DbUser, password = DbPasswd,
+                                db = database, charset = "utf8", port=3306)
     except:
         try:
-            conn = pymysql.connect(host=DbHost, user=DbUser, password=DbPasswd, db=database)
+            conn = PooledConnection(host=DbHost, user=DbUser, password=DbPasswd, db=database)
         except:
             raise ValueError('cannot connect to {0} database'.format(database))
+    # record the pool the connection belongs to
+    conn.pool_key = (os.getpid(), DbHost, DbUser, database)
+    opened_connections['count'] += 1
     return conn
 
 
+def is_connection_alive(conn):
+    '''
+    (PooledConnection) -> bool
+
+    Returns True if the connection to the database server is still usable
+
+    Parameters
+    ----------
+    - conn (PooledConnection): Connection to the database
+    '''
+
+    try:
+        conn.ping(reconnect=False)
+    except:
+        return False
+    return True
+
+
+def connect_to_database(credential_file, database):
+    '''
+    (str, str) -> PooledConnection
+
+    Returns a connection to the EGA database by parsing the CredentialFile.
+    An idle connection from the pool is reused if it is still alive,
+    otherwise a new connection is opened
+
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+
+    # get the database credentials
+    credentials = extract_credentials(credential_file)
+    # connections are not shared across processes
+    key = (os.getpid(), credentials['DbHost'], credentials['DbUser'], database)
+
+    # check out an idle connection. discard connections that were dropped by the server
+    idle = connection_pool.get(key, [])
+    while len(idle) != 0:
+        conn = idle.pop()
+        if is_connection_alive(conn):
+            return conn
+        try:
+            pymysql.connections.Connection.close(conn)
+        except:
+            pass
+
+    return open_connection(credential_file, database)
+
+
+def release_connection(conn):
+    '''
+    (PooledConnection) -> None
+
+    Returns the connection to the pool if the pool is not full or closes it.
+    Any open transaction is rolled back so that the next user of the connection
+    does not read from a stale snapshot
+
+    Parameters
+    ----------
+    - conn (PooledConnection): Connection to the database
+    '''
+
+    if not conn.open:
+        return
+    try:
+        conn.rollback()
+    except:
+        # connection is unusable, do not keep it
+        pymysql.connections.Connection.close(conn)
+        return
+    idle = connection_pool.setdefault(conn.pool_key, [])
+    if conn.pool_key[0] == os.getpid() and len(idle) < max_pooled_connections and conn not in idle:
+        idle.append(conn)
+    else:
+        pymysql.connections.Connection.close(conn)
+
+
+def close_all_connections():
+    '''
+    (None) -> None
+
+    Closes all idle connections held in the pool of the current process
+    '''
+
+    for key in list(connection_pool.keys()):
+        if key[0] == os.getpid():
+            for conn in connection_pool.pop(key):
+                try:
+                    pymysql.connections.Connection.close(conn)
+                except:
+                    pass
+
+
+def count_database_connections():
+    '''
+    (None) -> int
+
+    Returns the number of connections opened to the database server during the run
+    '''
+
+    return opened_connections['count']
+
+
+# close pooled connections when the run ends
+atexit.register(close_all_connections)
+
+
 def show_tables(credential_file, database):
     '''
     (str) -> list
@@ -86,6 +293,136 @@ def show_tables(credential_file, database):
     conn.close()
     return tables
 
+
+def add_table_indexes(cur, table):
+    '''
+    (pymysql.cursors.Cursor, str) -> list
+    
+    Creates the missing indexes on the egaBox, Status, alias and egaAccessionId columns
+    of table and returns the list of created indexes
+    
+    Parameters
+    ----------
+    - cur (pymysql.cursors.Cursor): Cursor of an open connection to the database
+    - table (str): Table in database
+    '''
+    
+    # get the column types. text columns can only be indexed on a prefix
+    cur.execute('SHOW COLUMNS FROM {0}'.format(table))
+    columns = {i[0].lower(): (i[0], str(i[1]).lower()) for i in cur.fetchall()}
+    # get the existing indexes
+    cur.execute('SHOW INDEX FROM {0}'.format(table))
+    indexes = set([i[2] for i in cur.fetchall()])
+    
+    # map index names to indexed columns
+    D = {}
+    if 'egabox' in columns and 'status' in columns:
+        D['idx_egaBox_Status'] = ['egabox', 'status']
+    elif 'egabox' in columns:
+        D['idx_egaBox'] = ['egabox']
+    if 'alias' in columns and 'egabox' in columns:
+        D['idx_alias_egaBox'] = ['alias', 'egabox']
+    if 'egaaccessionid' in columns:
+        D['idx_egaAccessionId'] = ['egaaccessionid']
+    
+    created = []
+    for index in sorted(D):
+        if index not in indexes:
+            fields = []
+            for i in D[index]:
+                name, column_type = columns[i]
+                if 'text' in column_type or 'blob' in column_type:
+                    fields.append('{0}(100)'.format(name))
+                else:
+                    fields.append(name)
+            cur.execute('CREATE INDEX {0} ON {1} ({2})'.format(index, table, ', '.join(fields)))
+            created.append(index)
+    return created
+
+
+def index_tables(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Creates the missing indexes on all tables of database
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    # skip tables used during collect and schema migrations
+    tables = [i for i in show_tables(credential_file, database) if i != 'SchemaVersion' and not i.endswith('_shadow') and not i.endswith('_old')]
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    for table in tables:
+        created = add_table_indexes(cur, table)
+        if len(created) != 0:
+            print('created indexes {0} on table {1}'.format(', '.join(created), table))
+    conn.commit()
+    conn.close()
+
+
+# versioned schema migrations applied in order to each database [(version, description, function)]
+# functions take the credential file and the name of the database
+schema_migrations = [(1, 'index egaBox, Status, alias and egaAccessionId columns', index_tables)]
+
+
+def get_schema_version(credential_file, database):
+    '''
+    (str, str) -> int
+    
+    Returns the most recent schema version recorded in database, or 0 if no migration was applied
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS SchemaVersion (version INT PRIMARY KEY, description TEXT NULL, appliedTime VARCHAR(100) NULL)')
+    conn.commit()
+    cur.execute('SELECT MAX(SchemaVersion.version) FROM SchemaVersion')
+    version = cur.fetchall()[0][0]
+    conn.close()
+    if version == None:
+        return 0
+    return int(version)
+
+
+def migrate_schema(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Applies in order the schema migrations more recent than the schema version 
+    of database and records the version of each applied migration
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    version = get_schema_version(credential_file, database)
+    for migration, description, function in schema_migrations:
+        if migration > version:
+            print('applying migration {0} to database {1}: {2}'.format(migration, database, description))
+            function(credential_file, database)
+            # record the schema version
+            conn = connect_to_database(credential_file, database)
+            cur = conn.cursor()
+            cur.execute('INSERT INTO SchemaVersion (version, description, appliedTime) VALUES (%s, %s, %s)',
+                        (migration, description, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+            conn.commit()
+            conn.close()
+            version = migration
+    print('database {0} is at schema version {1}'.format(database, version))
+
  
 def get_working_directory(S, working_dir):
     '''
@@ -192,60 +529,184 @@ def format_data(L):
     return tuple(Values)
 
 
-def list_enumerations(URL='https://ega-archive.org/submission-api/v1/'):
+def download_enumeration(URL):
     '''
-    (str) -> dict
+    (str) -> dict or None
+    
+    Returns a dictionary with values and tags of the EGA enumeration at URL,
+    or None if the enumeration could not be retrieved
+    
+    Parameters
+    ----------
+    - URL (str): URL of the enumeration
+    '''
+    
+    # create a dict to store the enumeration data (value: tag}
+    d = {}
+    # retrieve the information for the given enumeration
+    # a stalled request is treated as an enumeration that could not be retrieved
+    try:
+        response = requests.get(URL, timeout=api_timeout)
+    except requests.exceptions.RequestException:
+        return None
+    # check response code
+    if response.status_code != requests.codes.ok:
+        return None
+    # loop over dict in list
+    for i in response.json()['response']['result']:
+        if 'instrument_models' in URL:
+            if i['value'] == 'unspecified':
+                # grab label instead of value
+                assert i['label'] not in d
+                d[i['label']] = i['tag']
+            else:
+                assert i['value'] not in d
+                d[i['value']] = i['tag']
+        elif 'reference_chromosomes' in URL:
+            # grab value : tag
+            # group corresponds to tag in reference_genomes. currently, does not suppot patches
+            # group = 15 --> tag = 15 in reference_genomes = GRCH37
+            # group = 1 --> tag = 1 in reference_genomes = GRCH38
+            if i['group'] in ['1', '15']:
+                assert i['value'] not in d
+                d[i['value']] = i['tag']
+        else:
+            assert i['value'] not in d
+            d[i['value']] = i['tag']
+    return d
+
+
+def get_enumeration_cache_file(URL):
+    '''
+    (str) -> str
+    
+    Returns the path of the file storing the enumerations downloaded from the API at URL
+    
+    Parameters
+    ----------
+    - URL (str): URL of the API
+    '''
+    
+    return os.path.join(enumeration_cache_dir, hashlib.md5(format_url(URL).encode('utf-8')).hexdigest() + '.json')
+
+
+def read_enumeration_cache(URL):
+    '''
+    (str) -> tuple
+    
+    Returns a tuple with the download time and the enumerations stored on disk
+    for the API at URL, or None if enumerations were never stored
+    
+    Parameters
+    ----------
+    - URL (str): URL of the API
+    '''
+    
+    try:
+        infile = open(get_enumeration_cache_file(URL))
+        data = json.load(infile)
+        infile.close()
+    except (IOError, ValueError):
+        return None
+    if data.get('URL') != format_url(URL):
+        return None
+    return (data['time'], data['enumerations'])
+
+
+def write_enumeration_cache(URL, download_time, enums):
+    '''
+    (str, float, dict) -> None
+    
+    Writes the enumerations downloaded from the API at URL to disk. The file is
+    replaced atomically so that concurrent runs never read a partial file
+    
+    Parameters
+    ----------
+    - URL (str): URL of the API
+    - download_time (float): Time at which the enumerations were downloaded
+    - enums (dict): Dictionary with EGA enumerations as key and dictionary of metadata as value
+    '''
+    
+    cache_file = get_enumeration_cache_file(URL)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + '.{0}.tmp'.format(os.getpid())
+        newfile = open(tmp_file, 'w')
+        json.dump({'URL': format_url(URL), 'time': download_time, 'enumerations': enums}, newfile)
+        newfile.close()
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print('could not write enumerations to {0}: {1}'.format(cache_file, e))
+
+
+def list_enumerations(URL='https://ega-archive.org/submission-api/v1/', refresh=False):
+    '''
+    (str, bool) -> dict
     
-    Returns a dictionary with EGA enumerations as key and dictionary of metadata as value
+    Returns a dictionary with EGA enumerations as key and dictionary of metadata as value.
+    Enumerations are downloaded only if they are not cached in memory or on disk 
+    or if cached enumerations are older than enumeration_cache_ttl
     Precondition: the list of enumerations available from EGA is hard-coded
 
     Parameters
     ----------
     - URL (str): URL of the API. Default is 'https://ega-archive.org/submission-api/v1/'
+    - refresh (bool): Download the enumerations even if they are cached
     '''
     
     # build the URL    
     URL = format_url(URL)
-    URL = URL + 'enums/'
+    
+    # use enumerations cached in memory or on disk if not expired
+    if not refresh:
+        if URL not in enumeration_cache:
+            cached = read_enumeration_cache(URL)
+            if cached != None:
+                enumeration_cache[URL] = cached
+        if URL in enumeration_cache and time.time() - enumeration_cache[URL][0] < enumeration_cache_ttl:
+            return enumeration_cache[URL][1]
+    
     # list all enumerations available from EGA
     L = ['analysis_file_types', 'analysis_types', 'case_control', 'dataset_types', 'experiment_types',
          'file_types', 'genders', 'instrument_models', 'library_selections', 'library_sources',
          'library_strategies', 'reference_chromosomes', 'reference_genomes', 'study_types']
-    URLs = [os.path.join(URL, i) for i in L]
+    URLs = [os.path.join(URL + 'enums/', i) for i in L]
+    # download all enumerations at once
+    download_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(URLs)) as executor:
+        results = list(executor.map(download_enumeration, URLs))
+    
+    # keep previously cached enumerations if some enumerations could not be retrieved
+    if None in results and URL in enumeration_cache:
+        print('could not download all enumerations, using enumerations cached at {0}'.format(time.ctime(enumeration_cache[URL][0])))
+        return enumeration_cache[URL][1]
+    
     # create a dictionary to store each enumeration
     enums = {}
-    for URL in URLs:
-        # create a dict to store the enumeration data (value: tag}
-        d = {}
-        # retrieve the information for the given enumeration
-        response = requests.get(URL)
-        # check response code
-        if response.status_code == requests.codes.ok:
-            # loop over dict in list
-            for i in response.json()['response']['result']:
-                if 'instrument_models' in URL:
-                    if i['value'] == 'unspecified':
-                        # grab label instead of value
-                        assert i['label'] not in d
-                        d[i['label']] = i['tag']
-                    else:
-                        assert i['value'] not in d
-                        d[i['value']] = i['tag']
-                elif 'reference_chromosomes' in URL:
-                    # grab value : tag
-                    # group corresponds to tag in reference_genomes. currently, does not suppot patches
-                    # group = 15 --> tag = 15 in reference_genomes = GRCH37
-                    # group = 1 --> tag = 1 in reference_genomes = GRCH38
-                    if i['group'] in ['1', '15']:
-                        assert i['value'] not in d
-                        d[i['value']] = i['tag']
-                else:
-                    assert i['value'] not in d
-                    d[i['value']] = i['tag']
-        enums[os.path.basename(URL).title().replace('_', '')] = d
+    for i in range(len(URLs)):
+        enums[os.path.basename(URLs[i]).title().replace('_', '')] = {} if results[i] == None else results[i]
+    # cache enumerations only if all enumerations were retrieved
+    if None not in results:
+        enumeration_cache[URL] = (download_time, enums)
+        write_enumeration_cache(URL, download_time, enums)
     return enums
 
 
+def refresh_enumerations(URL):
+    '''
+    (str) -> None
+    
+    Downloads the EGA enumerations from the API at URL and replaces the cached enumerations
+    
+    Parameters
+    ----------
+    - URL (str): URL of the API
+    '''
+    
+    enums = list_enumerations(URL, True)
+    print('cached {0} enumerations from {1} in {2}'.format(len(enums), format_url(URL), get_enumeration_cache_file(URL)))
+
+
 def record_message(credential_file, database, table, box, alias, message, status):
     '''
     (str, str, str, str, str, str, str) -> None
@@ -484,7 +945,8 @@ def extract_accessions(credential_file, database, box, table):
     '''
     (file, str, str, str) -> dict
     
-    Returns a dictionary with alias: accessions pairs registered in box for the given object/Table
+    Returns a dictionary with alias: accessions pairs registered in box for the given object/Table.
+    The table is queried only once per run, the returned dictionary is shared and must not be modified
     
     Parameters
     ----------
@@ -494,18 +956,81 @@ def extract_accessions(credential_file, database, box, table):
     - table (str): Name of table in database
     '''
     
-    # connect to metadata database
-    conn = connect_to_database(credential_file, database)
-    cur = conn.cursor()
-    # pull down analysis alias and egaId from metadata db, alias should be unique
-    cur.execute('SELECT {0}.alias, {0}.egaAccessionId from {0} WHERE {0}.egaBox=\"{1}\"'.format(table, box)) 
-    # create a dict {alias: accession}
-    # some PCSI aliases are not unique, 1 sample is chosen arbitrarily
-    registered = {}
-    for i in cur:
-        registered[i[0]] = i[1]
-    conn.close()
-    return registered
+    key = (credential_file, database, box, table)
+    if key not in accession_index:
+        # connect to metadata database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        # pull down analysis alias and egaId from metadata db, alias should be unique
+        try:
+            cur.execute('SELECT {0}.alias, {0}.egaAccessionId from {0} WHERE {0}.egaBox=\"{1}\"'.format(table, box)) 
+        except:
+            conn.close()
+            raise
+        # create a dict {alias: accession}
+        # some PCSI aliases are not unique, 1 sample is chosen arbitrarily
+        registered = {}
+        for i in cur:
+            registered[i[0]] = i[1]
+        conn.close()
+        accession_index[key] = registered
+    return accession_index[key]
+
+
+def extract_box_accessions(credential_file, database, box):
+    '''
+    (str, str, str) -> set
+    
+    Returns the set of egaAccessionIds and accessions of dependencies (dacId, policyId)
+    of all tables in database for box. The tables are queried only once per run
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - box (str): EGA box (e.g. ega-box-xxx)
+    '''
+    
+    # accessions may be egaAccessionIds or may be accessions of dependencies
+    # eg. dac EGAC00001000010 is not in any egaAccessionId because it was registered in a different box
+    # but policy EGAP00001000077 depends on this dac. it can be retrieved in dacId of the policy table
+    key = (credential_file, database, box)
+    if key not in accession_sets:
+        ega_accessions = set()
+        # list all tables in EGA metadata db
+        tables = show_tables(credential_file, database)
+        # connect to metadata database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        # extract egaAccessions and Ids of dependencies for each table
+        for i in tables:
+            for j in ['egaAccessionId', 'dacId', 'policyId']:
+                try:
+                    cur.execute('SELECT {0}.{1} from {0} WHERE {0}.egaBox=\"{2}\"'.format(i, j, box)) 
+                    ega_accessions.update([k[0] for k in cur])
+                except:
+                    pass
+        conn.close()
+        accession_sets[key] = ega_accessions
+    return accession_sets[key]
+
+
+def clear_accession_index(database):
+    '''
+    (str) -> None
+    
+    Removes the accessions of database loaded during the current run so that
+    they are extracted again after the database is modified
+    
+    Parameters
+    ----------
+    - database (str): Name of the database
+    '''
+    
+    for key in [i for i in accession_index if i[1] == database]:
+        del accession_index[key]
+    for key in [i for i in accession_sets if i[1] == database]:
+        del accession_sets[key]
 
 
 def map_enumerations():
@@ -1253,1141 +1778,3064 @@ def add_json_to_table(credential_file, database, table, box, ega_object, **KeyWo
     conn.close()
 
 
-def get_job_exit_status(job_name):
+def set_executor(backend, workers=1):
     '''
-    (str) -> str
+    (str, int) -> None
     
-    Returns the exit code of a job named job_name after it finished running 
-    ('0' indicates a normal, error-free run and '1' or another value inicates an error)
+    Selects the backend running the encryption, upload and check jobs of the current run.
+    Jobs launched by the local backend inherit the backend through the environment
     
     Parameters
     ----------
-    - job_name (str): Name of the job run on cluster
+    - backend (str): Backend running the jobs. Accepted values: uge or local
+    - workers (int): Maximum number of jobs run at once by the local backend
     '''
     
-    # make a sorted list of accounting files with job info archives
-    archives = subprocess.check_output('ls -lt /oicr/cluster/uge-8.6/default/common/accounting*', shell=True).decode('utf-8').rstrip().split('\n')
-    # keep accounting files for the current year
-    archives = [archives[i].split()[-1] for i in range(len(archives)) if ':' in archives[i].split()[-2]]
+    executor['backend'] = backend
+    executor['workers'] = max(1, workers)
+    os.environ['GAEA_EXECUTOR'] = backend
+
+
+def run_local_job(job_name, command, logdir, hold_jobs):
+    '''
+    (str, str, str, list) -> int
     
-    # loop over the most recent archives and stop when job is found    
-    for accounting_file in archives:
-        try:
-            i = subprocess.check_output('qacct -j {0} -f {1}'.format(job_name, accounting_file), shell=True).decode('utf-8').rstrip().split('\n')
-        except:
-            i = ''
-        else:
-            if i != '':
-                break
-            
-    # check if accounting file with job has been found
-    if i == '':
-        # return error
-        return '1'        
-    else:
-        # record all exit status. the same job may have been run multiple times if re-encryption was needed
-        d = {}
-        for j in i:
-            if 'end_time' in j:
-                k = j.split()[1:]
-                if len(k) != 0:
-                    # convert date to epoch time
-                    if '.' in k[1]:
-                        k[1] = k[1][:k[1].index('.')]
-                    date = '.'.join([k[0].split('/')[1], k[0].split('/')[0], k[0].split('/')[-1]]) + ' ' + k[1]
-                    p = '%d.%m.%Y %H:%M:%S'
-                    date = int(time.mktime(time.strptime(date, p)))
-                else:
-                    date = 0
-            elif 'exit_status' in j:
-                d[date] = j.split()[1]
-        # get the exit status of the most recent job    
-        end_jobs = list(d.keys())
-        end_jobs.sort()
-        if len(d) != 0:
-            # return exit code
-            return d[end_jobs[-1]]
-        else:
-            # return error
-            return '1'
+    Runs command in its own process once all jobs in hold_jobs are done,
+    writes its logs in logdir and records its exit code. Returns the exit code of command
+    
+    Parameters
+    ----------
+    - job_name (str): Name of the job
+    - command (str): Shell command run by the job
+    - logdir (str): Directory where the job logs are written
+    - hold_jobs (list): List of futures of the jobs that must be done before running command
+    '''
+    
+    # jobs are submitted after the jobs they wait for and run in order of submission
+    concurrent.futures.wait(hold_jobs)
+    
+    # name logs as the UGE logs so that upload logs can be checked the same way
+    job_id = '{0}{1}'.format(int(time.time() * 1000), os.getpid())
+    os.makedirs(logdir, exist_ok=True)
+    with open(os.path.join(logdir, '{0}.o{1}'.format(job_name, job_id)), 'w') as out, open(os.path.join(logdir, '{0}.e{1}'.format(job_name, job_id)), 'w') as err:
+        exit_code = subprocess.call(command, shell=True, stdout=out, stderr=err)
     
+    # record the exit code for the check jobs running in other processes
+    os.makedirs(local_job_dir, exist_ok=True)
+    exit_file = os.path.join(local_job_dir, job_name + '.exit')
+    with open(exit_file + '.part', 'w') as newfile:
+        newfile.write(str(exit_code) + '\n')
+    os.replace(exit_file + '.part', exit_file)
+    return exit_code
 
-def get_subdirectories(user_name, password, directory, host):
+
+def submit_local_job(job_name, command, logdir, hold_jids=None):
     '''
-    (str, str, str, str) -> list
+    (str, str, str, list or None) -> int
     
-    Returns a list of sub-directories in directory in the box' staging server
+    Submits command to the pool of the local backend and returns 0 
     
     Parameters
     ----------
-    - user_name (str): EGA submission box
-    - password (str): Password for the EGA submission box
-    - directory (str): Directory on the box' staging server
-    - host (str): xfer host server
+    - job_name (str): Name of the job
+    - command (str): Shell command run by the job
+    - logdir (str): Directory where the job logs are written
+    - hold_jids (list or None): Names of the jobs or array jobs that must be done before running command
     '''
     
-    # make a list of directories on the staging servers
-    cmd = "ssh {0} \"lftp -u {1},{2} -e \\\" set ftp:ssl-allow false; ls {3} ; bye;\\\" ftp://ftp.ega.ebi.ac.uk\"".format(host, user_name, password, directory)
-    a = subprocess.check_output(cmd, shell=True).decode('utf-8').rstrip().split('\n')
-    content = [os.path.join(directory, i.split()[-1]) for i in a if i.startswith('d')]
-    return content
+    if local_pool['executor'] == None:
+        local_pool['executor'] = concurrent.futures.ThreadPoolExecutor(max_workers=executor['workers'])
+    
+    # remove the exit code of a previous run of the job
+    exit_file = os.path.join(local_job_dir, job_name + '.exit')
+    if os.path.isfile(exit_file):
+        os.remove(exit_file)
+    
+    # get the futures of the jobs to wait for, array jobs wait for all their tasks
+    hold_jobs = []
+    for i in hold_jids if hold_jids != None else []:
+        for j in local_arrays.get(i, [i]):
+            if j in local_jobs:
+                hold_jobs.append(local_jobs[j])
+    
+    local_jobs[job_name] = local_pool['executor'].submit(run_local_job, job_name, command, logdir, hold_jobs)
+    return 0
+
 
+def wait_local_jobs():
+    '''
+    (None) -> None
+    
+    Waits until all the jobs submitted to the local backend are done
+    '''
     
-def list_directories_staging_server(credential_file, box, host):
+    concurrent.futures.wait(list(local_jobs.values()))
+
+
+def submit_job(job_name, script, logdir, mem=None, hold_jids=None):
     '''
-    (str, str, host) -> list
+    (str, str, str, int or None, list or None) -> int
     
-    Returns a list of all directories on the staging server of the given box
+    Submits a job running the bash script to the backend of the current run
+    and returns the exit code of the submission
     
     Parameters
     ----------
-    - credential_file (str): File with EGA boxes and database credentials
-    - box (str): EGA submission box (ega-box-xxx)
-    - host (str): Xfer host server
+    - job_name (str): Name of the job
+    - script (str): Path to the bash script run by the job
+    - logdir (str): Directory where the job logs are written
+    - mem (int or None): Memory requirement of the job
+    - hold_jids (list or None): Names of the jobs that must be done before running the job
     '''
     
-    # get box credentials
-    credentials = extract_credentials(credential_file)
-    # exclude EGA-owned directories
-    exclude = ['MD5_daily_reports', 'metadata']
-    # make a list of directories on the staging server 
-    a = get_subdirectories(box, credentials[box], '', host)
-    # dump all sub-directories into the collecting list
-    # skip EGA-owned directories
-    b = [i for i in a if i not in exclude]
-    # add home directory
-    b.append('')
-    # make a list of directories already traversed
-    checked = ['']
-    # initialize list with list length so that first iteration always occurs
-    L = [0, len(b)]
-    while L[-1] != L[-2]:
-        for i in b:
-            # ignore if already checked and ignore EGA-owned directories
-            if i not in checked and i not in exclude:
-                b.extend(get_subdirectories(box, credentials[box], i, host))
-                checked.append(i)
-        # update L
-        L.append(len(b))
-    return b
-
-
-def extract_file_size_staging_server(credential_file, box, directory, host):
+    if executor['backend'] == 'local':
+        return submit_local_job(job_name, 'bash {0}'.format(script), logdir, hold_jids)
+    
+    options = ''
+    if hold_jids != None and len(hold_jids) != 0:
+        options += ' -hold_jid {0}'.format(','.join(hold_jids))
+    if mem != None:
+        options += ' -l h_vmem={0}g'.format(mem)
+    QsubCmd = "qsub -b y -P gsi{0} -N {1} -e {2} -o {2} \"bash {3}\"".format(options, job_name, logdir, script)
+    return subprocess.call(QsubCmd, shell=True)
+
+
+def connect_to_accounting_index():
     '''
-    (str, str, str, str) -> dict
+    (None) -> sqlite3.Connection
+    
+    Returns a connection to the local index of the UGE accounting files.
+    Creates the index tables if they don't already exist
+    '''
+    
+    os.makedirs(os.path.dirname(accounting_index), exist_ok=True)
+    conn = sqlite3.connect(accounting_index, timeout=60)
+    conn.execute('CREATE TABLE IF NOT EXISTS AccountingFiles (path TEXT PRIMARY KEY, offset INTEGER, mtime REAL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS Jobs (jobName TEXT, jobId INTEGER, taskId INTEGER, submissionTime INTEGER, \
+                 endTime INTEGER, failed TEXT, exitStatus TEXT, PRIMARY KEY (jobId, taskId, submissionTime))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobName ON Jobs (jobName)')
+    # times of UGE 8.x were indexed in milliseconds before being converted when parsed
+    if conn.execute('PRAGMA user_version').fetchall()[0][0] == 0:
+        conn.execute('UPDATE OR REPLACE Jobs SET submissionTime = submissionTime / 1000 WHERE submissionTime > 100000000000')
+        conn.execute('UPDATE Jobs SET endTime = endTime / 1000 WHERE endTime > 100000000000')
+        conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+    return conn
+
+
+def parse_accounting_line(line):
+    '''
+    (str) -> tuple or None
     
-    Returns a dictionary with file size for all files in directory
+    Returns a tuple with the job name, job id, task id, submission time, end time,
+    failed code and exit status of a job recorded in a line of a UGE accounting file, 
+    or None if the line is not a job record. Times are in seconds since epoch
     
     Parameters
     ----------
-    - credential_file (str): File with EGA box and database credentials
-    - box (str): EGA submission box (ega-box-xxxx)
-    - directory (str): Directory on the box' staging server
-    - host (str): Xfer host server
+    - line (str): Line of a UGE accounting file
     '''
     
-    # get credentials
-    credentials = extract_credentials(credential_file)
-        
-    cmd = "ssh {0} \"lftp -u {1},{2} -e \\\" set ftp:ssl-allow false; ls {3} ; bye;\\\" ftp://ftp.ega.ebi.ac.uk\"".format(host, box, credentials[box], directory)
-    a = subprocess.check_output(cmd, shell=True).decode('utf-8').rstrip().split('\n')
-    files = [i for i in a if i.startswith('-')]
-    # extract file size for all files {filepath: file_size}
-    size = {}
-    for S in files:
-        S = S.rstrip().split()
-        file_size = int(S[4])
-        file_path = directory + '/' + S[-1]
-        size[file_path] = file_size
-    return size
+    if line.startswith('#'):
+        return None
+    fields = line.rstrip('\n').split(':')
+    if len(fields) < 36:
+        return None
+    try:
+        # task number is 0 or undefined for jobs that are not array jobs
+        task_id = int(fields[35]) if fields[35].isdigit() else 0
+        # times are recorded in milliseconds by UGE 8.x
+        submission_time, end_time = [i // 1000 if i > 100000000000 else i for i in [int(fields[8]), int(fields[10])]]
+        return (fields[4], int(fields[5]), task_id, submission_time, end_time, fields[11].split()[0], fields[12])
+    except (ValueError, IndexError):
+        return None
 
 
-def map_files_to_checksum(credential_file, database, table, box):
-    '''    
-    (str, str, str, str) -> dict
+def update_accounting_index(build=False):
+    '''
+    (bool) -> bool
     
-    Returns a dictionary with file path, list of md5sums and accession ID key, value pairs
+    Adds the job records written to the UGE accounting files since the last update 
+    to the local index and returns True if the index is up to date. Only the new bytes
+    of the current accounting file are parsed and rotated archives are parsed once.
+    The index is created only if build is True
     
     Parameters
     ----------
-    - credential_file (str): File with EGA boxes and database credentials
-    - database (str): name of the database
-    - table (str): Table in database
-    - box (str): EGA submission box (eg. ega-box-xxxx)
+    - build (bool): Create the index from the accounting files if it doesn't exist
     '''
-   
-    # connect to db
-    conn = connect_to_database(credential_file, database)
-    cur = conn.cursor()
-    # extract alias, xml, accession number    
+    
+    # the index is built with the accounting_index command, not by the first lookup
+    if build == False and os.path.isfile(accounting_index) == False:
+        return False
+    
+    # index accounting files modified in the last 6 months
     try:
-       cur.execute('SELECT {0}.alias, {0}.xml, {0}.egaAccessionId FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(table, box))
-       data = cur.fetchall()
-    except:
-        data = []
+        archives = [os.path.join(accounting_dir, i) for i in os.listdir(accounting_dir) if i.startswith('accounting')]
+    except OSError:
+        archives = []
+    archives = [i for i in archives if time.time() - os.path.getmtime(i) < 183 * 86400]
+    
+    try:
+        conn = connect_to_accounting_index()
+    except sqlite3.Error as e:
+        print('could not open the accounting index: {0}'.format(e))
+        return False
+    try:
+        # lock the index while updating to avoid parsing the same bytes in concurrent checks
+        conn.execute('BEGIN IMMEDIATE')
+        index_accounting_files(conn, archives)
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        print('could not update the accounting index: {0}'.format(e))
+        conn.close()
+        return False
     conn.close()
-   
-    # create a dict {filepath: [[md5unc, md5enc, accession, alias]]}    
-    files = {}  
-    if len(data)!= 0:
-        for i in data:
-            # parse the xml, extract filenames and md5sums
-            alias = i[0]
-            tree = ET.ElementTree(ET.fromstring(i[1]))
-            accession = i[2]
-            j = tree.findall('.//FILE')
-            for i in range(len(j)):
-                filename = j[i].attrib['filename']
-                md5unc = j[i].attrib['unencrypted_checksum']
-                md5enc = j[i].attrib['checksum']
-                if filename in files:
-                    files[filename].append([md5unc, md5enc, alias, accession])
-                else:
-                    files[filename] = [[md5unc, md5enc, alias, accession]]
-    return files 
+    return True
 
 
-# use this function to get file size and metadata for all files on the staging server in a Specific box box
-def merge_file_info_staging_server(file_size, registered_files, box):
+def index_accounting_files(conn, archives):
     '''
-    (dict, dict, str) - > dict
+    (sqlite3.Connection, list) -> None
+    
+    Adds the job records written to the accounting files in archives since they
+    were last indexed. Indexed records are not committed
     
-    Returns a dictionary of file information that include file size and metadata
-    for the files on the box's staging server 
-        
     Parameters
     ----------
+    - conn (sqlite3.Connection): Connection to the accounting index
+    - archives (list): List of paths to the UGE accounting files
+    '''
     
-    - file_size (dict): Dictionary with file size for all files on the box's staging server
-    - registered_files (dict): Dictionary with registered files in the box 
-    - box (str): EGA submission box (ega-box-xxxx)
+    for accounting_file in archives:
+        data = conn.execute('SELECT offset, mtime FROM AccountingFiles WHERE path=?', (accounting_file,)).fetchall()
+        offset, mtime = (data[0][0], data[0][1]) if len(data) != 0 else (0, 0)
+        current_mtime = os.path.getmtime(accounting_file)
+        if accounting_file.endswith('.gz'):
+            # compressed archives do not grow, parse again only if replaced
+            if current_mtime == mtime:
+                continue
+            offset = 0
+            infile = gzip.open(accounting_file, 'rb')
+        else:
+            # start over if the accounting file was rotated
+            if os.path.getsize(accounting_file) < offset:
+                offset = 0
+            infile = open(accounting_file, 'rb')
+        with infile:
+            infile.seek(offset)
+            rows = []
+            for line in infile:
+                # keep incomplete lines still being written for the next update
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                record = parse_accounting_line(line.decode('utf-8', 'replace'))
+                if record != None:
+                    rows.append(record)
+                if len(rows) == 10000:
+                    conn.executemany('INSERT OR REPLACE INTO Jobs VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                    rows = []
+            conn.executemany('INSERT OR REPLACE INTO Jobs VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.execute('INSERT OR REPLACE INTO AccountingFiles VALUES (?, ?, ?)', (accounting_file, offset, current_mtime))
+
+
+def parse_qacct_time(date):
+    '''
+    (str) -> int
+    
+    Returns the epoch time of a date reported by qacct, or 0 if the date is not defined
+    
+    Parameters
+    ----------
+    - date (str): Date reported by qacct (e.g. 03/12/2024 10:11:12.123)
+    '''
+    
+    try:
+        return int(time.mktime(time.strptime(date.split('.')[0].strip(), '%m/%d/%Y %H:%M:%S')))
+    except ValueError:
+        return 0
+
+
+def get_qacct_exit_statuses(jobs, missing='1', since=0):
+    '''
+    (list, str or None, int) -> dict
+    
+    Returns a dictionary with the exit code of the most recent run of each job
+    in jobs found with qacct in the current accounting file. Used when the
+    accounting index is not available. qacct does not read the rotated accounting
+    files, jobs recorded only in rotated files are reported with the missing code
+    
+    Parameters
+    ----------
+    - jobs (list): List of (job name, task id) tuples. Task id is None if the job is not an array job
+    - missing (str or None): Exit code of the jobs that are not found
+    - since (int): Ignore the runs submitted before this time (in seconds since epoch)
     '''
     
     D = {}
-    for file_path in file_size:
-        # get the name of the file. check if file on the root on the staging server
-        if os.path.basename(file_path) == '':
-            file_name = file_path
-        else:
-            file_name = os.path.basename(file_path)
-        # check if file is md5
-        if file_path[-4:] == '.md5':
-            name = file_path[:-4]
-        else:
-            name = file_path
-        # add filename, size and initialize empty lists to store alias and accessions
-        if file_path not in D:
-            D[file_path] = [file_path, file_name, str(file_size[file_path]), [], [], box]
-        # check if file is registered
-        # file may or may not have .gpg extension in RegisteredFiles
-        # .gpg present upon registration but subsenquently removed from file name
-        # add aliases and acessions
-        if name in registered_files:
-            for i in range(len(registered_files[name])):
-                D[file_path][3].append(registered_files[name][i][-2])
-                D[file_path][4].append(registered_files[name][i][-1])
-        elif name[-4:] == '.gpg' and name[:-4] in registered_files:
-            for i in range(len(registered_files[name[:-4]])):
-                D[file_path][3].append(registered_files[name[:-4]][i][-2])
-                D[file_path][4].append(registered_files[name[:-4]][i][-1])
-        elif name[-4:] != '.gpg' and name + '.gpg' in registered_files:
-            for i in range(len(registered_files[name + '.gpg'])):
-                D[file_path][3].append(registered_files[name + '.gpg'][i][-2])
-                D[file_path][4].append(registered_files[name + '.gpg'][i][-1])
-        else:
-            D[file_path][3].append('NULL')
-            D[file_path][4].append('NULL')
-        # convert lists to strings
-        # check if multiple aliases and accessions exist for that file
-        if len(D[file_path][3]) > 1:
-            D[file_path][3] = ';'.join(D[file_path][3])
-        else:
-            D[file_path][3] = D[file_path][3][0]
-        if len(D[file_path][4]) > 1:
-            D[file_path][4]= ';'.join(D[file_path][4])
-        else:
-            D[file_path][4] = D[file_path][4][0]
+    for job_name, task_id in jobs:
+        D[(job_name, task_id)] = missing
+        # restrict accounting to the task of an array job
+        task = '' if task_id == None else ' -t {0}'.format(task_id)
+        try:
+            output = subprocess.check_output('qacct -j {0}{1}'.format(job_name, task), shell=True, stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+        except subprocess.CalledProcessError:
+            continue
+        # each run of the job is reported in a block of lines
+        runs = []
+        for block in re.split(r'\n=+\n', '\n' + output):
+            record = {}
+            for line in block.split('\n'):
+                if line.strip() != '':
+                    key = line.split()[0]
+                    record[key] = line[len(key):].strip()
+            if 'exit_status' in record and parse_qacct_time(record.get('qsub_time', '')) >= since:
+                runs.append((parse_qacct_time(record.get('end_time', '')), record.get('failed', '0').split()[0], record['exit_status'].split()[0]))
+        if len(runs) != 0:
+            # keep the status of the most recent run, the same job may run multiple times
+            end_time, failed, exit_status = sorted(runs)[-1]
+            # a job failing before or after running may have a 0 exit status
+            D[(job_name, task_id)] = failed if failed != '0' and exit_status == '0' else exit_status
     return D
 
 
-def add_file_info_staging_server(credential_file, metadata_database, submission_database, analysis_table, runs_table, staging_server_table, box, host):
+def get_job_exit_statuses(jobs, missing='1', since=0):
     '''
-    (str, str, str, str, str, str, str, str) -> None
+    (list, str or None, int) -> dict
     
-    Populates table StagingServerTable in the submission database with file information
-    including size and accession IDs for files on the box's staging server
-        
-    Paramaters
+    Returns a dictionary with the exit code of the most recent run of each job
+    in jobs, looked up in the local index of the UGE accounting files updated once
+    ('0' indicates a normal, error-free run and '1' or another value inicates an error).
+    Exit codes of the jobs run by the local backend are read from their records
+    
+    Parameters
     ----------
-    - credential_file (str): File with EGA box and database credentials 
-    - metadata_database (str): Database storing metadata information about registered EGA objects
-    - submission_database (str): Database storing required information for registration of EGA objects
-    - analysis_table (str): Table storing analysis information
-    - runs_table (str): Table storing run information 
-    - staging_server_table (str): Table storing file information on the EGA staging server
-    - box (str): EGA submission box (ega-box-xxx)
-    - host (str): Xfer host server
+    - jobs (list): List of (job name, task id) tuples. Task id is None if the job is not an array job
+    - missing (str or None): Exit code of the jobs that are not found
+    - since (int): Ignore the runs submitted before this time (in seconds since epoch)
     '''
     
-    # list all directories on the staging server of box
-    directories = list_directories_staging_server(credential_file, box, host)
-    # Extract file size for all files on the staging server
-    file_size = [extract_file_size_staging_server(credential_file, box, i, host) for i in directories]
-    # Extract md5sums and accessions from the metadata database
-    registered_analyses = map_files_to_checksum(credential_file, metadata_database, analysis_table, box)
-    registered_runs = map_files_to_checksum(credential_file, metadata_database, runs_table, box)
-        
-    # merge registered files for each box
-    registered = {}
-    for filename in registered_analyses:
-        registered[filename] = registered_analyses[filename]
-        if filename in registered_runs:
-            registered[filename].append(registered_runs[filename])
-    for filename in registered_runs:
-        if filename not in registered:
-            registered[filename] = registered_runs[filename]
-                    
-    # cross-reference dictionaries and get aliases and accessions for files on staging servers if registered
-    data = [merge_file_info_staging_server(D, registered, box) for D in file_size]
-                
-    # format colums with datatype and convert to string
-    fields = ["file", "filename", "fileSize", "alias", "egaAccessionId", "egaBox"]
-    columns = ' '.join([fields[i] + ' TEXT NULL,' if i != len(fields) -1 else fields[i] + ' TEXT NULL' for i in range(len(fields))])
-    # create a string with column headers
-    column_names = ', '.join(fields)
-
-    # create table if table doesn't exist
-    tables = show_tables(credential_file, submission_database)
-    if staging_server_table not in tables:
-        # connect to submission database
-        conn = connect_to_database(credential_file, submission_database)
-        cur = conn.cursor()
-        # format colums with datatype and convert to string
-        cur.execute('CREATE TABLE {0} ({1})'.format(staging_server_table, columns))
-        conn.commit()
+    D = {}
+    
+    # exit codes of the local jobs are recorded by the jobs
+    if executor['backend'] == 'local':
+        for job_name, task_id in jobs:
+            D[(job_name, task_id)] = missing
+            exit_file = os.path.join(local_job_dir, job_name + '.exit')
+            if os.path.isfile(exit_file) and os.path.getmtime(exit_file) >= since:
+                with open(exit_file) as infile:
+                    D[(job_name, task_id)] = infile.read().strip()
+        return D
+    
+    # look up the jobs with qacct if the index cannot be used
+    # runs recorded only in rotated accounting files are not found by qacct
+    if update_accounting_index() == False:
+        return get_qacct_exit_statuses(jobs, missing, since)
+    
+    # get the records of all jobs at once
+    job_names = list(set([i[0] for i in jobs]))
+    records = {}
+    try:
+        conn = connect_to_accounting_index()
+        records = query_accounting_index(conn, job_names, since)
         conn.close()
+    except sqlite3.OperationalError as e:
+        print('could not read the accounting index: {0}'.format(e))
+        return get_qacct_exit_statuses(jobs, missing, since)
     
-    # connect to submission database
-    conn = connect_to_database(credential_file, submission_database)
-    cur = conn.cursor()
-    # drop all entries for that Box
-    cur.execute('DELETE FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(staging_server_table, box))
-    conn.commit()
-        
-    # loop over dicts
-    for i in range(len(data)):
-        # list values according to the table column order
-        for filename in data[i]:
-            # convert data to strings, converting missing values to NULL
-            values =  format_data(data[i][filename])
-            cur.execute('INSERT INTO {0} ({1}) VALUES {2}'.format(staging_server_table, column_names, values))
-            conn.commit()
-    conn.close()            
+    for job in jobs:
+        # return error if the job is not found
+        D[job] = records.get(job, missing)
+    return D
 
 
-def add_footprint_data(credential_file, submission_database, staging_server_table, footprint_table, box):
+def query_accounting_index(conn, job_names, since=0):
     '''
-    (str, str, str, str, str) -> None
-    Use credentials to connect to SubDatabase, extract file information from
-    StagingServerTable for given Box and collapse it per directory in FootPrintTable
+    (sqlite3.Connection, list, int) -> dict
+    
+    Returns a dictionary with the exit status of the most recent run of each
+    (job name, task id) and (job name, None) found in the accounting index
     
     Parameters
     ----------
-    - credential_file (str): File with EGA boxes and database credentials
-    - submission_database (str): Name of the database storing information required for registing EGA objects
-    - staging_server_table (str): Table in the submission database storing information about files located on the EGA's staging server
-    - footprint_table (str): Table in the submission database storing foot print on each of the boxes' staging servers
-    - box (str): EGA submission box (ega-box-xxx)
+    - conn (sqlite3.Connection): Connection to the accounting index
+    - job_names (list): List of job names
+    - since (int): Ignore the runs submitted before this time (in seconds since epoch)
     '''
     
-    # connect to submission database
-    conn = connect_to_database(credential_file, submission_database)
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT * FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(staging_server_table, box))
-        data = cur.fetchall()
-    except:
-        data = []
-    conn.close()
-        
-    size = {}
-    if len(data) != 0:
-        for i in data:
-            filesize = int(i[2])
-            filename = i[0]
-            directory = os.path.dirname(filename)
-            box = i[-1]
-            if directory == '':
-                directory = '/'
-            if i[4] not in ['NULL', '', None]:
-                registered = True
-            else:
-                registered = False
-            if box not in size:
-                size[box] = {}
-            if directory not in size[box]:
-                size[box][directory] = [directory, 1, 0, 0, filesize, 0, 0]
-            else:
-                size[box][directory][4] += filesize
-                size[box][directory][1] += 1
-            if registered  == True:
-                size[box][directory][2] += 1
-                size[box][directory][5] += filesize
-            else:
-                 size[box][directory][3] += 1
-                 size[box][directory][6] += filesize
-        
-        # compute size for all files per box
-        for i in data:
-            box = i[-1]
-            size[box]['All'] = ['All', 0, 0, 0, 0, 0, 0]
-        for box in size:
-            for directory in size[box]:
-                if directory != 'All':
-                    cumulative = [x + y for x, y in list(zip(size[box]['All'], size[box][directory]))]
-                    size[box]['All'] = cumulative
-            # correct directory value
-            size[box]['All'][0] = 'All'
-        
-        # list all tables in EGA metadata db
-        tables = show_tables(credential_file, submission_database)
+    records = {}
+    for i in range(0, len(job_names), 500):
+        chunk = job_names[i: i + 500]
+        data = conn.execute('SELECT jobName, taskId, failed, exitStatus FROM Jobs WHERE jobName IN ({0}) \
+                            AND submissionTime >= ? ORDER BY endTime'.format(', '.join(['?'] * len(chunk))), chunk + [since]).fetchall()
+        for job_name, task_id, failed, exit_status in data:
+            # a job failing before or after running may have a 0 exit status
+            if failed != '0' and exit_status == '0':
+                exit_status = failed
+            # keep the status of the most recent run, the same job may run multiple times
+            records[(job_name, task_id)] = exit_status
+            records[(job_name, None)] = exit_status
+    return records
 
-        # connect to submission database
-        conn = connect_to_database(credential_file, submission_database)
-        cur = conn.cursor()
-  
-        # create table if doesn't exist        
-        if footprint_table not in tables:
-            fields = ["egaBox", "location", "AllFiles", "Registered", "NotRegistered", "Size", "SizeRegistered", "SizeNotRegistered"]
-            # format colums with datatype - convert to string
-            columns = ' '.join([fields[i] + ' TEXT NULL,' if i != len(fields) -1 else fields[i] + ' TEXT NULL' for i in range(len(fields))])
-            # create table with column headers
-            cur.execute('CREATE TABLE {0} ({1})'.format(footprint_table, columns))
-            conn.commit()
-        else:
-            # get the column headers from the table
-            cur.execute("SELECT * FROM {0}".format(footprint_table))
-            fields = [i[0] for i in cur.description]
-            
-        # create a string with column headers
-        column_names = ', '.join(fields)
-        # drop all entries for that Box
-        cur.execute('DELETE FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(footprint_table, box))
-        conn.commit()
-    
-        # loop over data in boxes
-        for box in size:
-            # loop over directory in each box
-            for directory in size[box]:
-                # add box to list of data
-                L = [box]
-                L.extend(size[box][directory])
-                # list values according to the table column order
-                # convert data to strings, converting missing values to NULL
-                values =  format_data(list(map(lambda x: str(x), L)))
-                cur.execute('INSERT INTO {0} ({1}) VALUES {2}'.format(footprint_table, column_names, values))
-                conn.commit()
-        conn.close()            
-                
 
-def get_disk_space_staging_server(credential_file, database, footprint_table, box):
+def get_queued_job_names():
     '''
-    (str, str, str, str) -> float
+    (None) -> set or None
     
-    Returns the footprint of non-registered files on the staging server of a given box (in Tb)
-        
-    Parameters
-    ----------
-    - credential_file (str): File with EGA box and database credentials
-    - database (str): Database storing information for registration of EGA objects
-    - footprint_table (str): Table in database storing information about files on the box' staging server 
-    - box (str): EGA submission box (ega-box-xxx)
+    Returns the set of names of the jobs of the current user queued or running,
+    or None if the jobs cannot be listed
     '''
     
-    # connect to database
-    conn = connect_to_database(credential_file, database)
-    cur = conn.cursor()
+    if executor['backend'] == 'local':
+        return set([i for i in local_jobs if not local_jobs[i].done()])
     
-    # make a list of boxes in foorptint table
-    cur.execute('SELECT {0}.egaBox FROM {0}'.format(footprint_table))
-    boxes = list(set([i[0] for i in cur]))
-    # if Box not in Boxes, footprint is 0
-    if box not in boxes:
-        return 0
-      
     try:
-        # extract files for alias in upload mode for given box
-        cur.execute('SELECT {0}.SizeNotRegistered from {0} WHERE {0}.location=\"All\" AND {0}.egaBox=\"{1}\"'.format(footprint_table, box))
-        # check that some alias are in upload mode
-        data = int(cur.fetchall()[0][0]) / (10**12)
-    except:
-        data = -1
-    # close connection
-    conn.close()
-    return data
+        output = subprocess.check_output('qstat -r', shell=True, stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+    except subprocess.CalledProcessError:
+        return None
+    # job names are truncated in the job list but not in the requested resources
+    return set([i.split(':', 1)[1].strip() for i in output.split('\n') if i.strip().startswith('Full jobname:')])
 
 
-def add_accessions(credential_file, metadata_db, submission_db, table, associated_table, column_name, prefix, update_status, box):
+def get_job_exit_status(job_name, task_id=None):
     '''
-    (str, str, str, str, str, str, str, bool, str) -> None
+    (str, int or None) -> str
     
-    Update table in the submission database with the accessions of dependent 
-    objects in the associate table using prefix and column name.
-    Update status --> ready if no error and UpdateStatus is True
+    Returns the exit code of a job named job_name after it finished running 
+    ('0' indicates a normal, error-free run and '1' or another value inicates an error)
     
-    Paramaters
+    Parameters
     ----------
-    - credential_file (str): File with EGA boxes and database credentials
-    - metadata_db (str): Database storing metadata information
-    - submission_db (str): Database storing submission information 
-    - table (str): Name of table in submission_db
-    - associated_table (str): Table with information on dependent objects
-    - column_name (str): Column name in table 
-    - prefix (str): Expected prefix of EGA accession Id (eg EGAN, EGAS)
-    - update_status (bool): Update alias status if True and no error is found
-    - box (str): EGA submssion box (ega-box-xxxx)
+    - job_name (str): Name of the job run on cluster
+    - task_id (int or None): Task id of an array job
     '''
     
-    # grab EGA accessions from metadata database, create a dict {alias: accession}
-    registered = extract_accessions(credential_file, metadata_db, box, associated_table)
-           
-    # connect to the submission database
-    conn = connect_to_database(credential_file, submission_db)
-    cur = conn.cursor()
-    # pull alias, dependent Ids for given box
-    Cmd = 'SELECT {0}.alias, {0}.{1} FROM {0} WHERE {0}.Status=\"clean\" AND {0}.egaBox=\"{2}\"'.format(table, column_name, box)
-    
-    try:
-        cur.execute(Cmd)
-        data = cur.fetchall()
-    except:
-        data = []
-    
-    # create a dict {alias: [accessions, ErrorMessage]}
-    dependent = {}
-    # check if alias are in start status
-    if len(data) != 0:
-        for i in data:
-            # make a list of dependent Alias
-            alias = i[1].split(';')
-            # make a list of dependent accessions
-            accessions = []
-            for j in alias:
-                if j.startswith(prefix):
-                    accessions.append(j)
-                elif j in registered:
-                    accessions.append(registered[j])
-            # record error if aliases have missing accessions
-            # alias may be in medata table but accession may be NULL if EGA Id is not yet available
-            if len(alias) != len(accessions) or 'NULL' in accessions:
-                error = 'Accessions not available'
-            else:
-                error = ''
-            dependent[i[0]] =  [';'.join(accessions), error]
-            
-        if len(dependent) != 0:
-            for alias in dependent:
-                error = dependent[alias][-1]
-                if error == '':
-                    # update accessions
-                    cur.execute('UPDATE {0} SET {0}.{1}=\"{2}\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{3}\" AND {0}.egaBox=\"{4}\"'.format(table, column_name, dependent[alias][0], alias, box)) 
-                else:
-                    # record error message
-                    cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
-                conn.commit()
-                
-                # check if status can be updated
-                if update_status == True and error == '':
-                    # update runs and experiments status only if studyId and sampleId are present
-                    if table in ['Experiments', 'Runs']:
-                        # make a list of sampleId
-                        try:
-                            cur.execute('SELECT {0}.sampleId FROM {0} WHERE {0}.egaBox=\"{1}\" AND {0}.alias=\"{2}\"'.format(table, box, alias))
-                            samples = cur.fetchall()[0][0].split(';')
-                        except:
-                            samples = []
-                        if len(samples) != 0:
-                            # check if all samples have accession Ids 
-                            has_accessions = list(set(list(map(lambda x:x.startswith("EGAN"), samples))))
-                            if len(has_accessions) == 1 and has_accessions[0] == True:
-                                # update satus start --> ready
-                                cur.execute('UPDATE {0} SET {0}.Status=\"ready\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box)) 
-                                conn.commit()
-                    else:
-                        # update satus start --> ready
-                        cur.execute('UPDATE {0} SET {0}.Status=\"ready\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box)) 
-                        conn.commit()
-    conn.close()    
+    return get_job_exit_statuses([(job_name, task_id)])[(job_name, task_id)]
 
-    
-def add_studyId_analyses_project(credential_file, metadata_database, submission_database, analysis_table, project_table, studies_table, box):
+
+
+def create_array_tasks_table(credential_file, database):
     '''
-    (str, str, str, str, str, str, str) -> None
-       
-    Updates column studyId in AnalysesProject table with the study EGA accession if alias is present
+    (str, str) -> None
+    
+    Creates the ArrayTasks table mapping the name of each task to the array job
+    and task id used to run it if it doesn't already exist
     
     Parameters
     ----------
-    - credential_file (str): File with EGA boxes and database credentials
-    - metadata_database (str): Name of the database storing metadata information
-    - submission_database (str): Name of the database storing information required for registering EGA objects
-    - analysis_table (str): Name of the table storing analyses information
-    - project_table (str): Name of the table storing project information
-    - studies_table (str): name of the table storing studies information
-    - box (str): EGA submission box (eg. ega-box-xxxx)
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
     '''
     
-    # grab EGA accessions from metadata database, create a dict {alias: accession}
-    registered = extract_accessions(credential_file, metadata_database, box, studies_table)
-    # connect to the submission database
-    conn = connect_to_database(credential_file, submission_database)
+    # connect to database
+    conn = connect_to_database(credential_file, database)
     cur = conn.cursor()
-    # pull alias, dependent Ids for given box
-    Cmd = 'SELECT {0}.alias, {0}.studyId FROM {0} JOIN {1} WHERE {1}.ProjectKey={0}.alias AND {1}.egaBox=\"{2}\"'.format(project_table, analysis_table, box)
-        
-    try:
-        cur.execute(Cmd)
-        data = cur.fetchall()
-    except:
-        data = []
-    
-    # update studyId in project 
-    data = list(set(data))
-    # make a new list with [(alias: studyId)]
-    accessions = []
-    for i in data:
-        if not i[1].startswith('EGAS'):
-            if i[1] in registered:
-                accessions.append([i[0], registered[i[1]]])
-    if len(accessions) != 0:
-        for i in accessions:
-            with conn.cursor() as cur:
-                cur.execute('UPDATE {0} SET {0}.studyId=\"{1}\" WHERE {0}.alias=\"{2}\"'.format(project_table, i[1], i[0])) 
-                conn.commit()
-    conn.close()    
-    
+    cur.execute('CREATE TABLE IF NOT EXISTS ArrayTasks (taskName VARCHAR(512), jobName VARCHAR(128), \
+                taskId INT, submitTime BIGINT, PRIMARY KEY (taskName, jobName))')
+    conn.commit()
+    conn.close()
 
-def check_ega_accession_id(credential_file, submission_database, metadata_database, ega_object, table, box):
+
+def record_array_tasks(credential_file, database, job_name, task_names):
     '''
-    (str, str, str, str, str, str) -> None
+    (str, str, str, list) -> None
     
-    Check that all dependent EGA accessions of an EGA object are available in
-    the metadata database. Updates status of all aliases in table of the submission
-    database for the given box or keep the same status if accessions are not available
+    Records the task id of each task of array job job_name in the ArrayTasks table
     
     Parameters
     ----------
-    - credential_file (str): File with EGA box and database credentials
-    - submission_database (str): Name of the metadata sotring information required for submission
-    - metata_database (str): Name of the database storing metadata information
-    - ega_object (str): Registered object at the EGA. Accepted values:
-                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
-    - table (str): Name of table in submission and metadata databases
-    - box (str): EGA submission box (ega-box-xxx)
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - job_name (str): Name of the array job
+    - task_names (list): List of task names, in the order of the task ids
     '''
     
-    # collect all egaAccessionIds for all tables in EGA metadata db
-    # accessions may be egaAccessionIds or may be accessions of dependencies
-    # eg. dac EGAC00001000010 is not in any egaAccessionId because it was registered in a different box
-    # but policy EGAP00001000077 depends on this dac. it can be retrieved in dacId of the policy table
+    create_array_tasks_table(credential_file, database)
+    submit_time = int(time.time())
+    rows = [(task_names[i], job_name, i + 1, submit_time) for i in range(len(task_names))]
     
-    ega_accessions = []
-    # list all tables in EGA metadata db
-    tables = show_tables(credential_file, metadata_database)
-    # extract accessions for each table
-    for i in tables:
-        # connect to metadata database
-        conn = connect_to_database(credential_file, metadata_database)
-        cur = conn.cursor()
-        # extract egaAccessions and Ids of dependencies
-        for j in ['egaAccessionId', 'dacId', 'policyId']:
-            try:
-                cur.execute('SELECT {0}.{1} from {0} WHERE {0}.egaBox=\"{2}\"'.format(i, j, box)) 
-                data = [i[0] for i in cur]   
-            except:
-                data = []
-            # dump egaAccessions for that table to master list
-            ega_accessions.extend(data)
-        conn.close()
-        
-    # connect to the submission database
-    conn = connect_to_database(credential_file, submission_database)
+    # connect to database
+    conn = connect_to_database(credential_file, database)
     cur = conn.cursor()
-    # pull alias and egaAccessionIds to be verified
-    if ega_object == 'analyses':
-        Cmd = 'SELECT {0}.alias, {0}.sampleReferences FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
-    elif ega_object == 'experiments':
-        Cmd = 'SELECT {0}.alias, {0}.sampleId, {0}.studyId FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
-    elif ega_object == 'datasets':
-        Cmd = 'SELECT {0}.alias, {0}.runsReferences, {0}.analysisReferences, {0}.policyId FROM {0} WHERE {0}.Status=\"clean\" AND {0}.egaBox=\"{1}\"'.format(table, box)
-    elif ega_object == 'policies':
-        Cmd = 'SELECT {0}.alias, {0}.dacId FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
-    elif ega_object == 'runs':
-        Cmd = 'SELECT {0}.alias, {0}.sampleId, {0}.experimentId FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
-    
-    try:
-        cur.execute(Cmd)
-        data = cur.fetchall()
-    except:
-        data = []
-       
-    # create a dict to collect all accessions to be verified for a given alias
-    verify = {}
-    # check if alias are in start status
-    if len(data) != 0:
-        for i in data:
-            # get alias
-            alias = i[0]
-            # make a list with all other accessions
-            accessions = []
-            for j in range(1, len(i)):
-                accessions.extend(list(map(lambda x: x.strip(), i[j].split(';'))))
-            # remove NULL from list when only analysis or runs are included in the dataset 
-            while 'NULL' in accessions:
-                accessions.remove('NULL')
-            verify[alias] = accessions
-        
-        if len(verify) != 0:
-            # check if all accessions are readily available from metadata db
-            for alias in verify:
-                # make a list with accession membership
-                if False in [i in ega_accessions for i in verify[alias]]:
-                    error = 'EGA accession(s) not available as metadata' 
-                    # record error and keep status unchanged
-                    cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
-                    conn.commit()
-                else:
-                    error = 'NoError'
-                    # set error to NoError and update status 
-                    cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\", {0}.Status=\"valid\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
-                    conn.commit()
-    conn.close()    
+    insert_rows(cur, 'ArrayTasks', ['taskName', 'jobName', 'taskId', 'submitTime'], rows, 1000, True)
+    conn.commit()
+    conn.close()
 
 
-def encrypt_and_checksum(credential_file, database, table, box, alias, ega_object, file_paths, file_names, key_ring, outdir, mem):
+def resolve_array_tasks(credential_file, database, job_names):
     '''
-    (str, str, str, str, str, str, list, list, str, str, int) -> list
+    (str, str, list) -> dict
     
-    Launch jobs to encrypt files under alias and returns a list job exit codes specifying
-    if the jobs were launched successfully or not
+    Returns a dictionary with the (job name, task id) of each job in job_names. 
+    Job names run as tasks of an array job are resolved to the most recent
+    array job and task id, task id is None for other jobs
     
     Parameters
     ----------
-    - credential_file (str): File with EGA boxes and database credentials
-    - database (str): Database storing information required for registration of EGA objects
-    - table (str): Table in database storing information about the files to encrypt
-    - box (str): EGA submission box (ega-box-xxx)
-    - alias (str): Unique identifier of the files in Table
-    - ega_object (str): Registered object at the EGA. Accepted values:
-                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
-    - file_paths (list): List of file paths for the given alias
-    - file_names (list): List of file names used for registration of files under alias 
-                         (ie. file names may be different than the file paths basenames)
-    - key_ring (str): Path to the key used for encryption
-    - outdir (str): Directory in which the encrypted files are written
-    - mem (int): Job memory requirement
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - job_names (list): List of names of the jobs or array tasks run on cluster
     '''
+    
+    # tasks run by the local backend are recorded under their own name
+    jobs = {job_name: (job_name, None) for job_name in job_names}
+    if executor['backend'] != 'local' and len(job_names) != 0:
+        # connect to database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT ArrayTasks.taskName, ArrayTasks.jobName, ArrayTasks.taskId FROM ArrayTasks WHERE ArrayTasks.taskName IN ({0}) ORDER BY ArrayTasks.submitTime'.format(', '.join(['%s'] * len(job_names))), list(job_names))
+            data = cur.fetchall()
+        except:
+            data = []
+        conn.close()
+        # keep the most recent array job of each task
+        for task_name, job_name, task_id in data:
+            jobs[task_name] = (job_name, task_id)
+    return jobs
+
 
-    MyCmd1 = 'md5sum {0} | cut -f1 -d \' \' > {1}.md5'
-    MyCmd2 = 'gpg --no-default-keyring --keyring {2} -r EGA_Public_key -r SeqProdBio --trust-model always -o {1}.gpg -e {0}'
-    MyCmd3 = 'md5sum {0}.gpg | cut -f1 -d \' \' > {0}.gpg.md5'
+def get_task_exit_statuses(credential_file, database, job_names, missing='1', since=0):
+    '''
+    (str, str, list, str or None, int) -> dict
     
-    # check that lists of file paths and names have the same number of entries
-    if len(file_paths) != len(file_names):
-        return [-1]
-    else:
-        # make a list to store the job names and job exit codes
-        job_exits, job_names = [], []
-        # loop over files for that alias      
-        for i in range(len(file_paths)):
-            # check that FileName is valid
-            if os.path.isfile(file_paths[i]) == False:
-                # return error that will be caught if file doesn't exist
-                return [-1] 
-            else:
-                # check if OutDir exist
-                if os.path.isdir(outdir) == False:
-                    return [-1] 
-                else:
-                    # make a directory to save the scripts
-                    qsubdir = os.path.join(outdir, 'qsubs')
-                    os.makedirs(qsubdir, exist_ok=True)
-                    # create a log dir
-                    logdir = os.path.join(qsubdir, 'log')
-                    os.makedirs(logdir, exist_ok=True)
-                    # get name of output file
-                    outfile = os.path.join(outdir, file_names[i])
-                    # put commands in shell script
-                    BashScript1 = os.path.join(qsubdir, alias + '_' + file_names[i] + '_md5sum_original.sh')
-                    BashScript2 = os.path.join(qsubdir, alias + '_' + file_names[i] + '_encrypt.sh')
-                    BashScript3 = os.path.join(qsubdir, alias + '_' + file_names[i] + '_md5sum_encrypted.sh')
-            
-                    with open(BashScript1, 'w') as newfile:
-                        newfile.write(MyCmd1.format(file_paths[i], outfile) + '\n')
-                    with open(BashScript2, 'w') as newfile:
-                        newfile.write(MyCmd2.format(file_paths[i], outfile, key_ring) + '\n')
-                    with open(BashScript3, 'w') as newfile:
-                        newfile.write(MyCmd3.format(outfile) + '\n')
+    Returns a dictionary with the exit code of each job in job_names after it finished
+    running. Job names run as tasks of an array job are resolved to the most recent
+    array job and task id. All jobs are looked up at once
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - job_names (list): List of names of the jobs or array tasks run on cluster
+    - missing (str or None): Exit code of the jobs that are not found
+    - since (int): Ignore the runs submitted before this time (in seconds since epoch)
+    '''
+    
+    jobs = resolve_array_tasks(credential_file, database, job_names)
+    statuses = get_job_exit_statuses(list(set(jobs.values())), missing, since)
+    return {job_name: statuses[jobs[job_name]] for job_name in job_names}
+
+
+def add_batch_task(batch, stage, task_name, logdir, command):
+    '''
+    (dict, str, str, str, str) -> None
+    
+    Adds a task running command to the stage of batch 
+    
+    Parameters
+    ----------
+    - batch (dict): Dictionary with the list of tasks of each stage
+    - stage (str): Stage of the batch, submitted as a single array job
+    - task_name (str): Name of the task, used as job name for the task logs and exit status
+    - logdir (str): Directory where the task logs are written
+    - command (str): Command run by the task
+    '''
+    
+    if stage not in batch:
+        batch[stage] = []
+    batch[stage].append((task_name, logdir, command))
+
+
+def submit_array_job(credential_file, database, job_name, tasks, qsubdir, mem, hold_jid='', max_running=0):
+    '''
+    (str, str, str, list, str, int, str, int) -> int
+    
+    Submits tasks as a single array job driven by a manifest file with one
+    task per line and returns the exit code of qsub. Each task writes its logs
+    as if it was submitted as a job named after the task
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database storing the task ids of the array jobs
+    - job_name (str): Name of the array job
+    - tasks (list): List of (task name, log directory, command) tuples
+    - qsubdir (str): Directory where the manifest and the array job script are written
+    - mem (int): Memory requirement of each task
+    - hold_jid (str): Name of the job that the array job waits for
+    - max_running (int): Maximum number of tasks running at once. No limit if 0
+    '''
+    
+    # create a log dir
+    logdir = os.path.join(qsubdir, 'log')
+    os.makedirs(logdir, exist_ok=True)
+    
+    # write the manifest, line i is run by task i
+    manifest = os.path.join(qsubdir, job_name + '.manifest')
+    with open(manifest, 'w') as newfile:
+        for task_name, task_logdir, command in tasks:
+            newfile.write('\t'.join([task_name, task_logdir, command]) + '\n')
+    
+    # each task runs its command and logs to the task's log directory
+    BashScript = os.path.join(qsubdir, job_name + '.sh')
+    with open(BashScript, 'w') as newfile:
+        newfile.write('IFS=$\'\\t\' read -r name logdir cmd < <(sed -n "${SGE_TASK_ID}p" ' + manifest + ')\n')
+        newfile.write('bash -c "$cmd" > "$logdir/$name.o$JOB_ID.$SGE_TASK_ID" 2> "$logdir/$name.e$JOB_ID.$SGE_TASK_ID"\n')
+    
+    # the local backend runs each task as a job named after the task
+    if executor['backend'] == 'local':
+        hold_jids = [hold_jid] if hold_jid != '' else []
+        local_arrays[job_name] = [i[0] for i in tasks]
+        for task_name, task_logdir, command in tasks:
+            submit_local_job(task_name, command, task_logdir, hold_jids)
+        return 0
+    
+    options = '-t 1-{0}'.format(len(tasks))
+    if max_running > 0:
+        options += ' -tc {0}'.format(max_running)
+    if hold_jid != '':
+        options += ' -hold_jid {0}'.format(hold_jid)
+    QsubCmd = "qsub -b y -P gsi {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(options, mem, job_name, logdir, BashScript)
+    job = subprocess.call(QsubCmd, shell=True)
+    
+    # record the task ids used to resolve the exit status of each task
+    if job == 0:
+        record_array_tasks(credential_file, database, job_name, [i[0] for i in tasks])
+    return job
+
+
+def submit_job_batch(credential_file, database, batch, stages, job_prefix, qsubdir, mem, max_running=None):
+    '''
+    (str, str, dict, list, str, str, int, dict or None) -> list
+    
+    Submits each stage of batch as an array job waiting for the array job
+    of the previous stage and returns a list of qsub exit codes
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database storing the task ids of the array jobs
+    - batch (dict): Dictionary with the list of tasks of each stage
+    - stages (list): Stages of batch in the order they run
+    - job_prefix (str): Suffix appended to the stage to name the array jobs
+    - qsubdir (str): Directory where the manifests and the array job scripts are written
+    - mem (int): Memory requirement of each task
+    - max_running (dict or None): Maximum number of tasks of a stage running at once
+    '''
+    
+    if max_running == None:
+        max_running = {}
+    os.makedirs(qsubdir, exist_ok=True)
+    stamp = time.strftime('%Y%m%d%H%M%S', time.localtime(time.time()))
+    
+    job_exits, hold_jid = [], ''
+    for stage in stages:
+        if stage in batch and len(batch[stage]) != 0:
+            job_name = '{0}Array.{1}.{2}'.format(stage, job_prefix, stamp)
+            job = submit_array_job(credential_file, database, job_name, batch[stage], qsubdir, mem, hold_jid, max_running.get(stage, 0))
+            job_exits.append(job)
+            hold_jid = job_name
+    return job_exits
+
+
+def get_ssh_command(host):
+    '''
+    (str) -> str
+    
+    Returns the ssh command to host. Commands of the run are multiplexed over
+    a single ssh connection kept open between commands
+    
+    Parameters
+    ----------
+    - host (str): Xfer host server
+    '''
+    
+    os.makedirs(ssh_control_dir, mode=0o700, exist_ok=True)
+    return 'ssh -o ControlMaster=auto -o ControlPath={0} -o ControlPersist={1} {2}'.format(os.path.join(ssh_control_dir, '%C'), ssh_control_persist, host)
+
+
+class StagingSession:
+    '''
+    A lftp session to the staging server of a box, opened through the xfer host
+    and kept open for the duration of the run. Commands are sent one at a time
+    and their output is read up to a marker echoed by lftp. A session without
+    output for staging_timeout seconds is killed
+    '''
+    
+    marker = '__GAEA_DONE__'
+    failure = '__GAEA_FAILED__'
+    
+    def __init__(self, host, box, password, server='ftp://ftp.ega.ebi.ac.uk'):
+        self.command = "{0} \"lftp -u {1},{2} {3}\"".format(get_ssh_command(host), box, password, server)
+        self.process = None
+        self.lock = threading.Lock()
+    
+    def start(self):
+        self.process = subprocess.Popen(self.command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        # output is read from the file descriptor to wait for it with a deadline
+        self.output = b''
+        self.send('set ftp:ssl-allow false')
+    
+    def send(self, command):
+        # mark the end of the output and the failure of the command
+        self.process.stdin.write('{0} || echo {1}; echo {2}\n'.format(command, self.failure, self.marker))
+        self.process.stdin.flush()
+        lines = []
+        while True:
+            # consume the complete lines received
+            while b'\n' in self.output:
+                line, self.output = self.output.split(b'\n', 1)
+                line = line.decode('utf-8', 'replace').rstrip('\r')
+                if line == self.marker:
+                    return lines
+                lines.append(line)
+            # wait for more output up to the deadline
+            if select.select([self.process.stdout], [], [], staging_timeout)[0] == []:
+                raise subprocess.TimeoutExpired(command, staging_timeout)
+            data = os.read(self.process.stdout.fileno(), 65536)
+            if data == b'':
+                raise EOFError('staging server session closed')
+            self.output += data
+    
+    def run(self, command):
+        '''
+        (str) -> list
         
-                    # launch qsub directly, collect job names and exit codes
-                    JobName1 = 'Md5sum.original.{0}'.format(alias + '__' + file_names[i])
-                    # check if 1st file in list
-                    if i == 0:
-                        QsubCmd1 = "qsub -b y -P gsi -l h_vmem={0}g -N {1} -e {2} -o {2} \"bash {3}\"".format(mem, JobName1, logdir, BashScript1)
-                    else:
-                        # launch job when previous job is done
-                        QsubCmd1 = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(job_names[-1], mem, JobName1, logdir, BashScript1)
-                    job1 = subprocess.call(QsubCmd1, shell=True)
-                                   
-                    JobName2 = 'Encrypt.{0}'.format(alias + '__' + file_names[i])
-                    QsubCmd2 = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(JobName1, mem, JobName2, logdir, BashScript2)
-                    job2 = subprocess.call(QsubCmd2, shell=True)
-                            
-                    JobName3 = 'Md5sum.encrypted.{0}'.format(alias + '__' + file_names[i])
-                    QsubCmd3 = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(JobName2, mem, JobName3, logdir, BashScript3)
-                    job3 = subprocess.call(QsubCmd3, shell=True)
-                            
-                    # store job names and exit codes
-                    job_exits.extend([job1, job2, job3])
-                    job_names.extend([JobName1, JobName2, JobName3])
+        Returns the lines printed by command. Raises subprocess.CalledProcessError if command fails
+        or if the staging server stops responding
         
-        # launch check encryption job
-        MyCmd = 'sleep 300; module load gaea; Gaea check_encryption -c {0} -s {1} -t {2} -b {3} -a {4} -o {5} -w {6} -j \"{7}\"'
-        # get parent directory
-        working_dir = os.path.dirname(outdir)
-        # put commands in shell script
-        BashScript = os.path.join(qsubdir, alias + '_check_encryption.sh')
-        with open(BashScript, 'w') as newfile:
-            newfile.write(MyCmd.format(credential_file, database, table, box, alias, ega_object, working_dir, ';'.join(job_names)) + '\n')
-                
-        # launch qsub directly, collect job names and exit codes
-        JobName = 'CheckEncryption.{0}'.format(alias)
-        # launch job when previous job is done
-        QsubCmd = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(job_names[-1], mem, JobName, logdir, BashScript)
-        job = subprocess.call(QsubCmd, shell=True)
-        # store the exit code (but not the job name)
-        job_exits.append(job)          
+        Parameters
+        ----------
+        - command (str): lftp command
+        '''
         
-        return job_exits
+        with self.lock:
+            # open the session again if the connection was dropped
+            for attempt in range(2):
+                try:
+                    if self.process == None or self.process.poll() != None:
+                        self.start()
+                    lines = self.send(command)
+                    break
+                except (OSError, ValueError, EOFError):
+                    self.close()
+                    if attempt == 1:
+                        raise
+                except subprocess.TimeoutExpired:
+                    # a stalled session is not reused
+                    self.kill()
+                    raise subprocess.CalledProcessError(1, command, 'no output from the staging server in {0} seconds'.format(staging_timeout))
+        if self.failure in lines:
+            raise subprocess.CalledProcessError(1, command, '\n'.join([i for i in lines if i != self.failure]))
+        return lines
+    
+    def close(self):
+        if self.process != None:
+            try:
+                self.process.stdin.write('bye\n')
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except:
+                self.process.kill()
+            self.process = None
+    
+    def kill(self):
+        if self.process != None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+class LocalStagingSession:
+    '''
+    A stand-in for the staging server of a box serving the ls, find -l and mkdir -p
+    commands from a local directory, used to test the listings and directory creation
+    without the EGA servers. Uploads still go to the EGA servers
+    '''
+    
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+    
+    def format_entry(self, path, name):
+        info = os.stat(path)
+        mode = 'd' if os.path.isdir(path) else '-'
+        return '{0}rw-r--r--  gaea/gaea {1:>12} {2} {3}'.format(mode, info.st_size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info.st_mtime)), name)
+    
+    def run(self, command):
+        '''
+        (str) -> list
+        
+        Returns the lines printed by command. Raises subprocess.CalledProcessError if command fails
+        
+        Parameters
+        ----------
+        - command (str): lftp command
+        '''
+        
+        args = command.split()
+        if args[0] == 'set':
+            return []
+        # paths on the staging server are relative to the home directory
+        directory = [i for i in args[1:] if not i.startswith('-')]
+        directory = directory[0].strip('/') if len(directory) != 0 else ''
+        path = os.path.join(self.root, directory)
+        if args[0] == 'mkdir':
+            os.makedirs(path, exist_ok=True)
+            return []
+        if os.path.isdir(path) == False:
+            raise subprocess.CalledProcessError(1, command, '{0}: No such file or directory'.format(directory))
+        if args[0] == 'ls':
+            return [self.format_entry(os.path.join(path, i), i) for i in sorted(os.listdir(path))]
+        if args[0] == 'find':
+            lines = []
+            for current, directories, files in os.walk(path):
+                for i in sorted(directories) + sorted(files):
+                    name = './' + os.path.relpath(os.path.join(current, i), path)
+                    lines.append(self.format_entry(os.path.join(current, i), name))
+            return lines
+        raise subprocess.CalledProcessError(1, command, 'command not supported by the local staging server')
+    
+    def close(self):
+        pass
+
+
+def get_staging_session(host, box, password):
+    '''
+    (str, str, str) -> StagingSession or LocalStagingSession
+    
+    Returns the session to the staging server of box opened during the run.
+    The session is served from a local directory if a stand-in staging root is set
+    
+    Parameters
+    ----------
+    - host (str): Xfer host server
+    - box (str): EGA submission box (ega-box-xxx)
+    - password (str): Password to connect to the EGA submission box
+    '''
+    
+    # sessions are not shared across processes
+    key = (os.getpid(), host, box)
+    if key not in staging_sessions:
+        if staging_root['path'] != None:
+            staging_sessions[key] = LocalStagingSession(os.path.join(staging_root['path'], box))
+        else:
+            staging_sessions[key] = StagingSession(host, box, password)
+    return staging_sessions[key]
+
+
+def close_staging_sessions():
+    '''
+    (None) -> None
+    
+    Closes the sessions to the staging servers opened by the current process
+    '''
+    
+    for key in list(staging_sessions.keys()):
+        if key[0] == os.getpid():
+            staging_sessions.pop(key).close()
+
 
+# close the staging server sessions when the run ends
+atexit.register(close_staging_sessions)
 
 
-def encrypt_files(credential_file, database, table, ega_object, box, key_ring, mem, disk_space, working_dir):
+def make_directory_staging_server(host, box, password, directory):
     '''
-    (str, str, str, str, str, str, int, str, str) -> None
+    (str, str, str, str) -> int
     
-    Encrypt files for all alises of the EGA objects if diskspace (in TB) remains available
-    after encryption and update file status to encrypting if encryption and md5sum
-    jobs are successfully launched 
+    Creates directory and its parents on the staging server of box and returns
+    the exit code of the command
+    
+    Parameters
+    ----------
+    - host (str): Xfer host server
+    - box (str): EGA submission box (ega-box-xxx)
+    - password (str): Password to connect to the EGA submission box
+    - directory (str): Directory on the box' staging server
+    '''
+    
+    try:
+        get_staging_session(host, box, password).run('mkdir -p {0}'.format(directory))
+    except subprocess.CalledProcessError as e:
+        return e.returncode
+    return 0
+
+
+# lines of lftp listings: ls -l, ls -lR or find -l formats. captures the entry type,
+# the size, and the path after the date (yyyy-mm-dd hh:mm[:ss] or Mon dd hh:mm|yyyy)
+staging_server_listing = re.compile(r'^([-dlbcps])[-rwxsStTl+@.]{9}\S*\s+.*?(\d+)\s+(?:\d{4}-\d{2}-\d{2}\s+\d{1,2}:\d{2}(?::\d{2})?|[A-Za-z]{3}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4}))\s+(.+)$')
+
+
+def parse_staging_server_listing(lines, exclude=None):
+    '''
+    (list, list or None) -> dict
+    
+    Returns a dictionary with the size of each file in a recursive listing of the
+    staging server. Files in the root directory are keyed as /file_name and files
+    in sub-directories as directory/file_name. Lines that are not file entries are ignored
+    
+    Parameters
+    ----------
+    - lines (list): Lines of the lftp listing, in find -l, ls -l or ls -lR format
+    - exclude (list or None): Directories in the root directory that are not listed.
+                              Default is the EGA-owned directories
+    '''
+    
+    # exclude EGA-owned directories
+    if exclude == None:
+        exclude = ['MD5_daily_reports', 'metadata']
+    
+    size = {}
+    # directory of the entries of a ls -lR listing
+    directory = ''
+    for line in lines:
+        line = line.rstrip('\r\n')
+        # ls -lR lists the entries of each directory under a directory: header
+        if line.endswith(':') and staging_server_listing.match(line) == None:
+            directory = line[:-1]
+            continue
+        match = staging_server_listing.match(line)
+        # skip directories, totals and messages
+        if match == None or match.group(1) != '-':
+            continue
+        path = os.path.normpath(os.path.join(directory, match.group(3))).lstrip('/')
+        if path.startswith('./'):
+            path = path[2:]
+        if path == '' or path == '.' or path.split('/')[0] in exclude:
+            continue
+        # files in the root directory have no directory
+        if '/' not in path:
+            path = '/' + path
+        size[path] = int(match.group(2))
+    return size
+
+
+def list_file_sizes_staging_server(credential_file, box, host):
+    '''
+    (str, str, str) -> dict
+    
+    Returns a dictionary with the size of all files on the staging server of
+    the given box, listed recursively in the session to the staging server
     
     Parameters
     ----------
     - credential_file (str): File with EGA boxes and database credentials
-    - database (str): Name of the database storing information required for registration of EGA objects
-    - table (str): Table in database
-    - ega_object (str): Registered object at the EGA. Accepted values:
-                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
-    - box (str): EGA submission box (ega-box-xxxx)
-    - key_ring (str): Path to the keys required for encryption
-    - mem (int): Required memory for the encryption jobs
-    - disk_space (int): Disk space (in TB) available in scratch after encryption is complete  
-    - working_dir (str): Directory containing directories with encrypted files
+    - box (str): EGA submission box (ega-box-xxx)
+    - host (str): Xfer host server
     '''
     
-    # create a list of aliases for encryption 
-    aliases = select_aliases_for_encryption(credential_file, database, table, box, disk_space, working_dir)
+    # get box credentials
+    credentials = extract_credentials(credential_file)
+    # list all files with their size recursively from the home directory
+    a = get_staging_session(host, box, credentials[box]).run('find -l')
+    return parse_staging_server_listing(a)
+
+
+def get_registered_files(credential_file, database, box):
+    '''    
+    (str, str, str) -> dict
     
-    # check if Table exist
-    tables = show_tables(credential_file, database)
-    if table in tables:
-        # connect to database
-        conn = connect_to_database(credential_file, database)
-        cur = conn.cursor()
-        # pull alias, files and working directory for status = encrypt
-        cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory FROM {0} WHERE {0}.Status=\"encrypt\" AND {0}.egaBox=\"{1}\"'.format(table, box))
+    Returns a dictionary with file path, list of md5sums and accession ID key, value pairs
+    for the files of the runs and analyses registered in box
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of the database storing the registered files
+    - box (str): EGA submission box (eg. ega-box-xxxx)
+    '''
+   
+    # connect to db
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    # extract file name, md5sums, alias and accession number of registered files
+    try:
+        cur.execute('SELECT RegisteredFiles.fileName, RegisteredFiles.unencryptedChecksum, RegisteredFiles.checksum, \
+                    RegisteredFiles.alias, RegisteredFiles.egaAccessionId FROM RegisteredFiles WHERE RegisteredFiles.egaBox=%s', (box,))
         data = cur.fetchall()
-        conn.close()
-        
-        # check that some files are in encrypt mode
-        if len(data) != 0:
-            for i in data:
-                alias = i[0]
-                # encrypt only files of aliases that were pre-selected
-                if alias in aliases:
-                    # get working directory
-                    working_directory = get_working_directory(i[2], working_dir)
-                    # create working directory
-                    os.makedirs(working_directory, exist_ok=True)
-                    # convert single quotes to double quotes for str -> json conversion
-                    files = json.loads(i[1].replace("'", "\""))
-                    # create parallel lists of file paths and names
-                    file_paths, file_names = [] , [] 
-                    # loop over files for that alias
-                    for file in files:
-                        # get the filePath and fileName
-                        file_paths.append(files[file]['filePath'])
-                        file_names.append(files[file]['fileName'])
+    except:
+        data = []
+    conn.close()
+   
+    # create a dict {filepath: [[md5unc, md5enc, alias, accession]]}    
+    files = {}  
+    for filename, md5unc, md5enc, alias, accession in data:
+        if filename in files:
+            files[filename].append([md5unc, md5enc, alias, accession])
+        else:
+            files[filename] = [[md5unc, md5enc, alias, accession]]
+    return files 
 
-                    # remove encrypted files if already exist in working directory
-                    # it generates an error if encrypted files are present and encryption starts again
-                    # make a list of files in working directory
-                    current_encrypted = [os.path.join(working_directory, j) for j in os.listdir(working_directory) if j[-4:] == '.gpg' in j] 
-                    for j in current_encrypted:
-                        os.remove(j)
-                    
-                    # update status -> encrypting
-                    conn = connect_to_database(credential_file, database)
-                    cur = conn.cursor()
-                    cur.execute('UPDATE {0} SET {0}.Status=\"encrypting\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box))
-                    conn.commit()
-                    conn.close()
 
-                    # encrypt and run md5sums on original and encrypted files and check encryption status
-                    job_codes = encrypt_and_checksum(credential_file, database, table, box, alias, ega_object, file_paths, file_names, key_ring, working_directory, mem)
-                    # check if encription was launched successfully
-                    if not (len(set(job_codes)) == 1 and list(set(job_codes))[0] == 0):
-                        # store error message, reset status encrypting --> encrypt
-                        error = 'Could not launch encryption jobs'
-                        conn = connect_to_database(credential_file, database)
-                        cur = conn.cursor()
-                        cur.execute('UPDATE {0} SET {0}.Status=\"encrypt\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+# use this function to get file size and metadata for all files on the staging server in a Specific box box
+def merge_file_info_staging_server(file_size, registered_files, box):
+    '''
+    (dict, dict, str) - > dict
+    
+    Returns a dictionary of file information that include file size and metadata
+    for the files on the box's staging server 
+        
+    Parameters
+    ----------
+    
+    - file_size (dict): Dictionary with file size for all files on the box's staging server
+    - registered_files (dict): Dictionary with registered files in the box 
+    - box (str): EGA submission box (ega-box-xxxx)
+    '''
+    
+    D = {}
+    for file_path in file_size:
+        # get the name of the file. check if file on the root on the staging server
+        if os.path.basename(file_path) == '':
+            file_name = file_path
+        else:
+            file_name = os.path.basename(file_path)
+        # check if file is md5
+        if file_path[-4:] == '.md5':
+            name = file_path[:-4]
+        else:
+            name = file_path
+        # add filename, size and initialize empty lists to store alias and accessions
+        if file_path not in D:
+            D[file_path] = [file_path, file_name, str(file_size[file_path]), [], [], box]
+        # check if file is registered
+        # file may or may not have .gpg extension in RegisteredFiles
+        # .gpg present upon registration but subsenquently removed from file name
+        # add aliases and acessions
+        if name in registered_files:
+            for i in range(len(registered_files[name])):
+                D[file_path][3].append(registered_files[name][i][-2])
+                D[file_path][4].append(registered_files[name][i][-1])
+        elif name[-4:] == '.gpg' and name[:-4] in registered_files:
+            for i in range(len(registered_files[name[:-4]])):
+                D[file_path][3].append(registered_files[name[:-4]][i][-2])
+                D[file_path][4].append(registered_files[name[:-4]][i][-1])
+        elif name[-4:] != '.gpg' and name + '.gpg' in registered_files:
+            for i in range(len(registered_files[name + '.gpg'])):
+                D[file_path][3].append(registered_files[name + '.gpg'][i][-2])
+                D[file_path][4].append(registered_files[name + '.gpg'][i][-1])
+        else:
+            D[file_path][3].append('NULL')
+            D[file_path][4].append('NULL')
+        # convert lists to strings
+        # check if multiple aliases and accessions exist for that file
+        if len(D[file_path][3]) > 1:
+            D[file_path][3] = ';'.join(D[file_path][3])
+        else:
+            D[file_path][3] = D[file_path][3][0]
+        if len(D[file_path][4]) > 1:
+            D[file_path][4]= ';'.join(D[file_path][4])
+        else:
+            D[file_path][4] = D[file_path][4][0]
+    return D
+
+
+def add_file_info_staging_server(credential_file, metadata_database, submission_database, staging_server_table, box, host, batch_size=1000):
+    '''
+    (str, str, str, str, str, str, int) -> None
+    
+    Populates table StagingServerTable in the submission database with file information
+    including size and accession IDs for files on the box's staging server.
+    Rows of the box are replaced in a single transaction
+        
+    Paramaters
+    ----------
+    - credential_file (str): File with EGA box and database credentials 
+    - metadata_database (str): Database storing metadata information about registered EGA objects
+    - submission_database (str): Database storing required information for registration of EGA objects
+    - staging_server_table (str): Table storing file information on the EGA staging server
+    - box (str): EGA submission box (ega-box-xxx)
+    - host (str): Xfer host server
+    - batch_size (int): Number of records inserted at once
+    '''
+    
+    # Extract file size for all files on the staging server
+    file_size = list_file_sizes_staging_server(credential_file, box, host)
+    # Extract md5sums and accessions of the files of registered analyses and runs
+    registered = get_registered_files(credential_file, metadata_database, box)
+                    
+    # cross-reference dictionaries and get aliases and accessions for files on staging servers if registered
+    data = merge_file_info_staging_server(file_size, registered, box)
+                
+    # format colums with datatype and convert to string
+    fields = ["file", "filename", "fileSize", "alias", "egaAccessionId", "egaBox"]
+    columns = ' '.join([fields[i] + ' TEXT NULL,' if i != len(fields) -1 else fields[i] + ' TEXT NULL' for i in range(len(fields))])
+
+    # create table if table doesn't exist
+    tables = show_tables(credential_file, submission_database)
+    if staging_server_table not in tables:
+        # connect to submission database
+        conn = connect_to_database(credential_file, submission_database)
+        cur = conn.cursor()
+        # format colums with datatype and convert to string
+        cur.execute('CREATE TABLE {0} ({1})'.format(staging_server_table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, staging_server_table)
+        conn.commit()
+        conn.close()
+    
+    # list values according to the table column order
+    # convert data to strings, converting missing values to NULL
+    rows = [format_data(data[filename]) for filename in data]
+    
+    # connect to submission database
+    conn = connect_to_database(credential_file, submission_database)
+    cur = conn.cursor()
+    # replace all entries for that Box at once so that the box never appears empty
+    try:
+        cur.execute('DELETE FROM {0} WHERE {0}.egaBox=%s'.format(staging_server_table), (box,))
+        insert_rows(cur, staging_server_table, fields, rows, batch_size)
+        conn.commit()
+    except:
+        conn.rollback()
+        conn.close()
+        raise
+    conn.close()
+
+
+def create_footprint_table(cur, footprint_table):
+    '''
+    (pymysql.cursors.Cursor, str) -> None
+    
+    Creates the footprint table with the number and size of registered and
+    non-registered files in each directory of the staging servers if it doesn't exist
+    
+    Parameters
+    ----------
+    - cur (pymysql.cursors.Cursor): Cursor of a connection to the submission database
+    - footprint_table (str): Table in the submission database storing foot print on each of the boxes' staging servers
+    '''
+    
+    fields = ["egaBox", "location", "AllFiles", "Registered", "NotRegistered", "Size", "SizeRegistered", "SizeNotRegistered"]
+    # format colums with datatype - convert to string
+    columns = ' '.join([fields[i] + ' TEXT NULL,' if i != len(fields) -1 else fields[i] + ' TEXT NULL' for i in range(len(fields))])
+    # create table with column headers
+    cur.execute('CREATE TABLE IF NOT EXISTS {0} ({1})'.format(footprint_table, columns))
+    # index columns used to filter rows
+    add_table_indexes(cur, footprint_table)
+
+
+def add_footprint_data(credential_file, submission_database, staging_server_table, footprint_table, box):
+    '''
+    (str, str, str, str, str) -> None
+    
+    Summarizes the file information in StagingServerTable for given Box per directory
+    and for All directories in FootPrintTable. The summary is computed by the database
+    and replaces the footprint of the box in a single transaction
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - submission_database (str): Name of the database storing information required for registing EGA objects
+    - staging_server_table (str): Table in the submission database storing information about files located on the EGA's staging server
+    - footprint_table (str): Table in the submission database storing foot print on each of the boxes' staging servers
+    - box (str): EGA submission box (ega-box-xxx)
+    '''
+    
+    # directory of each file. files in the root directory are recorded as /file_name
+    directory = 'IF(LOCATE(\"/\", {0}.file) = 0, \"/\", \
+                IF(LENGTH({0}.file) - LENGTH(SUBSTRING_INDEX({0}.file, \"/\", -1)) = 1, \"/\", \
+                LEFT({0}.file, LENGTH({0}.file) - LENGTH(SUBSTRING_INDEX({0}.file, \"/\", -1)) - 1)))'.format(staging_server_table)
+    # files are registered if they have an accession
+    registered = '({0}.egaAccessionId IS NOT NULL AND {0}.egaAccessionId NOT IN (\"NULL\", \"\"))'.format(staging_server_table)
+    size = 'CAST({0}.fileSize AS UNSIGNED)'.format(staging_server_table)
+    # count files and sum sizes per directory, the rollup row summarizes all directories
+    summary = 'SELECT {0} AS location, COUNT(*) AS AllFiles, SUM({1}) AS Registered, SUM(NOT {1}) AS NotRegistered, \
+              SUM({2}) AS Size, SUM(IF({1}, {2}, 0)) AS SizeRegistered, SUM(IF({1}, 0, {2})) AS SizeNotRegistered \
+              FROM {3} WHERE {3}.egaBox=%s GROUP BY location WITH ROLLUP'.format(directory, registered, size, staging_server_table)
+    
+    # connect to submission database
+    conn = connect_to_database(credential_file, submission_database)
+    cur = conn.cursor()
+    # create table if doesn't exist
+    create_footprint_table(cur, footprint_table)
+    conn.commit()
+    try:
+        # replace the footprint of the box
+        cur.execute('DELETE FROM {0} WHERE {0}.egaBox=%s'.format(footprint_table), (box,))
+        cur.execute('INSERT INTO {0} (egaBox, location, AllFiles, Registered, NotRegistered, Size, SizeRegistered, SizeNotRegistered) \
+                    SELECT %s, IFNULL(summary.location, \"All\"), summary.AllFiles, summary.Registered, summary.NotRegistered, \
+                    summary.Size, summary.SizeRegistered, summary.SizeNotRegistered FROM ({1}) AS summary'.format(footprint_table, summary), (box, box))
+        conn.commit()
+    except:
+        # keep the previous footprint if the staging table cannot be summarized
+        conn.rollback()
+    conn.close()
+
+
+def add_upload_footprint(credential_file, database, footprint_table, box, uploads):
+    '''
+    (str, str, str, str, dict) -> None
+    
+    Adds the number and size of the files uploaded since the last refresh of the
+    staging server to the footprint of their directory and of All directories of box,
+    so that the footprint is up to date without listing the staging server
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of the database storing information required for registing EGA objects
+    - footprint_table (str): Table in the submission database storing foot print on each of the boxes' staging servers
+    - box (str): EGA submission box (ega-box-xxx)
+    - uploads (dict): Dictionary with the number and size of non-registered files uploaded to each directory
+    '''
+    
+    if len(uploads) == 0:
+        return
+    
+    # add the uploads to All directories
+    total = [sum([uploads[i][0] for i in uploads]), sum([uploads[i][1] for i in uploads])]
+    rows = list(uploads.items()) + [('All', total)]
+    
+    # connect to submission database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    create_footprint_table(cur, footprint_table)
+    for location, (count, size) in rows:
+        # add the directory to the footprint if it doesn't exist
+        cur.execute('INSERT INTO {0} (egaBox, location, AllFiles, Registered, NotRegistered, Size, SizeRegistered, SizeNotRegistered) \
+                    SELECT %s, %s, 0, 0, 0, 0, 0, 0 FROM DUAL WHERE NOT EXISTS (SELECT * FROM {0} WHERE {0}.egaBox=%s AND {0}.location=%s)'.format(footprint_table), (box, location, box, location))
+        cur.execute('UPDATE {0} SET {0}.AllFiles={0}.AllFiles + %s, {0}.NotRegistered={0}.NotRegistered + %s, \
+                    {0}.Size={0}.Size + %s, {0}.SizeNotRegistered={0}.SizeNotRegistered + %s WHERE {0}.egaBox=%s AND {0}.location=%s'.format(footprint_table), (count, count, size, size, box, location))
+    conn.commit()
+    conn.close()
+
+
+def get_disk_space_staging_server(credential_file, database, footprint_table, box):
+    '''
+    (str, str, str, str) -> float
+    
+    Returns the footprint of non-registered files on the staging server of a given box (in Tb)
+        
+    Parameters
+    ----------
+    - credential_file (str): File with EGA box and database credentials
+    - database (str): Database storing information for registration of EGA objects
+    - footprint_table (str): Table in database storing information about files on the box' staging server 
+    - box (str): EGA submission box (ega-box-xxx)
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    
+    # make a list of boxes in foorptint table
+    cur.execute('SELECT {0}.egaBox FROM {0}'.format(footprint_table))
+    boxes = list(set([i[0] for i in cur]))
+    # if Box not in Boxes, footprint is 0
+    if box not in boxes:
+        conn.close()
+        return 0
+      
+    try:
+        # extract files for alias in upload mode for given box
+        cur.execute('SELECT {0}.SizeNotRegistered from {0} WHERE {0}.location=\"All\" AND {0}.egaBox=\"{1}\"'.format(footprint_table, box))
+        # check that some alias are in upload mode
+        data = int(cur.fetchall()[0][0]) / (10**12)
+    except:
+        data = -1
+    # close connection
+    conn.close()
+    return data
+
+
+def add_accessions(credential_file, metadata_db, submission_db, table, associated_table, column_name, prefix, update_status, box):
+    '''
+    (str, str, str, str, str, str, str, bool, str) -> None
+    
+    Update table in the submission database with the accessions of dependent 
+    objects in the associate table using prefix and column name.
+    Update status --> ready if no error and UpdateStatus is True
+    
+    Paramaters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - metadata_db (str): Database storing metadata information
+    - submission_db (str): Database storing submission information 
+    - table (str): Name of table in submission_db
+    - associated_table (str): Table with information on dependent objects
+    - column_name (str): Column name in table 
+    - prefix (str): Expected prefix of EGA accession Id (eg EGAN, EGAS)
+    - update_status (bool): Update alias status if True and no error is found
+    - box (str): EGA submssion box (ega-box-xxxx)
+    '''
+    
+    # grab EGA accessions from metadata database, create a dict {alias: accession}
+    registered = extract_accessions(credential_file, metadata_db, box, associated_table)
+           
+    # connect to the submission database
+    conn = connect_to_database(credential_file, submission_db)
+    cur = conn.cursor()
+    # pull alias, dependent Ids for given box
+    Cmd = 'SELECT {0}.alias, {0}.{1} FROM {0} WHERE {0}.Status=\"clean\" AND {0}.egaBox=\"{2}\"'.format(table, column_name, box)
+    
+    try:
+        cur.execute(Cmd)
+        data = cur.fetchall()
+    except:
+        data = []
+    
+    # create a dict {alias: [accessions, ErrorMessage]}
+    dependent = {}
+    # check if alias are in start status
+    if len(data) != 0:
+        for i in data:
+            # make a list of dependent Alias
+            alias = i[1].split(';')
+            # make a list of dependent accessions
+            accessions = []
+            for j in alias:
+                if j.startswith(prefix):
+                    accessions.append(j)
+                elif j in registered:
+                    accessions.append(registered[j])
+            # record error if aliases have missing accessions
+            # alias may be in medata table but accession may be NULL if EGA Id is not yet available
+            if len(alias) != len(accessions) or 'NULL' in accessions:
+                error = 'Accessions not available'
+            else:
+                error = ''
+            dependent[i[0]] =  [';'.join(accessions), error]
+            
+        if len(dependent) != 0:
+            for alias in dependent:
+                error = dependent[alias][-1]
+                if error == '':
+                    # update accessions
+                    cur.execute('UPDATE {0} SET {0}.{1}=\"{2}\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{3}\" AND {0}.egaBox=\"{4}\"'.format(table, column_name, dependent[alias][0], alias, box)) 
+                else:
+                    # record error message
+                    cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
+                conn.commit()
+                
+                # check if status can be updated
+                if update_status == True and error == '':
+                    # update runs and experiments status only if studyId and sampleId are present
+                    if table in ['Experiments', 'Runs']:
+                        # make a list of sampleId
+                        try:
+                            cur.execute('SELECT {0}.sampleId FROM {0} WHERE {0}.egaBox=\"{1}\" AND {0}.alias=\"{2}\"'.format(table, box, alias))
+                            samples = cur.fetchall()[0][0].split(';')
+                        except:
+                            samples = []
+                        if len(samples) != 0:
+                            # check if all samples have accession Ids 
+                            has_accessions = list(set(list(map(lambda x:x.startswith("EGAN"), samples))))
+                            if len(has_accessions) == 1 and has_accessions[0] == True:
+                                # update satus start --> ready
+                                cur.execute('UPDATE {0} SET {0}.Status=\"ready\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box)) 
+                                conn.commit()
+                    else:
+                        # update satus start --> ready
+                        cur.execute('UPDATE {0} SET {0}.Status=\"ready\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box)) 
+                        conn.commit()
+    conn.close()    
+
+    
+def add_studyId_analyses_project(credential_file, metadata_database, submission_database, analysis_table, project_table, studies_table, box):
+    '''
+    (str, str, str, str, str, str, str) -> None
+       
+    Updates column studyId in AnalysesProject table with the study EGA accession if alias is present
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - metadata_database (str): Name of the database storing metadata information
+    - submission_database (str): Name of the database storing information required for registering EGA objects
+    - analysis_table (str): Name of the table storing analyses information
+    - project_table (str): Name of the table storing project information
+    - studies_table (str): name of the table storing studies information
+    - box (str): EGA submission box (eg. ega-box-xxxx)
+    '''
+    
+    # grab EGA accessions from metadata database, create a dict {alias: accession}
+    registered = extract_accessions(credential_file, metadata_database, box, studies_table)
+    # connect to the submission database
+    conn = connect_to_database(credential_file, submission_database)
+    cur = conn.cursor()
+    # pull alias, dependent Ids for given box
+    Cmd = 'SELECT {0}.alias, {0}.studyId FROM {0} JOIN {1} WHERE {1}.ProjectKey={0}.alias AND {1}.egaBox=\"{2}\"'.format(project_table, analysis_table, box)
+        
+    try:
+        cur.execute(Cmd)
+        data = cur.fetchall()
+    except:
+        data = []
+    
+    # update studyId in project 
+    data = list(set(data))
+    # make a new list with [(alias: studyId)]
+    accessions = []
+    for i in data:
+        if not i[1].startswith('EGAS'):
+            if i[1] in registered:
+                accessions.append([i[0], registered[i[1]]])
+    if len(accessions) != 0:
+        for i in accessions:
+            with conn.cursor() as cur:
+                cur.execute('UPDATE {0} SET {0}.studyId=\"{1}\" WHERE {0}.alias=\"{2}\"'.format(project_table, i[1], i[0])) 
+                conn.commit()
+    conn.close()    
+    
+
+def check_ega_accession_id(credential_file, submission_database, metadata_database, ega_object, table, box):
+    '''
+    (str, str, str, str, str, str) -> None
+    
+    Check that all dependent EGA accessions of an EGA object are available in
+    the metadata database. Updates status of all aliases in table of the submission
+    database for the given box or keep the same status if accessions are not available
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA box and database credentials
+    - submission_database (str): Name of the metadata sotring information required for submission
+    - metata_database (str): Name of the database storing metadata information
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - table (str): Name of table in submission and metadata databases
+    - box (str): EGA submission box (ega-box-xxx)
+    '''
+    
+    # collect all egaAccessionIds for all tables in EGA metadata db
+    ega_accessions = extract_box_accessions(credential_file, metadata_database, box)
+        
+    # connect to the submission database
+    conn = connect_to_database(credential_file, submission_database)
+    cur = conn.cursor()
+    # pull alias and egaAccessionIds to be verified
+    if ega_object == 'analyses':
+        Cmd = 'SELECT {0}.alias, {0}.sampleReferences FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
+    elif ega_object == 'experiments':
+        Cmd = 'SELECT {0}.alias, {0}.sampleId, {0}.studyId FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
+    elif ega_object == 'datasets':
+        Cmd = 'SELECT {0}.alias, {0}.runsReferences, {0}.analysisReferences, {0}.policyId FROM {0} WHERE {0}.Status=\"clean\" AND {0}.egaBox=\"{1}\"'.format(table, box)
+    elif ega_object == 'policies':
+        Cmd = 'SELECT {0}.alias, {0}.dacId FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
+    elif ega_object == 'runs':
+        Cmd = 'SELECT {0}.alias, {0}.sampleId, {0}.experimentId FROM {0} WHERE {0}.Status=\"ready\" AND {0}.egaBox=\"{1}\"'.format(table, box)
+    
+    try:
+        cur.execute(Cmd)
+        data = cur.fetchall()
+    except:
+        data = []
+       
+    # create a dict to collect all accessions to be verified for a given alias
+    verify = {}
+    # check if alias are in start status
+    if len(data) != 0:
+        for i in data:
+            # get alias
+            alias = i[0]
+            # make a list with all other accessions
+            accessions = []
+            for j in range(1, len(i)):
+                accessions.extend(list(map(lambda x: x.strip(), i[j].split(';'))))
+            # remove NULL from list when only analysis or runs are included in the dataset 
+            while 'NULL' in accessions:
+                accessions.remove('NULL')
+            verify[alias] = accessions
+        
+        if len(verify) != 0:
+            # check if all accessions are readily available from metadata db
+            for alias in verify:
+                # make a list with accession membership
+                if not all([i in ega_accessions for i in verify[alias]]):
+                    error = 'EGA accession(s) not available as metadata' 
+                    # record error and keep status unchanged
+                    cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
+                    conn.commit()
+                else:
+                    error = 'NoError'
+                    # set error to NoError and update status 
+                    cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\", {0}.Status=\"valid\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
+                    conn.commit()
+    conn.close()    
+
+
+def remove_encryption_extension(encrypted_name):
+    '''
+    (str) -> str
+    
+    Returns the name of the encrypted file without the extension added by encryption
+    
+    Parameters
+    ----------
+    - encrypted_name (str): Name of the encrypted file
+    '''
+    
+    for i in encryption_extensions.values():
+        if encrypted_name.endswith(i):
+            return encrypted_name[:-len(i)]
+    return encrypted_name
+
+
+def write_md5(md5_file, checksum):
+    '''
+    (str, str) -> None
+    
+    Writes checksum to md5_file. The file is renamed once written so that 
+    an existing md5 file is always complete
+    
+    Parameters
+    ----------
+    - md5_file (str): Path to the md5 file
+    - checksum (str): Md5sum
+    '''
+    
+    with open(md5_file + '.part', 'w') as newfile:
+        newfile.write(checksum + '\n')
+    os.replace(md5_file + '.part', md5_file)
+
+
+def get_completion_record_file(working_directory, job_name):
+    '''
+    (str, str) -> str
+    
+    Returns the path to the completion record written by job_name when it finishes
+    
+    Parameters
+    ----------
+    - working_directory (str): Directory of the alias processed by the job
+    - job_name (str): Name of the job
+    '''
+    
+    return os.path.join(working_directory, 'completions', job_name + '.json')
+
+
+def write_completion_record(record_file, record):
+    '''
+    (str, dict) -> None
+    
+    Writes the completion record of a job atomically to record_file
+    
+    Parameters
+    ----------
+    - record_file (str): Path to the completion record
+    - record (dict): Exit code, checksums and byte counts of the job
+    '''
+    
+    os.makedirs(os.path.dirname(record_file), exist_ok=True)
+    record['time'] = int(time.time())
+    with open(record_file + '.part', 'w') as newfile:
+        json.dump(record, newfile)
+    os.replace(record_file + '.part', record_file)
+
+
+def read_completion_records(working_directory, job_names):
+    '''
+    (str, list) -> dict
+    
+    Returns a dictionary with the completion records of the jobs in job_names.
+    Records of jobs that did not finish running do not have an exit code
+    
+    Parameters
+    ----------
+    - working_directory (str): Directory of the alias processed by the jobs
+    - job_names (list): List of job names
+    '''
+    
+    D = {}
+    for job_name in job_names:
+        record_file = get_completion_record_file(working_directory, job_name)
+        if os.path.isfile(record_file):
+            try:
+                with open(record_file) as infile:
+                    D[job_name] = json.load(infile)
+            except ValueError:
+                pass
+    return D
+
+
+def start_completion_records(working_directory, job_names):
+    '''
+    (str, list) -> None
+    
+    Replaces the completion records of a previous run of the jobs in job_names
+    with pending records stamped with the launch time of the jobs
+    
+    Parameters
+    ----------
+    - working_directory (str): Directory of the alias processed by the jobs
+    - job_names (list): List of job names
+    '''
+    
+    for job_name in job_names:
+        write_completion_record(get_completion_record_file(working_directory, job_name), {})
+
+
+def gpg_encrypt_stream(file_path, key_ring, write, block_size=8388608):
+    '''
+    (str, str, function, int) -> tuple
+    
+    Encrypts file_path with gpg in a single read of file_path, passes each block 
+    of the encrypted stream to write and returns a tuple with the exit code of gpg
+    and the md5sums of the original and encrypted streams
+    
+    Parameters
+    ----------
+    - file_path (str): Path to the file to encrypt
+    - key_ring (str): Path to the key used for encryption
+    - write (function): Function called with each block of the encrypted stream
+    - block_size (int): Number of bytes read at once
+    '''
+    
+    # encrypt the stream of file_path, gpg writes the encrypted stream to stdout
+    MyCmd = ['gpg', '--no-default-keyring', '--keyring', key_ring, '-r', 'EGA_Public_key', '-r', 'SeqProdBio', '--trust-model', 'always', '-o', '-', '-e']
+    gpg = subprocess.Popen(MyCmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    
+    # compute the md5sum of the encrypted stream while passing it to write
+    encrypted_md5 = hashlib.md5()
+    errors = []
+    def write_encrypted():
+        try:
+            for block in iter(lambda: gpg.stdout.read(block_size), b''):
+                encrypted_md5.update(block)
+                write(block)
+        except Exception as e:
+            errors.append(e)
+            gpg.kill()
+    writer = threading.Thread(target=write_encrypted)
+    writer.start()
+    
+    # compute the md5sum of the original file while feeding the encryption
+    original_md5 = hashlib.md5()
+    try:
+        with open(file_path, 'rb') as infile:
+            for block in iter(lambda: infile.read(block_size), b''):
+                original_md5.update(block)
+                gpg.stdin.write(block)
+    except (IOError, OSError) as e:
+        errors.append(e)
+        gpg.kill()
+    finally:
+        try:
+            gpg.stdin.close()
+        except (IOError, OSError):
+            pass
+        writer.join()
+        exit_code = gpg.wait()
+    
+    if len(errors) != 0:
+        print('could not encrypt {0}: {1}'.format(file_path, errors[0]))
+        if exit_code == 0:
+            exit_code = 1
+    return exit_code, original_md5.hexdigest(), encrypted_md5.hexdigest()
+
+
+def encrypt_crypt4gh_segments(block, session_key):
+    '''
+    (bytes, bytes) -> bytes
+    
+    Returns the Crypt4GH encrypted segments of block. Each segment of 64 KiB 
+    is encrypted independently with session_key and its own nonce
+    
+    Parameters
+    ----------
+    - block (bytes): Consecutive segments of the file to encrypt
+    - session_key (bytes): Key used to encrypt all the segments of a file
+    '''
+    
+    # size of the plain text segments defined by the Crypt4GH format
+    segment_size = 65536
+    
+    L = []
+    for i in range(0, len(block), segment_size):
+        # encrypted segment is prefixed with its 12 bytes nonce and ends with the MAC
+        nonce = os.urandom(12)
+        L.append(nonce + crypto_aead_chacha20poly1305_ietf_encrypt(block[i: i + segment_size], None, nonce, session_key))
+    return b''.join(L)
+
+
+def crypt4gh_encrypt_stream(file_path, public_key, write, processes=4, segments_per_task=64):
+    '''
+    (str, str, function, int, int) -> tuple
+    
+    Encrypts file_path with Crypt4GH for the recipient of public_key in a single read
+    of file_path, passes each block of the encrypted stream to write and returns a tuple
+    with an exit code (0 if successful) and the md5sums of the original and encrypted streams.
+    Segments are encrypted in parallel by a pool of processes
+    
+    Parameters
+    ----------
+    - file_path (str): Path to the file to encrypt
+    - public_key (str): Path to the Crypt4GH public key of the recipient
+    - write (function): Function called with each block of the encrypted stream
+    - processes (int): Number of processes encrypting segments
+    - segments_per_task (int): Number of 64 KiB segments encrypted by each task
+    '''
+    
+    original_md5, encrypted_md5 = hashlib.md5(), hashlib.md5()
+    
+    # crypt4gh is only required for Crypt4GH encryption
+    try:
+        import crypt4gh.header
+        import crypt4gh.keys
+    except ImportError:
+        print('crypt4gh is required for Crypt4GH encryption')
+        return 1, original_md5.hexdigest(), encrypted_md5.hexdigest()
+    if crypto_aead_chacha20poly1305_ietf_encrypt == None:
+        print('pynacl is required for Crypt4GH encryption')
+        return 1, original_md5.hexdigest(), encrypted_md5.hexdigest()
+    
+    # write a block of the encrypted stream
+    def write_encrypted(encrypted):
+        encrypted_md5.update(encrypted)
+        write(encrypted)
+    
+    processes = max(1, processes)
+    try:
+        # make the header with the session key, encrypted for the recipient with a new sender key
+        session_key = os.urandom(32)
+        header_content = crypt4gh.header.make_packet_data_enc(0, session_key)
+        header_packets = crypt4gh.header.encrypt(header_content, [(0, os.urandom(32), crypt4gh.keys.get_public_key(public_key))])
+        write_encrypted(crypt4gh.header.serialize(header_packets))
+        
+        with open(file_path, 'rb') as infile:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                # encrypted blocks are written in order, with at most 2 blocks per process held at once
+                pending = collections.deque()
+                for block in iter(lambda: infile.read(65536 * segments_per_task), b''):
+                    original_md5.update(block)
+                    pending.append(executor.submit(encrypt_crypt4gh_segments, block, session_key))
+                    while len(pending) >= 2 * processes or (len(pending) != 0 and pending[0].done()):
+                        write_encrypted(pending.popleft().result())
+                while pending:
+                    write_encrypted(pending.popleft().result())
+    except Exception as e:
+        print('could not encrypt {0}: {1}'.format(file_path, e))
+        return 1, original_md5.hexdigest(), encrypted_md5.hexdigest()
+    return 0, original_md5.hexdigest(), encrypted_md5.hexdigest()
+
+
+def encrypt_stream(file_path, key, write, encryption='gpg', processes=1):
+    '''
+    (str, str, function, str, int) -> tuple
+    
+    Encrypts file_path with the encryption method in a single read of file_path, 
+    passes each block of the encrypted stream to write and returns a tuple with
+    an exit code (0 if successful) and the md5sums of the original and encrypted streams
+    
+    Parameters
+    ----------
+    - file_path (str): Path to the file to encrypt
+    - key (str): Path to the gpg keyring or to the Crypt4GH public key of the recipient
+    - write (function): Function called with each block of the encrypted stream
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    '''
+    
+    if encryption == 'crypt4gh':
+        return crypt4gh_encrypt_stream(file_path, key, write, processes)
+    return gpg_encrypt_stream(file_path, key, write)
+
+
+def encrypt_file(file_path, outfile, key, encryption='gpg', processes=1, record_file=None):
+    '''
+    (str, str, str, str, int, str or None) -> int
+    
+    Encrypts file_path into outfile.gpg (or outfile.c4gh) in a single read of file_path,
+    writes the md5sums of the original and encrypted files to outfile.md5 and 
+    outfile.gpg.md5 (or outfile.c4gh.md5) and returns 0 if encryption is successful. 
+    Md5 files are written only if encryption is successful. The exit code, checksums
+    and byte counts are written to record_file when encryption is done
+    
+    Parameters
+    ----------
+    - file_path (str): Path to the file to encrypt
+    - outfile (str): Path of the output files, without extension
+    - key (str): Path to the gpg keyring or to the Crypt4GH public key of the recipient
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - record_file (str or None): Path to the completion record of the encryption
+    '''
+    
+    encrypted_file = outfile + encryption_extensions[encryption]
+    
+    # remove md5 files of a previous encryption
+    for i in [outfile + '.md5', encrypted_file + '.md5']:
+        if os.path.isfile(i):
+            os.remove(i)
+    
+    try:
+        with open(encrypted_file + '.part', 'wb') as newfile:
+            exit_code, original_md5, encrypted_md5 = encrypt_stream(file_path, key, newfile.write, encryption, processes)
+    except (IOError, OSError) as e:
+        # the last blocks are written when the file is closed and may not fit on disk
+        print('could not write {0}: {1}'.format(encrypted_file + '.part', e))
+        exit_code = 1
+    
+    if exit_code != 0:
+        if os.path.isfile(encrypted_file + '.part'):
+            os.remove(encrypted_file + '.part')
+        if record_file != None:
+            write_completion_record(record_file, {'exitCode': exit_code})
+        return exit_code
+    
+    # write the encrypted file and md5sums only after encryption is complete
+    os.replace(encrypted_file + '.part', encrypted_file)
+    write_md5(encrypted_file + '.md5', encrypted_md5)
+    write_md5(outfile + '.md5', original_md5)
+    if record_file != None:
+        write_completion_record(record_file, {'exitCode': 0, 'unencryptedChecksum': original_md5, 'checksum': encrypted_md5,
+                                              'encryptedName': os.path.basename(encrypted_file), 'size': os.path.getsize(file_path),
+                                              'encryptedSize': os.path.getsize(encrypted_file)})
+    return 0
+
+
+def encrypt_and_checksum(credential_file, database, table, box, alias, ega_object, file_paths, file_names, key_ring, outdir, mem, encryption='gpg', processes=1, alias_parallel=4, batch=None):
+    '''
+    (str, str, str, str, str, str, list, list, str, str, int, str, int, int, dict or None) -> list
+    
+    Launch jobs to encrypt files under alias and returns a list job exit codes specifying
+    if the jobs were launched successfully or not. Each file is encrypted and checksummed
+    in a single job reading the file only once. Up to alias_parallel files are encrypted
+    at once and each job writes a completion record when done. Jobs are added to batch
+    instead of being launched if batch is provided
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Database storing information required for registration of EGA objects
+    - table (str): Table in database storing information about the files to encrypt
+    - box (str): EGA submission box (ega-box-xxx)
+    - alias (str): Unique identifier of the files in Table
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - file_paths (list): List of file paths for the given alias
+    - file_names (list): List of file names used for registration of files under alias 
+                         (ie. file names may be different than the file paths basenames)
+    - key_ring (str): Path to the key used for encryption
+    - outdir (str): Directory in which the encrypted files are written
+    - mem (int): Job memory requirement
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - alias_parallel (int): Maximum number of files of alias encrypted at once
+    - batch (dict or None): Dictionary with the tasks of each stage of an array job batch
+    '''
+
+    MyCmd1 = 'module load gaea; Gaea encrypt_file -f {0} -o {1} -k {2} -e {3} -p {4} -r {5}'
+    alias_parallel = max(1, alias_parallel)
+    
+    # check that lists of file paths and names have the same number of entries
+    if len(file_paths) != len(file_names):
+        return [-1]
+    else:
+        # make a list to store the job names and job exit codes
+        job_exits, job_names = [], []
+        # loop over files for that alias      
+        for i in range(len(file_paths)):
+            # check that FileName is valid
+            if os.path.isfile(file_paths[i]) == False:
+                # return error that will be caught if file doesn't exist
+                return [-1] 
+            else:
+                # check if OutDir exist
+                if os.path.isdir(outdir) == False:
+                    return [-1] 
+                else:
+                    # make a directory to save the scripts
+                    qsubdir = os.path.join(outdir, 'qsubs')
+                    os.makedirs(qsubdir, exist_ok=True)
+                    # create a log dir
+                    logdir = os.path.join(qsubdir, 'log')
+                    os.makedirs(logdir, exist_ok=True)
+                    # get name of output file
+                    outfile = os.path.join(outdir, file_names[i])
+                    JobName1 = 'Encrypt.{0}'.format(alias + '__' + file_names[i])
+                    # mark the encryption as pending
+                    record_file = get_completion_record_file(outdir, JobName1)
+                    start_completion_records(outdir, [JobName1])
+                    # add the task to the batch, launched later as a single array job
+                    if batch != None:
+                        add_batch_task(batch, 'Encrypt', JobName1, logdir, MyCmd1.format(file_paths[i], outfile, key_ring, encryption, processes, record_file))
+                        job_exits.append(0)
+                        job_names.append(JobName1)
+                        continue
+                    # put commands in shell script
+                    BashScript1 = os.path.join(qsubdir, alias + '_' + file_names[i] + '_encrypt.sh')
+                    with open(BashScript1, 'w') as newfile:
+                        newfile.write(MyCmd1.format(file_paths[i], outfile, key_ring, encryption, processes, record_file) + '\n')
+        
+                    # launch qsub directly, collect job names and exit codes
+                    # files are encrypted in alias_parallel concurrent chains
+                    if i < alias_parallel:
+                        job1 = submit_job(JobName1, BashScript1, logdir, mem)
+                    else:
+                        # launch job when the previous job of the same chain is done
+                        job1 = submit_job(JobName1, BashScript1, logdir, mem, [job_names[i - alias_parallel]])
+                            
+                    # store job names and exit codes
+                    job_exits.append(job1)
+                    job_names.append(JobName1)
+        
+        return job_exits
+
+
+
+def count_encryption_slots(credential_file, database, box, alias_parallel):
+    '''
+    (str, str, str, int) -> int
+    
+    Returns the number of files of the box that can be encrypted at once by 
+    the aliases with encrypting status in the analyses and runs tables
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of the database storing information required for registration of EGA objects
+    - box (str): EGA submission box (ega-box-xxxx)
+    - alias_parallel (int): Maximum number of files of an alias encrypted at once
+    '''
+    
+    slots = 0
+    tables = show_tables(credential_file, database)
+    for table in ['Analyses', 'Runs']:
+        if table in tables:
+            conn = connect_to_database(credential_file, database)
+            cur = conn.cursor()
+            cur.execute('SELECT {0}.files FROM {0} WHERE {0}.Status=\"encrypting\" AND {0}.egaBox=\"{1}\"'.format(table, box))
+            data = cur.fetchall()
+            conn.close()
+            for i in data:
+                # each alias encrypts up to alias_parallel files at once
+                files = json.loads(i[0].replace("'", "\""))
+                slots += min(len(files), max(1, alias_parallel))
+    return slots
+
+
+def encrypt_files(credential_file, database, table, ega_object, box, key_ring, mem, disk_space, working_dir, encryption='gpg', processes=1, alias_parallel=4, box_parallel=16, array_jobs=False):
+    '''
+    (str, str, str, str, str, str, int, str, str, str, int, int, int, bool) -> None
+    
+    Encrypt files for all alises of the EGA objects if diskspace (in TB) remains available
+    after encryption and update file status to encrypting if encryption and md5sum
+    jobs are successfully launched. The files of an alias are encrypted in parallel,
+    up to alias_parallel files per alias and box_parallel files for the box
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of the database storing information required for registration of EGA objects
+    - table (str): Table in database
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - box (str): EGA submission box (ega-box-xxxx)
+    - key_ring (str): Path to the keys required for encryption
+    - mem (int): Required memory for the encryption jobs
+    - disk_space (int): Disk space (in TB) available in scratch after encryption is complete  
+    - working_dir (str): Directory containing directories with encrypted files
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - alias_parallel (int): Maximum number of files of an alias encrypted at once
+    - box_parallel (int): Maximum number of files of the box encrypted at once
+    - array_jobs (bool): Launch the jobs of all aliases as array jobs if True
+    '''
+    
+    # collect the jobs of all aliases in a batch of array jobs
+    batch = {} if array_jobs else None
+    batch_aliases = []
+    
+    # create a list of aliases for encryption 
+    aliases = select_aliases_for_encryption(credential_file, database, table, box, disk_space, working_dir)
+    # an alias never encrypts more files at once than the box
+    alias_parallel = max(1, min(alias_parallel, box_parallel))
+    # count the files of the box that can be encrypted
+    available_slots = box_parallel - count_encryption_slots(credential_file, database, box, alias_parallel)
+    
+    # check if Table exist
+    tables = show_tables(credential_file, database)
+    if table in tables:
+        # connect to database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        # pull alias, files and working directory for status = encrypt
+        cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory FROM {0} WHERE {0}.Status=\"encrypt\" AND {0}.egaBox=\"{1}\"'.format(table, box))
+        data = cur.fetchall()
+        conn.close()
+        
+        # check that some files are in encrypt mode
+        if len(data) != 0:
+            for i in data:
+                alias = i[0]
+                # count the files of the alias encrypted at once
+                chains = max(1, min(len(json.loads(i[1].replace("'", "\""))), alias_parallel)) if alias in aliases else 0
+                # encrypt only files of aliases that were pre-selected
+                # and only if the box has slots for all the files encrypted at once by the alias
+                if alias in aliases and available_slots >= chains:
+                    # get working directory
+                    working_directory = get_working_directory(i[2], working_dir)
+                    # create working directory
+                    os.makedirs(working_directory, exist_ok=True)
+                    # convert single quotes to double quotes for str -> json conversion
+                    files = json.loads(i[1].replace("'", "\""))
+                    # create parallel lists of file paths and names
+                    file_paths, file_names = [] , [] 
+                    # loop over files for that alias
+                    for file in files:
+                        # get the filePath and fileName
+                        file_paths.append(files[file]['filePath'])
+                        file_names.append(files[file]['fileName'])
+
+                    # remove encrypted files if already exist in working directory
+                    # it generates an error if encrypted files are present and encryption starts again
+                    # make a list of files in working directory
+                    current_encrypted = [os.path.join(working_directory, j) for j in os.listdir(working_directory) if remove_encryption_extension(j) != j] 
+                    for j in current_encrypted:
+                        os.remove(j)
+                    
+                    # update status -> encrypting
+                    conn = connect_to_database(credential_file, database)
+                    cur = conn.cursor()
+                    cur.execute('UPDATE {0} SET {0}.Status=\"encrypting\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box))
+                    conn.commit()
+                    conn.close()
+
+                    # encrypt and run md5sums on original and encrypted files
+                    # jobs of an alias are added to the batch only if all jobs can be launched
+                    alias_batch = {} if array_jobs else None
+                    job_codes = encrypt_and_checksum(credential_file, database, table, box, alias, ega_object, file_paths, file_names, key_ring, working_directory, mem, encryption, processes, alias_parallel, alias_batch)
+                    available_slots -= chains
+                    # check if encription was launched successfully
+                    if len(set(job_codes)) == 1 and list(set(job_codes))[0] == 0:
+                        if array_jobs:
+                            for stage in alias_batch:
+                                for task in alias_batch[stage]:
+                                    add_batch_task(batch, stage, *task)
+                            batch_aliases.append(alias)
+                    else:
+                        # store error message, reset status encrypting --> encrypt
+                        error = 'Could not launch encryption jobs'
+                        conn = connect_to_database(credential_file, database)
+                        cur = conn.cursor()
+                        cur.execute('UPDATE {0} SET {0}.Status=\"encrypt\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
                         conn.commit()
                         conn.close()
+            
+            # launch the encryption jobs of all aliases as array jobs
+            if array_jobs and len(batch_aliases) != 0:
+                job_codes = submit_job_batch(credential_file, database, batch, ['Encrypt'], '{0}.{1}'.format(box, table), os.path.join(working_dir, 'qsubs'), mem, {'Encrypt': box_parallel})
+                if not (len(set(job_codes)) == 1 and list(set(job_codes))[0] == 0):
+                    # store error message, reset status encrypting --> encrypt
+                    error = 'Could not launch encryption jobs'
+                    conn = connect_to_database(credential_file, database)
+                    cur = conn.cursor()
+                    for alias in batch_aliases:
+                        cur.execute('UPDATE {0} SET {0}.Status=\"encrypt\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+                    conn.commit()
+                    conn.close()
  
         
 
-def check_encryption(credential_file, database, table, box, alias, ega_object, job_names, working_dir):
+def get_file_checksums(files, working_directory, ega_object, encrypted_copy=True):
+    '''
+    (dict, str, str, bool) -> dict
+    
+    Returns a dictionary with the path, md5sums and encrypted file name of each file
+    in files, using the md5 files written in working_directory during encryption.
+    Returns an empty dictionary if the md5sums of any file are not available
+    
+    Parameters
+    ----------
+    - files (dict): Dictionary with the alias' files information
+    - working_directory (str): Directory where encrypted and md5 files are written
+    - ega_object (str): Registered object at the EGA. Accepted values: analyses, runs
+    - encrypted_copy (bool): Requires the encrypted file in working_directory if True.
+                             Files streamed to the staging server are not written to disk
+    '''
+    
+    # create a dict to store the updated file info
+    file_info = {}
+    
+    for file in files:
+        # get the fileName
+        file_name = files[file]['fileName']
+        # get the name of the encrypted file, files may be encrypted with gpg or crypt4gh
+        encrypted_name = file_name + encryption_extensions['gpg']
+        for extension in encryption_extensions.values():
+            if os.path.isfile(os.path.join(working_directory, file_name + extension)) or os.path.isfile(os.path.join(working_directory, file_name + extension + '.md5')):
+                encrypted_name = file_name + extension
+        # check that encrypted and md5sum files do exist
+        original_md5_file = os.path.join(working_directory, file_name + '.md5')
+        encrypted_md5_file = os.path.join(working_directory, encrypted_name + '.md5')
+        encrypted_file = os.path.join(working_directory, encrypted_name)
+        if not (os.path.isfile(original_md5_file) and os.path.isfile(encrypted_md5_file)):
+            return {}
+        if encrypted_copy and not os.path.isfile(encrypted_file):
+            return {}
+        # get the md5sums
+        with open(encrypted_md5_file) as infile:
+            encryptedMd5 = infile.readline().rstrip()
+        with open(original_md5_file) as infile:
+            originalMd5 = infile.readline().rstrip()
+        if encryptedMd5 == '' or originalMd5 == '':
+            return {}
+        # capture md5sums, build updated dict
+        file_info[file] = {'filePath': file, 'unencryptedChecksum': originalMd5, 'encryptedName': encrypted_name, 'checksum': encryptedMd5}
+        if ega_object == 'analyses':
+            file_info[file]['fileTypeId'] = files[file]['fileTypeId']
+    return file_info
+
+
+def check_encryption(credential_file, database, table, box, alias, ega_object, job_names, working_dir):
+    '''
+    (file, str, str, str, str, str, str) -> None
+
+    Take the file with DataBase credentials, a semicolon-seprated string of job
+    names used for encryption and md5sum of all files under the Alias of Object,
+    extract information from Table regarding Alias with encrypting Status and update
+    status to upload and files with md5sums when encrypting is done
+
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of database
+    - table (str): Table in database
+    - box (str): EGA submission box (ega-box-xxxx)
+    - alias (str): Unique alias of EGA object
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - job_names (str): Semi-colon-separated string of job names used for the encryption of the files under alias
+    - working_dir (str): Directory where encrypted files are written 
+    '''        
+        
+    # make a list of job names
+    job_names = job_names.split(';')
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    
+    try:
+        cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory FROM {0} WHERE {0}.Status=\"encrypting\" AND {0}.egaBox=\"{1}\" AND {0}.alias=\"{2}\"'.format(table, box, alias))
+        data = cur.fetchall()
+    except:
+        data = []
+    conn.close()
+    # check that files are in encrypting mode for this Alias
+    if len(data) != 0:
+        data = data[0]
+        alias = data[0]
+        # get the working directory for that alias
+        working_directory = get_working_directory(data[2], working_dir)
+        # convert single quotes to double quotes for str -> json conversion
+        files = json.loads(data[1].replace("'", "\""))
+        # create boolean, update when md5sums and encrypted file not found or if jobs didn't exit properly 
+        encrypted = True
+        
+        # check the exit status of each encryption and md5sum jobs for that alias
+        exit_statuses = get_task_exit_statuses(credential_file, database, job_names)
+        for job in job_names:
+            if exit_statuses[job] != '0':
+                encrypted = False
+        
+        # check that files were encrypted and that md5sums were generated
+        file_info = get_file_checksums(files, working_directory, ega_object)
+        if len(file_info) != len(files):
+            encrypted = False
+                
+        # check if md5sums and encrypted files is available for all files
+        if encrypted == True:
+            # update file info and status only if all files do exist and md5sums can be extracted
+            conn = connect_to_database(credential_file, database)
+            cur = conn.cursor()
+            cur.execute('UPDATE {0} SET {0}.files=\"{1}\", {0}.errorMessages=\"None\", {0}.Status=\"upload\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, str(file_info), alias, box))
+            conn.commit()
+            conn.close()
+        elif encrypted == False:
+            # reset status encrypting -- > encrypt, record error message
+            error = 'Encryption or md5sum did not complete'
+            conn = connect_to_database(credential_file, database)
+            cur = conn.cursor()
+            cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\", {0}.Status=\"encrypt\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+            conn.commit()
+            conn.close()
+    else:
+        # couldn't evaluate encryption, record error and reset to encrypt
+        # reset status encrypting -- > encrypt, record error message
+        error = 'Could not check encryption'
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\", {0}.Status=\"encrypt\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+        conn.commit()
+        conn.close()
+
+
+def get_completion_exit_codes(credential_file, database, records, working_directories):
+    '''
+    (str, str, dict, dict) -> dict
+    
+    Returns a dictionary with the exit code of each job in records. Jobs that finished
+    without writing their completion record are failed, jobs still queued or running
+    have no exit code. Jobs launched more than completion_timeout ago that are neither
+    queued nor in the accounting were deleted and are failed. Records of the jobs that
+    finished after records were read are updated in place
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - records (dict): Dictionary with the completion record of each job
+    - working_directories (dict): Dictionary with the directory of the alias processed by each job
+    '''
+    
+    codes, pending = {}, {}
+    for job_name in records:
+        if 'exitCode' in records[job_name]:
+            codes[job_name] = str(records[job_name]['exitCode'])
+        else:
+            # group pending jobs by launch time to ignore previous runs of the same jobs
+            launch = records[job_name].get('time', 0)
+            if launch not in pending:
+                pending[launch] = []
+            pending[launch].append(job_name)
+    
+    # look up the pending jobs in the job accounting
+    lost = []
+    for launch in pending:
+        exit_statuses = get_task_exit_statuses(credential_file, database, pending[launch], None, launch)
+        for job_name in exit_statuses:
+            if exit_statuses[job_name] == None:
+                codes[job_name] = None
+                # jobs deleted while queued never appear in the accounting
+                if time.time() - launch > completion_timeout:
+                    lost.append(job_name)
+                continue
+            # the job may have written its record and finished after records were read
+            record = read_completion_records(working_directories[job_name], [job_name]).get(job_name, {})
+            if 'exitCode' in record:
+                records[job_name] = record
+                codes[job_name] = str(record['exitCode'])
+            elif exit_statuses[job_name] == '0':
+                # job finished but could not write its record
+                codes[job_name] = '1'
+            else:
+                codes[job_name] = exit_statuses[job_name]
+    
+    # fail the jobs that are no longer queued or running
+    queued = get_queued_job_names() if len(lost) != 0 else None
+    if queued != None:
+        jobs = resolve_array_tasks(credential_file, database, lost)
+        for job_name in lost:
+            if job_name in queued or jobs[job_name][0] in queued:
+                continue
+            # the job may have finished since the accounting was read
+            record = read_completion_records(working_directories[job_name], [job_name]).get(job_name, {})
+            if 'exitCode' in record:
+                records[job_name] = record
+                codes[job_name] = str(record['exitCode'])
+            else:
+                codes[job_name] = '1'
+    return codes
+
+
+def check_encryption_records(credential_file, database, table, box, ega_object, working_dir):
+    '''
+    (str, str, str, str, str, str) -> None
+    
+    Updates status of all aliases in table with encrypting status to upload and
+    records their md5sums when all their encryption jobs completed successfully,
+    or resets status to encrypt if any job failed. Aliases are checked from the
+    completion records of their jobs and updated in bulk
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of database
+    - table (str): Table in database
+    - box (str): EGA submission box (ega-box-xxxx)
+    - ega_object (str): Registered object at the EGA. Accepted values: analyses, runs
+    - working_dir (str): Directory where encrypted files are written 
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory FROM {0} WHERE {0}.Status=\"encrypting\" AND {0}.egaBox=\"{1}\"'.format(table, box))
+        data = cur.fetchall()
+    except:
+        data = []
+    conn.close()
+    
+    # collect the completion records of the jobs of all aliases
+    aliases, records, working_directories = [], {}, {}
+    for i in data:
+        alias = i[0]
+        # convert single quotes to double quotes for str -> json conversion
+        files = json.loads(i[1].replace("'", "\""))
+        working_directory = get_working_directory(i[2], working_dir)
+        job_names = {file: 'Encrypt.{0}'.format(alias + '__' + files[file]['fileName']) for file in files}
+        alias_records = read_completion_records(working_directory, list(job_names.values()))
+        # aliases launched without completion records are checked with check_encryption
+        if len(alias_records) != len(job_names):
+            continue
+        aliases.append((alias, files, working_directory, job_names))
+        records.update(alias_records)
+        working_directories.update({job_name: working_directory for job_name in alias_records})
+    exit_codes = get_completion_exit_codes(credential_file, database, records, working_directories)
+    
+    # make lists of aliases to update
+    encrypted, failed = [], []
+    for alias, files, working_directory, job_names in aliases:
+        codes = [exit_codes[job_names[file]] for file in files]
+        # skip aliases with jobs still running
+        if None in codes:
+            continue
+        if set(codes) != {'0'}:
+            failed.append(('Encryption or md5sum did not complete', alias, box))
+            continue
+        # build the file info from the records, check that encrypted files exist
+        file_info = {}
+        for file in files:
+            record = records[job_names[file]]
+            if os.path.isfile(os.path.join(working_directory, record['encryptedName'])) == False:
+                break
+            file_info[file] = {'filePath': file, 'unencryptedChecksum': record['unencryptedChecksum'], 'encryptedName': record['encryptedName'], 'checksum': record['checksum']}
+            if ega_object == 'analyses':
+                file_info[file]['fileTypeId'] = files[file]['fileTypeId']
+        if len(file_info) != len(files):
+            failed.append(('Encryption or md5sum did not complete', alias, box))
+        else:
+            encrypted.append((str(file_info), alias, box))
+    
+    # update status of all checked aliases at once
+    if len(encrypted) != 0 or len(failed) != 0:
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        # update status encrypting -> upload and record file info
+        cur.executemany('UPDATE {0} SET {0}.files=%s, {0}.errorMessages=\"None\", {0}.Status=\"upload\" WHERE {0}.alias=%s AND {0}.egaBox=%s'.format(table), encrypted)
+        # reset status encrypting -- > encrypt, record error message
+        cur.executemany('UPDATE {0} SET {0}.errorMessages=%s, {0}.Status=\"encrypt\" WHERE {0}.alias=%s AND {0}.egaBox=%s'.format(table), failed)
+        conn.commit()
+        conn.close()
+
+
+def upload_alias_files(alias, host, files, stage_path, file_dir, credential_file, database, table, ega_object, box, mem, batch=None, **KeyWordParams):
+    '''
+    (str, str, dict, str, str, str, str, str, str, str, int, dict or None, dict) -> list
+    
+    Return a list of exit codes for the jobs used for uploading the encrypted and md5 files to stage_path.
+    Each upload job writes a completion record when done. Jobs are added to batch instead of
+    being launched if batch is provided
+    
+    Parameters
+    ----------
+    
+    - alias (str): Unique alias of the EGA object
+    - host (str): xfer host server
+    - files (dict): Dictionary with the alias' files information
+    - StagePath (str): Destination directory of the uploaded files on the box' staging server
+    - file_dir (str): Directory where encrypted files are located on the file system
+    - credential_file (str): File with EGA box and database creentials
+    - database (str): Name of the database storing information required for registering EGA objects
+    - table (str): Table in database with the EGA object information
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - box (str): EGA submission box (ega-box-xxx)
+    - mem (int): Memory requirement for the uploading job
+    - batch (dict or None): Dictionary with the tasks of each stage of an array job batch
+    - KeyWordParams (dict): Optional attributes table
+    '''
+    
+    # get box credentials
+    credentials = extract_credentials(credential_file)
+    
+    # write shell scripts with command
+    assert os.path.isdir(file_dir)
+    # make a directory to save the scripts
+    qsubdir = os.path.join(file_dir, 'qsubs')
+    os.makedirs(qsubdir, exist_ok=True)
+    # create a log dir
+    logdir = os.path.join(qsubdir, 'log')
+    os.makedirs(logdir, exist_ok=True)
+        
+    # command to upload files. requires aspera to be installed
+    upload_cmd = "ssh {0} \"export ASPERA_SCP_PASS={1};ascp -P33001 -O33001 -QT -l300M {2} {3}@fasp.ega.ebi.ac.uk:{4} && ascp -P33001 -O33001 -QT -l300M {5} {3}@fasp.ega.ebi.ac.uk:{4} && ascp -P33001 -O33001 -QT -l300M {6} {3}@fasp.ega.ebi.ac.uk:{4};\""
+    # write the completion record of the upload atomically
+    record_cmd = 'code=$?; mkdir -p {0}; echo "{{\\"exitCode\\": $code, \\"encryptedSize\\": {1}}}" > {2}.part && mv {2}.part {2}; exit $code'
+      
+    # create parallel lists to store the job names and exit codes
+    job_exits, job_names = [], []
+    
+    # make a list of file paths
+    file_paths = list(files.keys())
+    
+    # create destination directory in the session to the staging server
+    # do not evaluate the exit code, uploads fail if the directory cannot be created
+    make_directory_staging_server(host, box, credentials[box], stage_path)
+    
+    
+    # loop over filepaths
+    for i in range(len(file_paths)):
+        # get filename and encryptedname
+        fileName = os.path.basename(file_paths[i])
+        encryptedName = files[file_paths[i]]['encryptedName']
+        encryptedFile = os.path.join(file_dir, encryptedName)
+        originalMd5 = os.path.join(file_dir, remove_encryption_extension(encryptedName)  + '.md5')
+        encryptedMd5 = os.path.join(file_dir, encryptedName + '.md5')
+        if os.path.isfile(encryptedFile) and os.path.isfile(originalMd5) and os.path.isfile(encryptedMd5):
+            jobName = 'Upload.{0}'.format(alias + '__' + fileName)
+            # mark the upload as pending
+            record_file = get_completion_record_file(file_dir, jobName)
+            start_completion_records(file_dir, [jobName])
+            MyCmd = upload_cmd.format(host, credentials[box], encryptedMd5, box, stage_path, originalMd5, encryptedFile)
+            MyCmd += '; ' + record_cmd.format(os.path.dirname(record_file), os.path.getsize(encryptedFile), record_file)
+            # add the task to the batch, launched later as a single array job
+            if batch != None:
+                add_batch_task(batch, 'Upload', jobName, logdir, MyCmd)
+                job_exits.append(0)
+                job_names.append(jobName)
+                continue
+            # put command in a shell script    
+            BashScript = os.path.join(qsubdir, alias + '_' + remove_encryption_extension(encryptedName) + '_upload.sh')
+            newfile = open(BashScript, 'w')
+            newfile.write(MyCmd + '\n')
+            newfile.close()
+            # launch job directly
+            # hold until previous job is done
+            job = submit_job(jobName, BashScript, logdir, mem, job_names[-1:])
+            # store job exit code and name
+            job_exits.append(job)
+            job_names.append(jobName)
+        else:
+            return [-1]
+    
+    return job_exits
+
+
+def select_upload_aliases(credential_file, database, table, ega_object, box, status, **KeyWordParams):
+    '''
+    (str, str, str, str, str, str, dict) -> list
+    
+    Returns a list of tuples with alias, files, working directory, stage path
+    and project of all aliases in table with status for the given box
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - database (str): Name of database storing information required for registrating EGA objects
+    - table (str): Table in database storing information about the files to be uploaded
+    - ega_object (str): Registered object at the EGA. Accepted values: analyses, runs
+    - box (str): EGA submission box (ega-box-xxxx)
+    - status (str): Submission status of the aliases
+    - KeyWordParams (dict): Optional table attributes table
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+   
+    # check Object
+    if ega_object == 'analyses':
+        # retreieve attributes table
+        if 'attributes' in KeyWordParams:
+            attributes_table = KeyWordParams['attributes']
+        else:
+            attributes_table = 'empty'
+    
+        # extract files
+        try:
+            # extract files for alias with status for given box
+            cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory, {1}.StagePath, {0}.ProjectKey FROM {0} JOIN {1} WHERE {0}.Status=\"{2}\" AND {0}.egaBox=\"{3}\" AND {0}.AttributesKey = {1}.alias'.format(table, attributes_table, status, box))
+            data = cur.fetchall()
+        except:
+            data = []
+    elif ega_object == 'runs':
+        # extract files
+        try:
+            # extract files for alias with status for given box. runs are not assigned to projects
+            cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory, {0}.StagePath, \"NULL\" FROM {0} WHERE {0}.Status=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, status, box))
+            data = cur.fetchall()
+        except:
+            data = []
+    # close connection
+    conn.close()
+    return list(data)
+
+
+def create_upload_weights_table(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Creates the UploadWeights table storing the fair-share weights of boxes and
+    projects and the priority of aliases for upload if it doesn't already exist
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS UploadWeights (scope VARCHAR(100), name VARCHAR(255), \
+                weight DOUBLE, PRIMARY KEY (scope, name))')
+    conn.commit()
+    conn.close()
+
+
+def set_upload_weight(credential_file, database, scope, name, weight):
+    '''
+    (str, str, str, str, float) -> None
+    
+    Records the fair-share weight of a box or project, or the priority of an alias
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - scope (str): Scope of the weight. Accepted values: box, project, alias
+    - name (str): Name of the box, project or alias
+    - weight (float): Fair-share weight of the box or project, or priority of the alias
+    '''
+    
+    # weights are relative shares of the upload slots
+    if scope in ['box', 'project'] and weight <= 0:
+        raise ValueError('weight of {0} {1} must be positive'.format(scope, name))
+    
+    create_upload_weights_table(credential_file, database)
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('REPLACE INTO UploadWeights (scope, name, weight) VALUES (%s, %s, %s)', (scope, name, weight))
+    conn.commit()
+    conn.close()
+
+
+def get_upload_weights(cur):
+    '''
+    (pymysql.cursors.Cursor) -> dict
+    
+    Returns a dictionary with the weights of each name for each scope
+    recorded in the UploadWeights table
+    
+    Parameters
+    ----------
+    - cur (pymysql.cursors.Cursor): Cursor of a connection to the submission database
+    '''
+    
+    D = {'box': {}, 'project': {}, 'alias': {}}
+    cur.execute('SELECT UploadWeights.scope, UploadWeights.name, UploadWeights.weight FROM UploadWeights')
+    for scope, name, weight in cur.fetchall():
+        if scope in D:
+            D[scope][name] = float(weight)
+    return D
+
+
+def get_fair_shares(demands, weights, capacity):
+    '''
+    (dict, dict, int) -> dict
+    
+    Returns a dictionary with the number of slots allocated to each key of demands
+    by weighted max-min fair share of capacity. Slots not needed by a key are
+    shared among the other keys so that capacity is used if there is demand
+    
+    Parameters
+    ----------
+    - demands (dict): Dictionary with the number of slots needed by each key
+    - weights (dict): Dictionary with the weight of each key. Default weight is 1
+    - capacity (int): Number of slots to allocate
+    '''
+    
+    shares = {key: 0 for key in demands}
+    for i in range(capacity):
+        # give the next slot to the key with the smallest weighted share
+        candidates = [key for key in demands if shares[key] < demands[key]]
+        if len(candidates) == 0:
+            break
+        key = min(candidates, key=lambda j: (shares[j] / weights.get(j, 1), j))
+        shares[key] += 1
+    return shares
+
+
+def order_upload_aliases(aliases, projects, in_use, weights):
+    '''
+    (list, dict, dict, dict) -> list
+    
+    Returns aliases in the order they should be granted upload slots. Projects
+    take turns by weighted fair share, counting the slots they already hold,
+    and aliases of a project are ordered by decreasing priority
+    
+    Parameters
+    ----------
+    - aliases (list): List of aliases ready for upload
+    - projects (dict): Dictionary with the project of each alias
+    - in_use (dict): Dictionary with the number of slots held by each project of the box
+    - weights (dict): Dictionary with the weights of each name for each scope
+    '''
+    
+    # make a queue of aliases for each project, highest priority first
+    queues = {}
+    for alias in aliases:
+        project = projects.get(alias, 'NULL')
+        if project not in queues:
+            queues[project] = []
+        queues[project].append(alias)
+    for project in queues:
+        queues[project].sort(key=lambda j: -weights['alias'].get(j, 0))
+    
+    # take the next alias of the project with the smallest weighted share
+    held = {project: in_use.get(project, 0) for project in queues}
+    ordered = []
+    while len(queues) != 0:
+        project = min(queues, key=lambda j: (held[j] / weights['project'].get(j, 1), -weights['alias'].get(queues[j][0], 0), j))
+        ordered.append(queues[project].pop(0))
+        held[project] += 1
+        if len(queues[project]) == 0:
+            del queues[project]
+    return ordered
+
+
+def create_upload_slots_table(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Creates the UploadSlots table recording the aliases of each box and table
+    currently uploading files if it doesn't already exist
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS UploadSlots (egaBox VARCHAR(100), egaTable VARCHAR(100), \
+                alias VARCHAR(255), project VARCHAR(255), acquiredTime BIGINT, PRIMARY KEY (egaBox, egaTable, alias))')
+    conn.commit()
+    conn.close()
+
+
+def acquire_upload_slots(credential_file, database, table, box, aliases, status, max_box, max_total, projects=None, footprint_table=None, max_footprint=None):
+    '''
+    (str, str, str, str, list, str, int, int, dict or None, str or None, float or None) -> list
+    
+    Returns the list of aliases in aliases granted an upload slot. Slots of all boxes
+    are allocated by weighted fair share across the boxes with aliases waiting for upload
+    in the analyses and runs tables, up to max_box slots for the box and max_total slots for all boxes. Aliases of boxes
+    at or above max_footprint cannot upload and do not count in the demand of their box. Within the box,
+    projects take turns by weighted fair share and aliases are taken by priority.
+    Status of the granted aliases is updated from status to uploading. Each alias
+    uploads its files one at a time and holds a single slot until its upload is checked
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - table (str): Table in database storing information about the files to be uploaded
+    - box (str): EGA submission box (ega-box-xxxx)
+    - aliases (list): List of aliases ready for upload
+    - status (str): Current status of the aliases
+    - max_box (int): Maximum number of aliases of the box uploading at once
+    - max_total (int): Maximum number of aliases of all boxes uploading at once
+    - projects (dict or None): Dictionary with the project of each alias
+    - footprint_table (str or None): Table storing the footprint of the files on the boxes' staging servers
+    - max_footprint (float or None): Maximum footprint authorized on each box's staging server (in Tb)
+    '''
+    
+    if projects == None:
+        projects = {}
+    
+    create_upload_slots_table(credential_file, database)
+    create_upload_weights_table(credential_file, database)
+    # slots are shared by the aliases of the analyses and runs tables
+    tables = show_tables(credential_file, database)
+    upload_tables = [i for i in ['Analyses', 'Runs'] if i in tables or i == table]
+    
+    granted = []
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    # serialize slot acquisition across concurrent register runs
+    cur.execute('SELECT GET_LOCK(\"{0}.UploadSlots\", 600)'.format(database))
+    # no slot is granted if the lock is not acquired, aliases are retried at the next run
+    if cur.fetchall()[0][0] != 1:
+        conn.close()
+        return granted
+    try:
+        # free the slots of aliases that are no longer uploading. slots are released when
+        # upload is checked, but status may also be reset manually 
+        cur.execute('DELETE FROM UploadSlots WHERE UploadSlots.egaBox=\"{0}\" AND UploadSlots.egaTable=\"{1}\" \
+                    AND UploadSlots.alias NOT IN (SELECT {1}.alias FROM {1} WHERE {1}.Status=\"uploading\" AND {1}.egaBox=\"{0}\")'.format(box, table))
+        # count the slots in use by box and by project of the box
+        cur.execute('SELECT UploadSlots.egaBox, UploadSlots.project, COUNT(*) FROM UploadSlots GROUP BY UploadSlots.egaBox, UploadSlots.project')
+        in_use, project_use = {}, {}
+        for i in cur.fetchall():
+            in_use[i[0]] = in_use.get(i[0], 0) + int(i[2])
+            if i[0] == box:
+                project_use[i[1]] = int(i[2])
+        # count the aliases of all boxes waiting for upload in the tables sharing the slots
+        # demand is counted over the same tables as the slots in use
+        waiting = {}
+        for i in upload_tables:
+            cur.execute('SELECT {0}.egaBox, COUNT(*) FROM {0} WHERE {0}.Status=\"{1}\" GROUP BY {0}.egaBox'.format(i, status))
+            for j in cur.fetchall():
+                # aliases of the box waiting in table are the aliases ready for upload
+                if not (i == table and j[0] == box):
+                    waiting[j[0]] = waiting.get(j[0], 0) + int(j[1])
+        # boxes over their footprint cannot use their share
+        if footprint_table != None and max_footprint != None:
+            try:
+                cur.execute('SELECT {0}.egaBox FROM {0} WHERE {0}.location=\"All\" AND CAST({0}.SizeNotRegistered AS DECIMAL(30)) >= %s'.format(footprint_table), (max_footprint * 10**12,))
+                full = [i[0] for i in cur.fetchall()]
+            except:
+                full = []
+            for i in full:
+                waiting.pop(i, None)
+        waiting[box] = waiting.get(box, 0) + len(aliases)
+        weights = get_upload_weights(cur)
+        
+        # allocate all slots across boxes, boxes without demand leave their share to the others
+        demands = {i: in_use.get(i, 0) + waiting.get(i, 0) for i in set(in_use).union(set(waiting))}
+        demands[box] = min(demands[box], max_box)
+        shares = get_fair_shares(demands, weights['box'], max_total)
+        available = min(shares[box] - in_use.get(box, 0), max_total - sum(in_use.values()))
+        
+        for alias in order_upload_aliases(aliases, projects, project_use, weights):
+            if len(granted) >= available:
+                break
+            # update status -> uploading unless the alias was taken by another run
+            cur.execute('UPDATE {0} SET {0}.Status=\"uploading\", {0}.errorMessages=\"None\" WHERE {0}.alias=%s AND {0}.egaBox=%s AND {0}.Status=%s'.format(table), (alias, box, status))
+            if cur.rowcount == 1:
+                cur.execute('INSERT INTO UploadSlots (egaBox, egaTable, alias, project, acquiredTime) VALUES (%s, %s, %s, %s, %s)', (box, table, alias, projects.get(alias, 'NULL'), int(time.time())))
+                granted.append(alias)
+        conn.commit()
+    finally:
+        cur.execute('SELECT RELEASE_LOCK(\"{0}.UploadSlots\")'.format(database))
+        conn.close()
+    
+    return granted
+
+
+def release_upload_slots(credential_file, database, table, box, aliases):
     '''
-    (file, str, str, str, str, str, str) -> None
+    (str, str, str, str, list) -> None
+    
+    Releases the upload slots held by aliases of table in box
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - table (str): Table in database storing information about the files to be uploaded
+    - box (str): EGA submission box (ega-box-xxxx)
+    - aliases (list): List of aliases done uploading
+    '''
+    
+    if len(aliases) != 0:
+        create_upload_slots_table(credential_file, database)
+        # connect to database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        cur.executemany('DELETE FROM UploadSlots WHERE UploadSlots.egaBox=%s AND UploadSlots.egaTable=%s AND UploadSlots.alias=%s', [(box, table, alias) for alias in aliases])
+        conn.commit()
+        conn.close()
 
-    Take the file with DataBase credentials, a semicolon-seprated string of job
-    names used for encryption and md5sum of all files under the Alias of Object,
-    extract information from Table regarding Alias with encrypting Status and update
-    status to upload and files with md5sums when encrypting is done
 
+def upload_object_files(credential_file, host, database, table, ega_object, footprint_table, box, mem, Max, max_footprint, working_dir, array_jobs=False, max_total=8, **KeyWordParams):
+    '''
+    (str, str, str, str, str, str, str, int, int, int, str, bool, int, dict) -> None
+    
+    Upload files of all aliases in table with upload status if upload slots
+    are available for the box
+    
     Parameters
     ----------
     - credential_file (str): File with EGA boxes and database credentials
-    - database (str): Name of database
-    - table (str): Table in database
-    - box (str): EGA submission box (ega-box-xxxx)
-    - alias (str): Unique alias of EGA object
+    - host (str): xfer host server
+    - database (str): Name of database storing information required for registrating EGA objects
+    - table (str): Table in database storing information about the files to be uploaded
     - ega_object (str): Registered object at the EGA. Accepted values:
                         studies, runs, samples, experiments, datasets, analyses, policies, dacs
-    - job_names (str): Semi-colon-separated string of job names used for the encryption of the files under alias
-    - working_dir (str): Directory where encrypted files are written 
-    '''        
-        
-    # make a list of job names
-    job_names = job_names.split(';')
+    - footprint_table (str): Table storing the footprint of uploaded files on the EGA box' staging server
+    - box (str): EGA submission box (ega-box-xxxx)
+    - mem (int): Memory requirement for uploading jobs
+    - Max (int): Maximum number of files of the box to upload at once
+    - max_footprint (int): Maximum footprint authorized on the EGA box's staging server
+    - working_dir (str): Directory containing the sub-directories for each EGA object
+    - array_jobs (bool): Launch the jobs of all aliases as array jobs if True
+    - max_total (int): Maximum number of files of all boxes to upload at once
+    - KeyWordParams (dict): Optional table attributes table
+    '''
     
-    # connect to database
-    conn = connect_to_database(credential_file, database)
-    cur = conn.cursor()
+    # collect the jobs of all aliases in a batch of array jobs
+    batch = {} if array_jobs else None
+    batch_aliases = []
     
-    try:
-        cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory FROM {0} WHERE {0}.Status=\"encrypting\" AND {0}.egaBox=\"{1}\" AND {0}.alias=\"{2}\"'.format(table, box, alias))
-        data = cur.fetchall()
-    except:
-        data = []
-    conn.close()
-    # check that files are in encrypting mode for this Alias
-    if len(data) != 0:
-        data = data[0]
-        alias = data[0]
-        # get the working directory for that alias
-        working_directory = get_working_directory(data[2], working_dir)
-        # convert single quotes to double quotes for str -> json conversion
-        files = json.loads(data[1].replace("'", "\""))
-        # create a dict to store the updated file info
-        file_info = {}
-                
-        # create boolean, update when md5sums and encrypted file not found or if jobs didn't exit properly 
-        encrypted = True
+    # extract files for alias in upload mode for given box
+    data = select_upload_aliases(credential_file, database, table, ega_object, box, 'upload', **KeyWordParams)
         
-        # check the exit status of each encryption and md5sum jobs for that alias
-        for job in job_names:
-            if get_job_exit_status(job) != '0':
-                encrypted = False
+    # get the footprint of non-registered files on the Box's staging server
+    not_registered = get_disk_space_staging_server(credential_file, database, footprint_table, box)
+    
+    # check that alias are ready for uploading and that staging server's limit is not reached 
+    if len(data) != 0 and 0 <= not_registered < max_footprint:
+        # acquire upload slots, update status upload -> uploading for the aliases granted a slot
+        granted = acquire_upload_slots(credential_file, database, table, box, [i[0] for i in data], 'upload', int(Max), int(max_total), {i[0]: i[4] for i in data}, footprint_table, max_footprint)
+        data = [i for i in data if i[0] in granted]
         
-        # check that files were encrypted and that md5sums were generated
-        for file in files:
-            # get the fileName
-            file_name = files[file]['fileName']
-            if ega_object == 'analyses':
-                file_typeId = files[file]['fileTypeId']
-            # check that encryoted and md5sum files do exist
-            original_md5_file = os.path.join(working_directory, file_name + '.md5')
-            encrypted_md5_file = os.path.join(working_directory, file_name + '.gpg.md5')
-            encrypted_file = os.path.join(working_directory, file_name + '.gpg')
-            if os.path.isfile(original_md5_file) and os.path.isfile(encrypted_md5_file) and os.path.isfile(encrypted_file):
-                # get the name of the encrypted file
-                encrypted_name = file_name + '.gpg'
-                # get the md5sums
-                with open(encrypted_md5_file) as infile:
-                    encryptedMd5 = infile.readline().rstrip()
-                with open(original_md5_file) as infile:
-                    originalMd5 = infile.readline().rstrip()
-                if encryptedMd5 != '' and originalMd5 != '':
-                    # capture md5sums, build updated dict
-                    if ega_object == 'analyses':
-                        file_info[file] = {'filePath': file, 'unencryptedChecksum': originalMd5, 'encryptedName': encrypted_name, 'checksum': encryptedMd5, 'fileTypeId': file_typeId} 
-                    elif ega_object == 'runs':
-                        file_info[file] = {'filePath': file, 'unencryptedChecksum': originalMd5, 'encryptedName': encrypted_name, 'checksum': encryptedMd5}
-                else:
-                    # update boolean
-                    encrypted = False
+        for i in data:
+            alias = i[0]
+            # get the file information, working directory and stagepath for that alias
+            files = json.loads(i[1].replace("'", "\""))
+            working_directory = get_working_directory(i[2], working_dir)
+            stage_path  = i[3]
+            
+            # upload files
+            # jobs of an alias are added to the batch only if all jobs can be launched
+            alias_batch = {} if array_jobs else None
+            job_codes = upload_alias_files(alias, host, files, stage_path, working_directory, credential_file, database, table, ega_object, box, mem, alias_batch, **KeyWordParams)
+                        
+            # check if upload launched properly for all files under that alias
+            if len(set(job_codes)) == 1 and list(set(job_codes))[0] == 0:
+                if array_jobs:
+                    for stage in alias_batch:
+                        for task in alias_batch[stage]:
+                            add_batch_task(batch, stage, *task)
+                    batch_aliases.append(alias)
             else:
-                # update boollean
-                encrypted = False
-                
-        # check if md5sums and encrypted files is available for all files
-        if encrypted == True:
-            # update file info and status only if all files do exist and md5sums can be extracted
-            conn = connect_to_database(credential_file, database)
-            cur = conn.cursor()
-            cur.execute('UPDATE {0} SET {0}.files=\"{1}\", {0}.errorMessages=\"None\", {0}.Status=\"upload\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, str(file_info), alias, box))
-            conn.commit()
-            conn.close()
-        elif encrypted == False:
-            # reset status encrypting -- > encrypt, record error message
-            error = 'Encryption or md5sum did not complete'
-            conn = connect_to_database(credential_file, database)
-            cur = conn.cursor()
-            cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\", {0}.Status=\"encrypt\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
-            conn.commit()
-            conn.close()
-    else:
-        # couldn't evaluate encryption, record error and reset to encrypt
-        # reset status encrypting -- > encrypt, record error message
-        error = 'Could not check encryption'
-        conn = connect_to_database(credential_file, database)
-        cur = conn.cursor()
-        cur.execute('UPDATE {0} SET {0}.errorMessages=\"{1}\", {0}.Status=\"encrypt\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
-        conn.commit()
-        conn.close()
+                # record error message, reset status same uploading --> upload
+                error = 'Could not launch upload jobs'
+                conn = connect_to_database(credential_file, database)
+                cur = conn.cursor()
+                cur.execute('UPDATE {0} SET {0}.Status=\"upload\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+                conn.commit()
+                conn.close()
+                release_upload_slots(credential_file, database, table, box, [alias])
+        
+        # launch the upload and check jobs of all aliases as array jobs
+        if array_jobs and len(batch_aliases) != 0:
+            job_codes = submit_job_batch(credential_file, database, batch, ['Upload'], '{0}.{1}'.format(box, table), os.path.join(working_dir, 'qsubs'), mem, {'Upload': int(Max)})
+            if not (len(set(job_codes)) == 1 and list(set(job_codes))[0] == 0):
+                # record error message, reset status same uploading --> upload
+                error = 'Could not launch upload jobs'
+                conn = connect_to_database(credential_file, database)
+                cur = conn.cursor()
+                for alias in batch_aliases:
+                    cur.execute('UPDATE {0} SET {0}.Status=\"upload\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+                conn.commit()
+                conn.close()
+                release_upload_slots(credential_file, database, table, box, batch_aliases)
+
+
+def open_upload_stream(host, box, password, stage_path, file_name):
+    '''
+    (str, str, str, str, str) -> subprocess.Popen
+    
+    Returns a process uploading its standard input to file_name in stage_path 
+    on the box' staging server through the xfer host. Destination directories
+    are created if they do not exist
+    
+    Parameters
+    ----------
+    - host (str): Xfer host server
+    - box (str): EGA submission box (ega-box-xxx)
+    - password (str): Password to connect to the EGA submission box
+    - stage_path (str): Destination directory of the uploaded file on the box' staging server
+    - file_name (str): Name of the uploaded file on the staging server
+    '''
+    
+    # aspera cannot read from a pipe, the stream is uploaded with curl over ftp
+    destination = 'ftp://ftp.ega.ebi.ac.uk/{0}/{1}'.format(stage_path.strip('/'), file_name)
+    upload_cmd = "ssh {0} \"curl --fail -sS --ftp-create-dirs -T - -u {1}:{2} {3}\"".format(host, box, password, destination)
+    return subprocess.Popen(upload_cmd, shell=True, stdin=subprocess.PIPE)
+
+
+def run_ftp_commands(host, box, password, stage_path, commands):
+    '''
+    (str, str, str, str, list) -> int
+    
+    Sends the ftp commands in stage_path on the box' staging server through
+    the xfer host and returns the exit code of curl
+    
+    Parameters
+    ----------
+    - host (str): Xfer host server
+    - box (str): EGA submission box (ega-box-xxx)
+    - password (str): Password to connect to the EGA submission box
+    - stage_path (str): Directory on the box' staging server in which the commands are sent
+    - commands (list): List of ftp commands
+    '''
+    
+    # commands are sent after moving to stage_path and before listing it
+    destination = 'ftp://ftp.ega.ebi.ac.uk/{0}/'.format(stage_path.strip('/'))
+    quotes = ' '.join(["-Q '{0}'".format(i) for i in commands])
+    ftp_cmd = "ssh {0} \"curl --fail -sS -o /dev/null {1} -u {2}:{3} {4}\"".format(host, quotes, box, password, destination)
+    return subprocess.call(ftp_cmd, shell=True)
 
 
-def upload_alias_files(alias, host, files, stage_path, file_dir, credential_file, database, table, ega_object, box, mem, **KeyWordParams):
+def stream_upload_file(credential_file, box, file_path, file_name, outdir, stage_path, key, host, encryption='gpg', processes=1, record_file=None):
     '''
-    (str, str, dict, str, str, str, str, str, str, str, int, dict) -> list
+    (str, str, str, str, str, str, str, str, str, int, str or None) -> int
     
-    Return a list of exit codes for the jobs used for uploading the encrypted and md5 files to stage_path 
+    Encrypts file_path straight into the upload to stage_path on the box' staging server
+    without writing the encrypted file to disk, writes the md5sums of the original 
+    and encrypted files in outdir, uploads the md5 files and returns 0 if all files
+    are successfully uploaded. The exit code, checksums and byte counts are written
+    to record_file when done
     
     Parameters
     ----------
+    - credential_file (str): File with EGA box and database credentials
+    - box (str): EGA submission box (ega-box-xxx)
+    - file_path (str): Path to the file to encrypt and upload
+    - file_name (str): Name of the file on the staging server, without encryption extension
+    - outdir (str): Directory in which the md5 files are written
+    - stage_path (str): Destination directory of the uploaded files on the box' staging server
+    - key (str): Path to the gpg keyring or to the Crypt4GH public key of the recipient
+    - host (str): Xfer host server
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - record_file (str or None): Path to the completion record of the upload
+    '''
+    
+    # write the completion record before returning the exit code
+    def done(exit_code, record=None):
+        if record_file != None:
+            record = {} if record == None else dict(record)
+            record['exitCode'] = exit_code
+            write_completion_record(record_file, record)
+        return exit_code
+    
+    # get box credentials
+    credentials = extract_credentials(credential_file)
+    
+    encrypted_name = file_name + encryption_extensions[encryption]
+    original_md5_file = os.path.join(outdir, file_name + '.md5')
+    encrypted_md5_file = os.path.join(outdir, encrypted_name + '.md5')
+    
+    # remove md5 files of a previous upload
+    for i in [original_md5_file, encrypted_md5_file]:
+        if os.path.isfile(i):
+            os.remove(i)
+    
+    # encrypt the file into the upload stream
+    # the file is uploaded under a temporary name and renamed only if encryption and upload succeed
+    # the remote upload may complete a truncated file when the stream stops
+    partial_name = encrypted_name + '.part'
+    upload = open_upload_stream(host, box, credentials[box], stage_path, partial_name)
+    # count the bytes sent to the staging server
+    encrypted_size = [0]
+    def write(block):
+        upload.stdin.write(block)
+        encrypted_size[0] += len(block)
+    exit_code, original_md5, encrypted_md5 = encrypt_stream(file_path, key, write, encryption, processes)
+    if exit_code != 0:
+        # stop the upload and remove the partial file from the staging server
+        upload.kill()
+        upload.wait()
+        run_ftp_commands(host, box, credentials[box], stage_path, ['DELE {0}'.format(partial_name)])
+        return done(exit_code)
+    try:
+        upload.stdin.close()
+    except (IOError, OSError):
+        pass
+    exit_code = upload.wait()
+    if exit_code != 0:
+        print('could not upload {0}'.format(encrypted_name))
+        run_ftp_commands(host, box, credentials[box], stage_path, ['DELE {0}'.format(partial_name)])
+        return done(exit_code)
+    # give the complete file its final name
+    exit_code = run_ftp_commands(host, box, credentials[box], stage_path, ['RNFR {0}'.format(partial_name), 'RNTO {0}'.format(encrypted_name)])
+    if exit_code != 0:
+        print('could not rename {0} to {1}'.format(partial_name, encrypted_name))
+        return done(exit_code)
+    print('Completed {0}'.format(encrypted_name))
+    
+    # write the md5sums and upload the md5 files
+    write_md5(encrypted_md5_file, encrypted_md5)
+    write_md5(original_md5_file, original_md5)
+    for md5_file in [encrypted_md5_file, original_md5_file]:
+        upload = open_upload_stream(host, box, credentials[box], stage_path, os.path.basename(md5_file))
+        with open(md5_file, 'rb') as infile:
+            upload.communicate(infile.read())
+        if upload.returncode != 0:
+            print('could not upload {0}'.format(os.path.basename(md5_file)))
+            return done(upload.returncode)
+        print('Completed {0}'.format(os.path.basename(md5_file)))
+    return done(0, {'unencryptedChecksum': original_md5, 'checksum': encrypted_md5, 'encryptedName': encrypted_name,
+                    'size': os.path.getsize(file_path), 'encryptedSize': encrypted_size[0]})
+
+
+def stream_alias_files(alias, host, files, stage_path, file_dir, credential_file, database, table, ega_object, box, key_ring, mem, encryption='gpg', processes=1, **KeyWordParams):
+    '''
+    (str, str, dict, str, str, str, str, str, str, str, str, int, str, int, dict) -> list
+    
+    Return a list of exit codes for the jobs encrypting the files of alias straight
+    into their upload to stage_path. Each job writes a completion record when done
     
+    Parameters
+    ----------
     - alias (str): Unique alias of the EGA object
     - host (str): xfer host server
     - files (dict): Dictionary with the alias' files information
-    - StagePath (str): Destination directory of the uploaded files on the box' staging server
-    - file_dir (str): Directory where encrypted files are located on the file system
+    - stage_path (str): Destination directory of the uploaded files on the box' staging server
+    - file_dir (str): Directory where md5 files are written on the file system
     - credential_file (str): File with EGA box and database creentials
     - database (str): Name of the database storing information required for registering EGA objects
     - table (str): Table in database with the EGA object information
-    - ega_object (str): Registered object at the EGA. Accepted values:
-                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - ega_object (str): Registered object at the EGA. Accepted values: analyses, runs
     - box (str): EGA submission box (ega-box-xxx)
+    - key_ring (str): Path to the gpg keyring or to the Crypt4GH public key of the recipient
     - mem (int): Memory requirement for the uploading job
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
     - KeyWordParams (dict): Optional attributes table
     '''
     
-    # get box credentials
-    credentials = extract_credentials(credential_file)
-    
-    # write shell scripts with command
-    assert os.path.isdir(file_dir)
     # make a directory to save the scripts
+    os.makedirs(file_dir, exist_ok=True)
     qsubdir = os.path.join(file_dir, 'qsubs')
     os.makedirs(qsubdir, exist_ok=True)
     # create a log dir
     logdir = os.path.join(qsubdir, 'log')
     os.makedirs(logdir, exist_ok=True)
-        
-    # command to upload files. requires aspera to be installed
-    upload_cmd = "ssh {0} \"export ASPERA_SCP_PASS={1};ascp -P33001 -O33001 -QT -l300M {2} {3}@fasp.ega.ebi.ac.uk:{4};ascp -P33001 -O33001 -QT -l300M {5} {3}@fasp.ega.ebi.ac.uk:{4};ascp -P33001 -O33001 -QT -l300M {6} {3}@fasp.ega.ebi.ac.uk:{4};\""
-      
-    # create parallel lists to store the job names and exit codes
-    job_exits, job_names = [], []
     
-    # make a list of file paths
-    file_paths = list(files.keys())
+    # command to encrypt and upload each file
+    upload_cmd = 'module load gaea; Gaea stream_upload -c {0} -b {1} -f {2} -n {3} -o {4} -sp {5} -k {6} -e {7} -p {8} -ht {9} -r {10}'
     
-    # create destination directory
-    make_dir_cmd = "ssh {0} \"lftp -u {1},{2} -e \\\" set ftp:ssl-allow false; mkdir -p {3}; bye;\\\" ftp://ftp.ega.ebi.ac.uk\""
-    # put commands in shell script
-    bashscript = os.path.join(qsubdir, alias + '_make_destination_directory.sh')
-    with open(bashscript, 'w') as newfile:
-        newfile.write(make_dir_cmd.format(host, box, credentials[box], stage_path))    
-    # launch job directly for the 1st file only
-    jobName = 'MakeDestinationDir.{0}'.format(alias)
-    qsub_cmd = "qsub -b y -P gsi -N {0} -e {1} -o {1} \"bash {2}\"".format(jobName, logdir, bashscript)
-    job = subprocess.call(qsub_cmd, shell=True)
-    # record job name but not exit code.
-    # may produce an error message if directory already exists. do not evaluate command during CheckUpload
-    job_names.append(jobName)
-        
+    # create parallel lists to store the job names and exit codes
+    job_exits, job_names = [], []
     
-    # loop over filepaths
-    for i in range(len(file_paths)):
-        # get filename and encryptedname
-        fileName = os.path.basename(file_paths[i])
-        encryptedName = files[file_paths[i]]['encryptedName']
-        encryptedFile = os.path.join(file_dir, encryptedName)
-        originalMd5 = os.path.join(file_dir, encryptedName[:-4]  + '.md5')
-        encryptedMd5 = os.path.join(file_dir, encryptedName + '.md5')
-        if os.path.isfile(encryptedFile) and os.path.isfile(originalMd5) and os.path.isfile(encryptedMd5):
-            MyCmd = upload_cmd.format(host, credentials[box], encryptedMd5, box, stage_path, originalMd5, encryptedFile)
-            # put command in a shell script    
-            BashScript = os.path.join(qsubdir, alias + '_' + encryptedName[:-4] + '_upload.sh')
-            newfile = open(BashScript, 'w')
-            newfile.write(MyCmd + '\n')
-            newfile.close()
-            # launch job directly
-            jobName = 'Upload.{0}'.format(alias + '__' + fileName)
-            # hold until previous job is done
-            qsub_cmd = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(job_names[-1], mem, jobName, logdir, BashScript)
-            job = subprocess.call(qsub_cmd, shell=True)
-            # store job exit code and name
-            job_exits.append(job)
-            job_names.append(jobName)
-        else:
+    for file_path in files:
+        # check that file exists
+        if os.path.isfile(file_path) == False:
             return [-1]
+        fileName = os.path.basename(file_path)
+        file_name = files[file_path]['fileName']
+        jobName = 'Upload.{0}'.format(alias + '__' + fileName)
+        # mark the upload as pending
+        record_file = get_completion_record_file(file_dir, jobName)
+        start_completion_records(file_dir, [jobName])
+        # put command in a shell script    
+        BashScript = os.path.join(qsubdir, alias + '_' + file_name + '_stream_upload.sh')
+        with open(BashScript, 'w') as newfile:
+            newfile.write(upload_cmd.format(credential_file, box, file_path, file_name, file_dir, stage_path, key_ring, encryption, processes, host, record_file) + '\n')
+        # launch job directly
+        if len(job_names) == 0:
+            job = submit_job(jobName, BashScript, logdir, mem)
+        else:
+            # hold until previous job is done
+            job = submit_job(jobName, BashScript, logdir, mem, [job_names[-1]])
+        # store job exit code and name
+        job_exits.append(job)
+        job_names.append(jobName)
     
-    # launch check upload job
-    if ega_object == 'analyses':
-        if 'attributes' in KeyWordParams:
-            attributes_table = KeyWordParams['attributes']
-        CheckCmd = 'sleep 600; module load gaea; Gaea check_upload -c {0} -s {1} -t {2} -b {3} -a {4} -j \"{5}\" -o {6} --Attributes {7} -ht {8}'
-    elif ega_object == 'runs':
-        CheckCmd = 'sleep 600; module load gaea; Gaea check_upload -c {0} -s {1} -t {2} -b {3} -a {4} -j \"{5}\" -o {6} -ht {7}' 
+    if len(job_names) == 0:
+        return [-1]
     
-    # do not check job used to make destination directory
-    job_names = job_names[1:]
-    # put commands in shell script
-    BashScript = os.path.join(qsubdir, alias + '_check_upload.sh')
-    with open(BashScript, 'w') as newfile:
-        if ega_object == 'analyses':
-            newfile.write(CheckCmd.format(credential_file, database, table, box, alias, ';'.join(job_names), ega_object, attributes_table, host) + '\n')
-        elif ega_object == 'runs':
-            newfile.write(CheckCmd.format(credential_file, database, table, box, alias, ';'.join(job_names), ega_object, host) + '\n')
-            
-    # launch qsub directly, collect job names and exit codes
-    JobName = 'CheckUpload.{0}'.format(alias)
-    # launch job when previous job is done
-    QsubCmd = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(job_names[-1], mem, JobName, logdir, BashScript)
-    job = subprocess.call(QsubCmd, shell=True)
-    # store the exit code (but not the job name)
-    job_exits.append(job)          
-        
     return job_exits
 
 
-def upload_object_files(credential_file, host, database, table, ega_object, footprint_table, box, mem, Max, max_footprint, working_dir, **KeyWordParams):
+def stream_object_files(credential_file, host, database, table, ega_object, footprint_table, box, key_ring, mem, Max, max_footprint, working_dir, encryption='gpg', processes=1, max_total=8, **KeyWordParams):
     '''
-    (str, str, str, str, str, str, str, int, int, int, str, dict) -> None
+    (str, str, str, str, str, str, str, str, int, int, int, str, str, int, int, dict) -> None
     
-    Upload files of all aliases in table with upload status 
+    Encrypt files of all aliases in table with encrypt status straight into their
+    upload to the staging server if upload slots are available for the box.
+    Encrypted files are not written to disk, only the md5 files are written
+    in the working directory of each alias
     
     Parameters
     ----------
@@ -2395,61 +4843,31 @@ def upload_object_files(credential_file, host, database, table, ega_object, foot
     - host (str): xfer host server
     - database (str): Name of database storing information required for registrating EGA objects
     - table (str): Table in database storing information about the files to be uploaded
-    - ega_object (str): Registered object at the EGA. Accepted values:
-                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - ega_object (str): Registered object at the EGA. Accepted values: analyses, runs
     - footprint_table (str): Table storing the footprint of uploaded files on the EGA box' staging server
     - box (str): EGA submission box (ega-box-xxxx)
+    - key_ring (str): Path to the gpg keyring or to the Crypt4GH public key of the recipient
     - mem (int): Memory requirement for uploading jobs
-    - Max (int): Maximum number of files to upload at once
+    - Max (int): Maximum number of files of the box to upload at once
     - max_footprint (int): Maximum footprint authorized on the EGA box's staging server
-    - working_dir (str): Directory containing the sub-directories for each EGA object
-    - KeyWordParams (dict): Optional table attributes table
-    '''
-    
-    # connect to database
-    conn = connect_to_database(credential_file, database)
-    cur = conn.cursor()
-   
-    # check Object
-    if ega_object == 'analyses':
-        # retreieve attributes table
-        if 'attributes' in KeyWordParams:
-            attributes_table = KeyWordParams['attributes']
-        else:
-            attributes_table = 'empty'
-    
-        # extract files
-        try:
-            # extract files for alias in upload mode for given box
-            cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory, {1}.StagePath FROM {0} JOIN {1} WHERE {0}.Status=\"upload\" AND {0}.egaBox=\"{2}\" AND {0}.AttributesKey = {1}.alias'.format(table, attributes_table, box))
-            # check that some alias are in upload mode
-            data = cur.fetchall()
-        except:
-            data = []
-    elif ega_object == 'runs':
-        # extract files
-        try:
-            # extract files for alias in upload mode for given box
-            cur.execute('SELECT {0}.alias, {0}.files, {0}.WorkingDirectory, {0}.StagePath FROM {0} WHERE {0}.Status=\"upload\" AND {0}.egaBox=\"{1}\"'.format(table, box))
-            # check that some alias are in upload mode
-            data = cur.fetchall()
-        except:
-            data = []
-    # close connection
-    conn.close()
-        
+    - working_dir (str): Directory containing the sub-directories for each EGA object
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - max_total (int): Maximum number of files of all boxes to upload at once
+    - KeyWordParams (dict): Optional table attributes table
+    '''
+    
+    # extract files for alias in encrypt mode for given box
+    data = select_upload_aliases(credential_file, database, table, ega_object, box, 'encrypt', **KeyWordParams)
+    
     # get the footprint of non-registered files on the Box's staging server
     not_registered = get_disk_space_staging_server(credential_file, database, footprint_table, box)
     
-    # check that alias are ready for uploading and that staging server's limit is not reached 
+    # scratch space is not used, only the staging server's limit is checked
     if len(data) != 0 and 0 <= not_registered < max_footprint:
-        # count the number of files being uploaded
-        uploading = int(subprocess.check_output('qstat | grep Upload | wc -l', shell=True).decode('utf-8').rstrip())        
-        # upload new files up to Max
-        maximum = int(Max) - uploading
-        if maximum < 0:
-            maximum = 0
-        data = data[: maximum]
+        # acquire upload slots, update status encrypt -> uploading for the aliases granted a slot
+        granted = acquire_upload_slots(credential_file, database, table, box, [i[0] for i in data], 'encrypt', int(Max), int(max_total), {i[0]: i[4] for i in data}, footprint_table, max_footprint)
+        data = [i for i in data if i[0] in granted]
         
         for i in data:
             alias = i[0]
@@ -2457,26 +4875,20 @@ def upload_object_files(credential_file, host, database, table, ega_object, foot
             files = json.loads(i[1].replace("'", "\""))
             working_directory = get_working_directory(i[2], working_dir)
             stage_path  = i[3]
-                            
-            # update status -> uploading
-            conn = connect_to_database(credential_file, database)
-            cur = conn.cursor()
-            cur.execute('UPDATE {0} SET {0}.Status=\"uploading\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\";'.format(table, alias, box))
-            conn.commit()
-            conn.close()
             
-            # upload files
-            job_codes = upload_alias_files(alias, host, files, stage_path, working_directory, credential_file, database, table, ega_object, box, mem, **KeyWordParams)
-                        
+            # encrypt and upload files
+            job_codes = stream_alias_files(alias, host, files, stage_path, working_directory, credential_file, database, table, ega_object, box, key_ring, mem, encryption, processes, **KeyWordParams)
+            
             # check if upload launched properly for all files under that alias
             if not (len(set(job_codes)) == 1 and list(set(job_codes))[0] == 0):
-                # record error message, reset status same uploading --> upload
+                # record error message, reset status same uploading --> encrypt
                 error = 'Could not launch upload jobs'
                 conn = connect_to_database(credential_file, database)
                 cur = conn.cursor()
-                cur.execute('UPDATE {0} SET {0}.Status=\"upload\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
+                cur.execute('UPDATE {0} SET {0}.Status=\"encrypt\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box))
                 conn.commit()
                 conn.close()
+                release_upload_slots(credential_file, database, table, box, [alias])
 
 
 def get_files_staging_server(box, password, directory, host):
@@ -2493,70 +4905,73 @@ def get_files_staging_server(box, password, directory, host):
     - host (str): Xfer host server
     '''
     
-    uploaded_files = subprocess.check_output("ssh {0} 'lftp -u {1},{2} -e \"set ftp:ssl-allow false; ls {3}; bye;\" ftp://ftp.ega.ebi.ac.uk'".format(host, box, password, directory), shell=True).decode('utf-8').rstrip().split('\n')
+    uploaded_files = get_staging_session(host, box, password).run('ls {0}'.format(directory))
     # get the file paths
-    for i in range(len(uploaded_files)):
-        uploaded_files[i] = uploaded_files[i].split()[-1]
-    return uploaded_files
+    return [i.split()[-1] for i in uploaded_files if i.strip() != '']
     
       
-def list_files_staging_server(credential_file, host, database, table, box, ega_object, **KeyWordParams):
+def create_staging_listings_table(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Creates the StagingListings table caching the files listed in each stage path
+    of the staging servers if it doesn't already exist
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
     '''
-    (str, str, str, str, str, str, dict) -> dict
     
-    Returns a dictionary with files on the EGA box' staging server for all aliases
-    in table with uploading status
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS StagingListings (egaBox VARCHAR(100), stagePath VARCHAR(255), \
+                files MEDIUMTEXT NULL, listTime BIGINT, PRIMARY KEY (egaBox, stagePath))')
+    conn.commit()
+    conn.close()
 
+
+def get_stage_path_files(credential_file, database, host, box, stage_path, since=0):
+    '''
+    (str, str, str, str, str, int) -> list
+    
+    Returns the list of files in stage_path on the staging server of box.
+    The listing is shared through the submission database and reused if it is 
+    more recent than since and not older than the listing cache lifetime
+    
     Parameters
     ----------
     - credential_file (str): File with EGA boxes and database credentials
-    - host (str) Xfer server host
     - database (str): Database storing information required for registration of EGA objects
-    - table (str): Table in database storing information about files to register
+    - host (str): Xfer host server
     - box (str): EGA submission box (ega-box-xxx)
-    - ega_object (str): Registered object at the EGA. Accepted values:
-                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
-    - KeyWordParams: Optional attributes table
+    - stage_path (str): Directory on the box' staging server
+    - since (int): Time (in seconds since epoch) after which the listing must have been made,
+                   ie the time the files of interest were uploaded
     '''
-        
-    # get credentials
+    
+    create_staging_listings_table(credential_file, database)
+    
+    # reuse a recent listing of the stage path
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('SELECT StagingListings.files, StagingListings.listTime FROM StagingListings WHERE StagingListings.egaBox=%s AND StagingListings.stagePath=%s', (box, stage_path))
+    data = cur.fetchall()
+    conn.close()
+    now = int(time.time())
+    if len(data) != 0 and int(data[0][1]) >= since and now - int(data[0][1]) <= staging_listing_ttl:
+        return json.loads(data[0][0])
+    
+    # list the stage path and share the listing
     credentials = extract_credentials(credential_file)
-        
-    # make a dict {directory: [files]}
-    files_box = {}
-        
-    # check that Analysis table exists
-    tables = show_tables(credential_file, database)
-    if table in tables:
-        # connect to database
-        conn = connect_to_database(credential_file, database)
-        cur = conn.cursor()
-        # extract files for alias in upload mode for given box
-        if ega_object == 'analyses':
-            if 'attributes' in KeyWordParams:
-                attributes_table = KeyWordParams['attributes']
-            else:
-                attributes_table = 'empty'
-            Cmd = 'SELECT {0}.alias, {1}.StagePath FROM {0} JOIN {1} WHERE {0}.AttributesKey = {1}.alias AND {0}.Status=\"uploading\" AND {0}.egaBox=\"{2}\"'.format(table, attributes_table, box)
-        elif ega_object == 'runs':
-            Cmd = 'SELECT {0}.alias, {0}.StagePath FROM {0} WHERE {0}.Status=\"uploading\" AND {0}.egaBox=\"{1}\"'.format(table, box)
-        
-        try:
-            cur.execute(Cmd)
-            data = cur.fetchall()
-        except:
-            data = []
-        conn.close()
-        
-        # check that some aliases have the proper status
-        if len(data) != 0:
-            # make a list of stagepath
-            stage_paths = list(set([i[1] for i in data]))
-            for i in stage_paths:
-                uploaded_files = get_files_staging_server(box, credentials[box], i, host)
-                # populate dict
-                files_box[i] = uploaded_files
-    return files_box
+    files = get_files_staging_server(box, credentials[box], stage_path, host)
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('REPLACE INTO StagingListings (egaBox, stagePath, files, listTime) VALUES (%s, %s, %s, %s)', (box, stage_path, json.dumps(files), now))
+    conn.commit()
+    conn.close()
+    return files
 
 
 def convert_to_tb(file_size):
@@ -2771,12 +5186,13 @@ def check_upload_success(logdir, alias, file_name):
         return False
     
     
-def check_upload_files(credential_file, host, database, table, box, ega_object, alias, job_names, working_dir, **KeyWordParams):
+def check_upload_files(credential_file, host, database, table, box, ega_object, alias, job_names, working_dir, stream=False, **KeyWordParams):
     '''
-    (str, str, str, str, str, str, str, str, dict) -> None
+    (str, str, str, str, str, str, str, str, bool, dict) -> None
     
     Updates status of alias from uploading to uploaded if all the files for
-    that alias were successfuly uploaded.  
+    that alias were successfuly uploaded. Files streamed to the staging server
+    are recorded with their md5sums when upload is successful  
     
     Parameters
     ----------
@@ -2790,12 +5206,17 @@ def check_upload_files(credential_file, host, database, table, box, ega_object,
     - alias (str): Unique identifier for the files in table
     - job_names (str): Semi-colon-separated string of job names used for uploading files under the alias
     - working_dir (str): Parent directory containing sub-folders where encrypted files are located 
+    - stream (bool): Files were encrypted straight into the upload if True.
+                     Status is reset to encrypt instead of upload if upload failed
     - KeyWordParams (str): Optional attributes table
     '''
 
-    # make a dict {directory: [files]} for alias with uploading status 
-    files_box = list_files_staging_server(credential_file, host, database, table, box, ega_object, **KeyWordParams)
-        
+    # streamed files are encrypted again if upload failed
+    if stream:
+        reset_status = 'encrypt'
+    else:
+        reset_status = 'upload'
+    
     # connect to database
     conn = connect_to_database(credential_file, database)
     cur = conn.cursor()
@@ -2839,18 +5260,40 @@ def check_upload_files(credential_file, host, database, table, box, ega_object,
                     uploaded = False
             
             # check the exit status of the jobs uploading files
+            exit_statuses = get_task_exit_statuses(credential_file, database, job_names.split(';'))
             for jobName in job_names.split(';'):
-                if get_job_exit_status(jobName) != '0':
+                if exit_statuses[jobName] != '0':
+                    uploaded = False
+            
+            # get the md5sums of the streamed files written during upload
+            if stream:
+                file_info = get_file_checksums(files, working_directory, ega_object, False)
+                if len(file_info) != len(files):
                     uploaded = False
+                    file_info = files
+                files = file_info
+            
+            # list the stage path of the alias after the upload logs were last written
+            since = max([int(os.path.getmtime(os.path.join(logdir, j))) for j in (os.listdir(logdir) if os.path.isdir(logdir) else []) if j.startswith('Upload.{0}__'.format(alias))] + [0])
+            try:
+                uploaded_files = get_stage_path_files(credential_file, database, host, box, stage_path, since)
+            except subprocess.CalledProcessError:
+                # leave the alias uploading if the jobs succeeded but the stage path cannot be listed
+                if uploaded:
+                    continue
+                uploaded_files = []
             
             # check if files are uploaded on the server
             for file_path in files:
                 # get filename
                 filename = os.path.basename(file_path)
+                if 'encryptedName' not in files[file_path]:
+                    uploaded = False
+                    continue
                 encryptedFile = files[file_path]['encryptedName']
-                originalMd5, encryptedMd5 = encryptedFile[:-4] + '.md5', encryptedFile + '.md5'                    
+                originalMd5, encryptedMd5 = remove_encryption_extension(encryptedFile) + '.md5', encryptedFile + '.md5'                    
                 for j in [encryptedFile, encryptedMd5, originalMd5]:
-                    if j not in files_box[stage_path]:
+                    if j not in uploaded_files:
                         uploaded = False
             
             # check if all files for that alias have been uploaded
@@ -2858,27 +5301,164 @@ def check_upload_files(credential_file, host, database, table, box, ega_object,
                 # connect to database, update status and close connection
                 conn = connect_to_database(credential_file, database)
                 cur = conn.cursor()
-                cur.execute('UPDATE {0} SET {0}.Status=\"uploaded\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box)) 
+                if stream:
+                    # record md5sums and encrypted file names of the streamed files
+                    cur.execute('UPDATE {0} SET {0}.files=\"{1}\", {0}.Status=\"uploaded\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, str(files), alias, box))
+                else:
+                    cur.execute('UPDATE {0} SET {0}.Status=\"uploaded\", {0}.errorMessages=\"None\" WHERE {0}.alias=\"{1}\" AND {0}.egaBox=\"{2}\"'.format(table, alias, box)) 
                 conn.commit()                                
                 conn.close()              
             elif uploaded == False:
-                # reset status uploading --> upload, record error message
+                # reset status uploading --> upload (or encrypt), record error message
                 error = 'Upload failed'
                 conn = connect_to_database(credential_file, database)
                 cur = conn.cursor()
-                cur.execute('UPDATE {0} SET {0}.Status=\"upload\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
+                cur.execute('UPDATE {0} SET {0}.Status=\"{1}\", {0}.errorMessages=\"{2}\" WHERE {0}.alias=\"{3}\" AND {0}.egaBox=\"{4}\"'.format(table, reset_status, error, alias, box)) 
                 conn.commit()                                
                 conn.close()
+            # release the upload slot of the alias
+            release_upload_slots(credential_file, database, table, box, [alias])
     else:
-        # reset status uploading --> upload, record error message
+        # reset status uploading --> upload (or encrypt), record error message
         error = 'Could not check uploaded files'
         conn = connect_to_database(credential_file, database)
         cur = conn.cursor()
-        cur.execute('UPDATE {0} SET {0}.Status=\"upload\", {0}.errorMessages=\"{1}\" WHERE {0}.alias=\"{2}\" AND {0}.egaBox=\"{3}\"'.format(table, error, alias, box)) 
+        cur.execute('UPDATE {0} SET {0}.Status=\"{1}\", {0}.errorMessages=\"{2}\" WHERE {0}.alias=\"{3}\" AND {0}.egaBox=\"{4}\"'.format(table, reset_status, error, alias, box)) 
         conn.commit()                                
         conn.close()
+        release_upload_slots(credential_file, database, table, box, [alias])
 
         
+def check_upload_records(credential_file, host, database, table, box, ega_object, working_dir, footprint_table, **KeyWordParams):
+    '''
+    (str, str, str, str, str, str, str, str, dict) -> None
+    
+    Updates status of all aliases in table with uploading status to uploaded when
+    all their upload jobs completed successfully and their files are on the staging
+    server, or resets status to upload (or encrypt for streamed files) if any job failed.
+    Aliases are checked from the completion records of their jobs and from the
+    listings of their stage paths shared between checks, and updated in bulk.
+    Uploaded files are added to the footprint of the box
+    
+    Parameters
+    ----------
+    - credential_file (str): File with EGA boxes and database credentials
+    - host (str): Xfer host server
+    - database (str): Database with information required for registering EGA objects
+    - table (str): Name of table in database
+    - box (str): EGA submission box (ega-box-xxx)
+    - ega_object (str): Registered object at the EGA. Accepted values: analyses, runs
+    - working_dir (str): Parent directory containing sub-folders where encrypted files are located 
+    - footprint_table (str): Table storing the footprint of uploaded files on the EGA box' staging server
+    - KeyWordParams (str): Optional attributes table
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    if ega_object == 'analyses':
+        if 'attributes' in KeyWordParams:
+            attributes_table = KeyWordParams['attributes']
+        else:
+            attributes_table = 'empty'
+        Cmd = 'SELECT {0}.alias, {0}.files, {0}.WorkingDirectory, {1}.StagePath FROM {0} JOIN {1} WHERE {0}.AttributesKey = {1}.alias AND {0}.Status=\"uploading\" AND {0}.egaBox=\"{2}\"'.format(table, attributes_table, box)
+    elif ega_object == 'runs':
+        Cmd = 'SELECT {0}.alias, {0}.files, {0}.WorkingDirectory, {0}.StagePath FROM {0} WHERE {0}.Status=\"uploading\" AND {0}.egaBox=\"{1}\"'.format(table, box)
+    try:
+        cur.execute(Cmd)
+        data = cur.fetchall()
+    except:
+        data = []
+    conn.close()
+    
+    # collect the completion records of the jobs of all aliases
+    aliases, records, working_directories = [], {}, {}
+    for i in data:
+        alias = i[0]
+        # convert single quotes to double quotes for str -> json conversion
+        files = json.loads(i[1].replace("'", "\""))
+        working_directory = get_working_directory(i[2], working_dir)
+        job_names = {file: 'Upload.{0}'.format(alias + '__' + os.path.basename(file)) for file in files}
+        alias_records = read_completion_records(working_directory, list(job_names.values()))
+        # aliases launched without completion records are checked with check_upload
+        if len(alias_records) != len(job_names):
+            continue
+        aliases.append((alias, files, i[3], job_names))
+        records.update(alias_records)
+        working_directories.update({job_name: working_directory for job_name in alias_records})
+    if len(aliases) == 0:
+        return
+    exit_codes = get_completion_exit_codes(credential_file, database, records, working_directories)
+    
+    # make lists of aliases to update
+    uploaded, streamed, failed = [], [], []
+    # count the number and size of the uploaded files in each directory {directory: [count, size]}
+    uploads = {}
+    for alias, files, stage_path, job_names in aliases:
+        codes = [exit_codes[job_names[file]] for file in files]
+        # skip aliases with jobs still running
+        if None in codes:
+            continue
+        # files streamed to the staging server were not encrypted beforehand
+        stream = any(['encryptedName' not in files[file] for file in files])
+        reset_status = 'encrypt' if stream else 'upload'
+        if set(codes) != {'0'}:
+            failed.append((reset_status, 'Upload failed', alias, box))
+            continue
+        # get the md5sums of the streamed files from the records
+        file_info = files
+        if stream:
+            file_info = {}
+            for file in files:
+                record = records[job_names[file]]
+                file_info[file] = {'filePath': file, 'unencryptedChecksum': record['unencryptedChecksum'], 'encryptedName': record['encryptedName'], 'checksum': record['checksum']}
+                if ega_object == 'analyses':
+                    file_info[file]['fileTypeId'] = files[file]['fileTypeId']
+        # check if files are uploaded on the server, using a listing made after the uploads completed
+        try:
+            uploaded_files = get_stage_path_files(credential_file, database, host, box, stage_path, max([records[job_names[file]]['time'] for file in files]))
+        except subprocess.CalledProcessError:
+            # check again at the next run if the stage path cannot be listed
+            continue
+        on_server = True
+        for file in file_info:
+            encryptedFile = file_info[file]['encryptedName']
+            for j in [encryptedFile, encryptedFile + '.md5', remove_encryption_extension(encryptedFile) + '.md5']:
+                if j not in uploaded_files:
+                    on_server = False
+        if on_server == False:
+            failed.append((reset_status, 'Upload failed', alias, box))
+            continue
+        # encrypted file and md5 files of the original and encrypted files
+        directory = stage_path.strip('/') if stage_path.strip('/') != '' else '/'
+        if directory not in uploads:
+            uploads[directory] = [0, 0]
+        for file in files:
+            uploads[directory][0] += 3
+            uploads[directory][1] += int(records[job_names[file]].get('encryptedSize', 0)) + 2 * 33
+        if stream:
+            streamed.append((str(file_info), alias, box))
+        else:
+            uploaded.append((alias, box))
+    
+    # update status of all checked aliases at once
+    if len(uploaded) != 0 or len(streamed) != 0 or len(failed) != 0:
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        # update status uploading -> uploaded
+        cur.executemany('UPDATE {0} SET {0}.Status=\"uploaded\", {0}.errorMessages=\"None\" WHERE {0}.alias=%s AND {0}.egaBox=%s'.format(table), uploaded)
+        # record md5sums and encrypted file names of the streamed files
+        cur.executemany('UPDATE {0} SET {0}.files=%s, {0}.Status=\"uploaded\", {0}.errorMessages=\"None\" WHERE {0}.alias=%s AND {0}.egaBox=%s'.format(table), streamed)
+        # reset status uploading --> upload (or encrypt), record error message
+        cur.executemany('UPDATE {0} SET {0}.Status=%s, {0}.errorMessages=%s WHERE {0}.alias=%s AND {0}.egaBox=%s'.format(table), failed)
+        conn.commit()
+        conn.close()
+        # release the upload slots of the checked aliases
+        release_upload_slots(credential_file, database, table, box, [i[-2] for i in uploaded + streamed + failed])
+        # keep the footprint of the box up to date until the next listing of the staging server
+        add_upload_footprint(credential_file, database, footprint_table, box, uploads)
+
+
 def clean_up_error(error_messages):
     '''
     (str or list or None) -> str
@@ -2939,9 +5519,9 @@ def remove_files_after_submission(credential_file, database, table, box, remove,
                 workingdir = get_working_directory(i[2], working_dir)
                 files = [os.path.join(workingdir, files[i]['encryptedName']) for i in files]
                 for i in files:
-                    assert i[-4:] == '.gpg'
-                    a, b = i + '.md5', i.replace('.gpg', '') + '.md5'
-                    if os.path.isfile(i) and working_dir in i and '.gpg' in i:
+                    assert remove_encryption_extension(i) != i
+                    a, b = i + '.md5', remove_encryption_extension(i) + '.md5'
+                    if os.path.isfile(i) and working_dir in i and remove_encryption_extension(i) != i:
                         # remove encrypted file
                         os.system('rm {0}'.format(i))
                     if os.path.isfile(a) and working_dir in a and '.md5' in a:
@@ -2953,9 +5533,9 @@ def remove_files_after_submission(credential_file, database, table, box, remove,
 
 
 # use this function to check upload    
-def check_upload(host, ega_object, credential_file, submission_database, table, box, alias, jobnames, working_dir, attributes_table):
+def check_upload(host, ega_object, credential_file, submission_database, table, box, alias, jobnames, working_dir, attributes_table, stream=False):
     '''    
-    (str, str, str, str, str, str, str, str)
+    (str, str, str, str, str, str, str, str, str, str, bool)
     
     Updates alias status to uploaded if upload is succesfull or reset status to upload
     
@@ -2972,18 +5552,19 @@ def check_upload(host, ega_object, credential_file, submission_database, table,
     - jobnames (str): semi-colon-separated list of job names used for uploading all the files under a given alias
     - working_dir (str): Parent directory containing sub-folders where encrypted files are located
     - attributes_table (str): Table storing analysis attributes information
+    - stream (bool): Files were encrypted straight into the upload if True
     '''
     
     if ega_object == 'analyses':
         # check that files have been successfully uploaded, update status uploading -> uploaded or rest status uploading -> upload
-        check_upload_files(credential_file, host, submission_database, table, box, ega_object, alias, jobnames, working_dir, attributes = attributes_table)
-    elif args.object == 'runs':
-        check_upload_files(credential_file, host, submission_database, table, box, ega_object, alias, jobnames, working_dir)
+        check_upload_files(credential_file, host, submission_database, table, box, ega_object, alias, jobnames, working_dir, stream, attributes = attributes_table)
+    elif ega_object == 'runs':
+        check_upload_files(credential_file, host, submission_database, table, box, ega_object, alias, jobnames, working_dir, stream)
     
 
-def create_json(credential_file, submission_database, metadata_database, table, ega_object, working_dir, key_ring, memory, disk_space, samples_attributes_table, analysis_attributes_table, projects_table, footprint_table, max_uploads, max_footprint, remove, box, host):
+def create_json(credential_file, submission_database, metadata_database, table, ega_object, working_dir, key_ring, memory, disk_space, samples_attributes_table, analysis_attributes_table, projects_table, footprint_table, max_uploads, max_footprint, remove, box, host, encryption='gpg', processes=1, stream=False, alias_parallel=4, box_parallel=16, array_jobs=False, max_total=8):
     '''
-    (str, str, str, str, str, str, str, int, int, str, str, str, str, int, int, bool, str, str) -> None
+    (str, str, str, str, str, str, str, int, int, str, str, str, str, int, int, bool, str, str, str, int, bool, int, int, bool, int) -> None
     
     Forms the submission json for a given EGA object and stores the json in the submission database
         
@@ -3003,11 +5584,18 @@ def create_json(credential_file, submission_database, metadata_database, table,
     - analysis_attributes_table (str): Table storing analysis attributes information
     - projects_table (str): Table storing project information
     - footprint_table (str): Table with foot print by project on the staging servers
-    - max_uploads (int): Maximum number of files to upload at once
+    - max_uploads (int): Maximum number of files of the box to upload at once
     - max_footprint (int): Maximum footprint authorized on the EGA box's staging server
     - remove (bool): Remove encrypted after successful upload if True
     - box (str): EGA submission box (ega-box-xxx)
     - host (str): Xfer host server
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - stream (bool): Encrypt files straight into their upload to the staging server if True
+    - alias_parallel (int): Maximum number of files of an alias encrypted at once
+    - box_parallel (int): Maximum number of files of the box encrypted at once
+    - array_jobs (bool): Launch the encryption and upload jobs of each cycle as array jobs if True
+    - max_total (int): Maximum number of files of all boxes to upload at once
     '''
 
     # check if Analyses table exists
@@ -3053,17 +5641,34 @@ def create_json(credential_file, submission_database, metadata_database, table,
         if ega_object in ['analyses', 'runs']:
             ## set up working directory, add to analyses table and update status valid --> encrypt
             add_working_directory(credential_file, submission_database, table, box, working_dir)
-                   
+            
+            ## check the completion records of the finished encryption jobs, store md5sums and path to encrypted file in db
+            ## update status encrypting -> upload or reset encrypting -> encrypt
+            check_encryption_records(credential_file, submission_database, table, box, ega_object, working_dir)
+            ## check the completion records of the finished upload jobs and that files are on the staging server
+            ## update status uploading -> uploaded or reset status uploading -> upload (or encrypt for streamed files)
+            if ega_object == 'analyses':
+                check_upload_records(credential_file, host, submission_database, table, box, ega_object, working_dir, footprint_table, attributes = analysis_attributes_table)
+            elif ega_object == 'runs':
+                check_upload_records(credential_file, host, submission_database, table, box, ega_object, working_dir, footprint_table)
+            
+            if stream:
+                ## encrypt files straight into the upload and change the status encrypt -> uploading
+                if ega_object == 'analyses':
+                    stream_object_files(credential_file, host, submission_database, table, ega_object, footprint_table, box, key_ring, memory, max_uploads, max_footprint, working_dir, encryption, processes, max_total, attributes = analysis_attributes_table)
+                elif ega_object == 'runs':
+                    stream_object_files(credential_file, host, submission_database, table, ega_object, footprint_table, box, key_ring, memory, max_uploads, max_footprint, working_dir, encryption, processes, max_total)
+            
             ## encrypt new files only if diskspace is available. update status encrypt --> encrypting
-            ## check that encryption is done, store md5sums and path to encrypted file in db, update status encrypting -> upload or reset encrypting -> encrypt
-            encrypt_files(credential_file, submission_database, table, ega_object, box, key_ring, memory, disk_space, working_dir)
+            ## files are not encrypted on scratch in stream mode
+            if not stream:
+                encrypt_files(credential_file, submission_database, table, ega_object, box, key_ring, memory, disk_space, working_dir, encryption, processes, alias_parallel, box_parallel, array_jobs)
         
             ## upload files and change the status upload -> uploading 
-            ## check that files have been successfully uploaded, update status uploading -> uploaded or rest status uploading -> upload
             if ega_object == 'analyses':
-                upload_object_files(credential_file, host, submission_database, table, ega_object, footprint_table, box, memory, max_uploads, max_footprint, working_dir, attributes = analysis_attributes_table)
+                upload_object_files(credential_file, host, submission_database, table, ega_object, footprint_table, box, memory, max_uploads, max_footprint, working_dir, array_jobs, max_total, attributes = analysis_attributes_table)
             elif ega_object == 'runs':
-                upload_object_files(credential_file, host, submission_database, table, ega_object, footprint_table, box, memory, max_uploads, max_footprint, working_dir)
+                upload_object_files(credential_file, host, submission_database, table, ega_object, footprint_table, box, memory, max_uploads, max_footprint, working_dir, array_jobs, max_total)
             
             ## remove files with uploaded status. does not change status. keep status uploaded --> uploaded
             remove_files_after_submission(credential_file, submission_database, table, box, remove, working_dir)
@@ -3152,9 +5757,9 @@ def submit_metadata(credential_file, submission_database, table, box, ega_object
 def register_ega_objects(credential_file, submission_database, metadata_database, 
                          working_dir, key_ring, memory, disk_space, footprint_table,
                          samples_attributes_table, analysis_attributes_table, projects_table,
-                         max_uploads, max_footprint, remove, portal, box, host):
+                         max_uploads, max_footprint, remove, portal, box, host, encryption='gpg', processes=1, stream=False, alias_parallel=4, box_parallel=16, array_jobs=False, max_total=8):
     '''
-    (str, str, str, str, str, str, int, int, str, str, str, str, int, int, bool, str, str) -> None
+    (str, str, str, str, str, str, int, int, str, str, str, str, int, int, bool, str, str, str, int, bool, int, int, bool, int) -> None
     
     Register all EGA objects to the EGA API    
         
@@ -3171,18 +5776,25 @@ def register_ega_objects(credential_file, submission_database, metadata_database
     - samples_attributes_table (str): Table storing samples attributes information
     - analysis_attributes_table (str): Table storing analysis attributes information
     - projects_table (str): Table storing project information
-    - max_uploads (int): Maximum number of files to upload at once
+    - max_uploads (int): Maximum number of files of the box to upload at once
     - max_footprint (int): Maximum footprint authorized on the EGA box's staging server
     - remove (bool): Remove encrypted after successful upload if True
     - portal (str): URL of the EGA submisison API
     - box (str): EGA submission box (ega-box-xxx)
     - host (str): Xfer host server
+    - encryption (str): Encryption method. Accepted values: gpg or crypt4gh
+    - processes (int): Number of processes used for Crypt4GH encryption
+    - stream (bool): Encrypt files straight into their upload to the staging server if True
+    - alias_parallel (int): Maximum number of files of an alias encrypted at once
+    - box_parallel (int): Maximum number of files of the box encrypted at once
+    - array_jobs (bool): Launch the encryption and upload jobs of each cycle as array jobs if True
+    - max_total (int): Maximum number of files of all boxes to upload at once
     '''
     
     for ega_object in ['studies', 'runs', 'samples', 'experiments', 'datasets', 'analyses', 'policies', 'dacs']:
         table = ega_object.title()    
         # create json
-        create_json(credential_file, submission_database, metadata_database, table, ega_object, working_dir, key_ring, memory, disk_space, samples_attributes_table, analysis_attributes_table, projects_table, footprint_table, max_uploads, max_footprint, remove, box, host)
+        create_json(credential_file, submission_database, metadata_database, table, ega_object, working_dir, key_ring, memory, disk_space, samples_attributes_table, analysis_attributes_table, projects_table, footprint_table, max_uploads, max_footprint, remove, box, host, encryption, processes, stream, alias_parallel, box_parallel, array_jobs, max_total)
         # submit json and register object
         submit_metadata(credential_file, submission_database, table, box, ega_object, portal)
 
@@ -3254,6 +5866,7 @@ def add_missing_working_directory(credential_file, database, table, alias, box,
             # create working directories
             workingdir = get_working_directory(UID, working_dir)
             os.makedirs(workingdir)
+    conn.close()
     
   
 
@@ -3299,8 +5912,8 @@ def edit_submitted_status(credential_file, database, table, alias, box, analysis
             new_files = {}
             for file in files:
                 file_typeId, filename, file_path = file_types[file], files[file]['encryptedName'], files[file]['filePath']
-                assert filename[-4:] == '.gpg'
-                filename = filename[:-4]
+                assert remove_encryption_extension(filename) != filename
+                filename = remove_encryption_extension(filename)
                 new_files[file] = {'filePath': file_path, 'fileName': filename, 'fileTypeId': file_typeId}
         elif ega_accession.startswith('EGAR'):
             # run object
@@ -3308,8 +5921,8 @@ def edit_submitted_status(credential_file, database, table, alias, box, analysis
             new_files = {}
             for file in files:
                 filename, file_path = files[file]['encryptedName'], files[file]['filePath']
-                assert filename[-4:] == '.gpg'
-                filename = filename[:-4]
+                assert remove_encryption_extension(filename) != filename
+                filename = remove_encryption_extension(filename)
                 new_files[file] = {'filePath': file_path, 'fileName': filename}
         if working_directory in ['', 'NULL', None, 'None']:
             error.append('Working directory does not have a valid Id')
@@ -3397,7 +6010,7 @@ def file_info_staging_server(credential_file, metadata_database, submission_data
     '''
 
     # add info for all files on staging server for given box
-    add_file_info_staging_server(credential_file, metadata_database, submission_database, analyses_table, runs_table, staging_table, box, host)
+    add_file_info_staging_server(credential_file, metadata_database, submission_database, staging_table, box, host)
     # summarize data into footprint table
     add_footprint_data(credential_file, submission_database, staging_table, footprint_table, box)
     
@@ -3438,7 +6051,7 @@ def connect_to_api(username, password, URL):
 
     URL = format_url(URL)
     data = {'username': username, 'password': password, 'loginType': 'submitter'}
-    login = requests.post(URL + 'login', data=data)
+    login = requests.post(URL + 'login', data=data, timeout=api_timeout)
     token = login.json()['response']['result'][0]['session']['sessionToken']
     return token
     
@@ -3457,7 +6070,7 @@ def close_api_connection(token, URL):
         
     URL = format_url(URL)
     headers = {'X-Token': token}
-    response = requests.delete(URL + 'logout', headers=headers)
+    response = requests.delete(URL + 'logout', headers=headers, timeout=api_timeout)
 
     
 def count_objects(username, password, URL):
@@ -3483,7 +6096,7 @@ def count_objects(username, password, URL):
     URL = format_url(URL)
     for i in L:
         # connect to API
-        response = requests.get(URL + i + '?status=SUBMITTED&skip=0&limit=10', headers=headers)
+        response = requests.get(URL + i + '?status=SUBMITTED&skip=0&limit=10', headers=headers, timeout=api_timeout)
         D[i] = response.json()['response']['numTotalResults']
         # close connection
     close_api_connection(token, URL)    
@@ -3503,26 +6116,58 @@ def get_upper_limit(count, chunk_size):
     - chunk_size (int): Size of each chunk of data to download at once
     '''
     
-    i = count / chunk_size
-    if '.' in str(i):
-        num, dec = str(i)[:str(i).index('.')], str(i)[str(i).index('.'):]
-    else:
-        num, dec = i, 0
-    if 0 < float(dec) < 0.5:
-        u = round(int(num) + float(dec) + 0.5)
-    elif float(dec) > 0.5:
-        u = round(i)
-    elif float(dec) == 0:
-        u = i + 1
-    return u    
+    # number of pages needed to hold count objects
+    return (count + chunk_size - 1) // chunk_size
+
 
+def download_page(session, URL, ega_object, page, chunk_size, retries):
+    '''
+    (dict, str, str, int, int, int) -> list
+    
+    Returns a list of dictionaries with the instances of ega_object in the given page
+    of size chunk_size. Failed requests are retried up to retries times, logging in
+    again if the session token expired
     
-def download_metadata(username, password, URL, ega_object, count, chunk_size):
+    Parameters
+    ----------
+    - session (dict): Dictionary with the box credentials and the current session token
+    - URL (str): URL of the API
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - page (int): Index of the page to download
+    - chunk_size (int): Size of each chunk of data to download at once
+    - retries (int): Number of times a failed page is downloaded again
     '''
-    (str, str, str, str, dict, int) -> list
     
-    Returns a list of dictionaries with all instances of ega_object, downloaded in 
-    chunks of size chunk_size from URL for a given box
+    # the API skips pages of size limit, skip is the index of the page
+    request = URL + ega_object + '?status=SUBMITTED&skip={0}&limit={1}'.format(page, chunk_size)
+    for attempt in range(retries + 1):
+        token = session['token']
+        try:
+            # a stalled connection fails after the timeout and the page is retried
+            response = requests.get(request, headers={'X-Token': token}, timeout=api_timeout)
+            if response.status_code == 401:
+                # login again if token expired, unless another page already did
+                with session['lock']:
+                    if session['token'] == token:
+                        session['token'] = connect_to_api(session['username'], session['password'], URL)
+                raise ValueError('session token expired')
+            return response.json()['response']['result']
+        except Exception as e:
+            # timeouts, connection errors and invalid responses are retried
+            if attempt == retries:
+                raise
+            print('could not download page {0} of {1}: {2}. retrying'.format(page, ega_object, e))
+            time.sleep(2 ** attempt)
+
+
+def iterate_pages(username, password, URL, ega_object, pages, chunk_size, workers=4, retries=3):
+    '''
+    (str, str, str, str, list, int, int, int) -> generator
+    
+    Yields the lists of instances of ega_object in each page of size chunk_size, 
+    in the order of the pages. Pages are downloaded concurrently from URL for a 
+    given box using a single session, with at most workers pages held at once
     
     Parameters
     ----------
@@ -3531,27 +6176,84 @@ def download_metadata(username, password, URL, ega_object, count, chunk_size):
     - URL (str): URL of the API
     - ega_object (str): Registered object at the EGA. Accepted values:
                         studies, runs, samples, experiments, datasets, analyses, policies, dacs
-    - count (dict): Dictionary with the counts of all submitted EGA objects
+    - pages (list): List of page indices to download
     - chunk_size (int): Size of each chunk of data to download at once
+    - workers (int): Maximum number of pages downloaded at once
+    - retries (int): Number of times a failed page is downloaded again
     '''
     
     # format URL
     URL = format_url(URL)
-        
-    # collect all instances of ega_object  
+    workers = max(1, workers)
+    
+    # connect to API once for all pages
+    session = {'username': username, 'password': password, 'lock': threading.Lock(),
+               'token': connect_to_api(username, password, URL)}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # submit a new page only when the oldest page is consumed
+            pending = collections.deque()
+            for i in pages:
+                pending.append(executor.submit(download_page, session, URL, ega_object, i, chunk_size, retries))
+                if len(pending) == workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        # close connection
+        close_api_connection(session['token'], URL)
+
+
+def download_pages(username, password, URL, ega_object, pages, chunk_size, workers=4, retries=3):
+    '''
+    (str, str, str, str, list, int, int, int) -> list
+    
+    Returns a list of dictionaries with the instances of ega_object in the pages
+    of size chunk_size downloaded concurrently from URL for a given box, 
+    using a single session for all pages
+    
+    Parameters
+    ----------
+    - username (str): Username of a given box (e.g. ega-box-xxxx)
+    - password (str): Password to access the EGA box
+    - URL (str): URL of the API
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - pages (list): List of page indices to download
+    - chunk_size (int): Size of each chunk of data to download at once
+    - workers (int): Maximum number of pages downloaded at once
+    - retries (int): Number of times a failed page is downloaded again
+    '''
+    
     L = []
+    for page in iterate_pages(username, password, URL, ega_object, pages, chunk_size, workers, retries):
+        L.extend(page)
+    return L
+
+
+def download_metadata(username, password, URL, ega_object, count, chunk_size, workers=4):
+    '''
+    (str, str, str, str, dict, int, int) -> list
+    
+    Returns a list of dictionaries with all instances of ega_object, downloaded in 
+    chunks of size chunk_size from URL for a given box
+    
+    Parameters
+    ----------
+    - username (str): Username of a given box (e.g. ega-box-xxxx)
+    - password (str): Password to access the EGA box
+    - URL (str): URL of the API
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - count (dict): Dictionary with the counts of all submitted EGA objects
+    - chunk_size (int): Size of each chunk of data to download at once
+    - workers (int): Maximum number of chunks downloaded at once
+    '''
+    
     # get the right range limit
     right = get_upper_limit(count[ega_object], chunk_size)
     # download objects in chuncks of chunk_size
-    for i in range(0, right):
-        # connect to API
-        token = connect_to_api(username, password, URL)
-        headers = {'X-Token': token}
-        # download only chunk_size object, skipping the previous downloaded objects
-        response = requests.get(URL + ega_object + '?status=SUBMITTED&skip={0}&limit={1}'.format(i, chunk_size), headers=headers)
-        L.extend(response.json()['response']['result'])
-        # close connection
-        close_api_connection(token, URL)
+    L = download_pages(username, password, URL, ega_object, list(range(0, right)), chunk_size, workers)
     # make a list of accession Id
     if ega_object != 'experiments':
         accessions = [i['egaAccessionId'] for i in L]
@@ -3562,7 +6264,8 @@ def download_metadata(username, password, URL, ega_object, count, chunk_size):
                 accessions.append(i['egaAccessionId'])
             else:
                 accessions.extend(i['egaAccessionIds'])
-    assert len(accessions) == count[ega_object]
+    # check that all objects were downloaded
+    assert len(accessions) == count[ega_object], 'downloaded {0} {1}, expected {2}'.format(len(accessions), ega_object, count[ega_object])
     return L
 
 
@@ -3833,36 +6536,138 @@ def create_table(credential_file, ega_object, database):
     # connect to database
     conn = connect_to_database(credential_file, database)
     cur = conn.cursor()
-    # create table
-    cur.execute('CREATE TABLE {0} ({1})'.format(table_name, columns))
+    # create table
+    cur.execute('CREATE TABLE {0} ({1})'.format(table_name, columns))
+    # index columns used to filter rows
+    add_table_indexes(cur, table_name)
+    conn.commit()
+    conn.close()
+
+    
+def delete_records(credential_file, table, box, database):
+    '''
+    (str, str, str, str) -> None
+    
+    Delete rows from table in database corresponding to box
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - table (str): Name of table in database
+    - box (str): EGA box (e.g. ega-box-xxx)
+    - database (str): Name of the database
+    '''
+
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+
+    # delete rows corresponding to box
+    cur.execute('DELETE FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(table, box))
+    conn.commit()
+    conn.close()
+    
+    
+def get_shadow_table(table):
+    '''
+    (str) -> str
+    
+    Returns the name of the shadow table used to rebuild table
+    
+    Parameters
+    ----------
+    - table (str): Name of table in database
+    '''
+    
+    return table + '_shadow'
+
+
+def create_shadow_table(credential_file, table, box, database, ega_object=None):
+    '''
+    (str, str, str, str, str | None) -> None
+    
+    Creates a shadow table with the same schema as table in database and
+    copies the rows of all boxes other than box into it. Rows of box for
+    other objects are also copied if ega_object is defined
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - table (str): Name of table in database
+    - box (str): EGA box (e.g. ega-box-xxx)
+    - database (str): Name of the database
+    - ega_object (str | None): Object rebuilt for box in tables shared by several objects
+    '''
+    
+    shadow = get_shadow_table(table)
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    # remove shadow table left over by a failed collect
+    cur.execute('DROP TABLE IF EXISTS {0}'.format(shadow))
+    cur.execute('CREATE TABLE {0} LIKE {1}'.format(shadow, table))
+    # keep rows of the other boxes
+    if ega_object:
+        cur.execute('INSERT INTO {0} SELECT * FROM {1} WHERE {1}.egaBox IS NULL OR {1}.egaBox != \"{2}\" OR {1}.object != \"{3}\"'.format(shadow, table, box, ega_object))
+    else:
+        cur.execute('INSERT INTO {0} SELECT * FROM {1} WHERE {1}.egaBox IS NULL OR {1}.egaBox != \"{2}\"'.format(shadow, table, box))
+    conn.commit()
+    conn.close()
+
+
+def swap_shadow_tables(credential_file, tables, database):
+    '''
+    (str, list, str) -> None
+    
+    Replaces each table in tables with its shadow table in a single atomic rename
+    and drops the previous tables
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - tables (list): List of tables in database
+    - database (str): Name of the database
+    '''
+    
+    # all tables are renamed at once. readers see either the old or the new tables
+    renames = []
+    for table in tables:
+        renames.append('{0} TO {0}_old'.format(table))
+        renames.append('{0} TO {1}'.format(get_shadow_table(table), table))
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    for table in tables:
+        cur.execute('DROP TABLE IF EXISTS {0}_old'.format(table))
+    cur.execute('RENAME TABLE {0}'.format(', '.join(renames)))
+    for table in tables:
+        cur.execute('DROP TABLE {0}_old'.format(table))
     conn.commit()
     conn.close()
 
-    
-def delete_records(credential_file, table, box, database):
+
+def drop_shadow_tables(credential_file, tables, database):
     '''
-    (str, str, str, str) -> None
+    (str, list, str) -> None
     
-    Delete rows from table in database corresponding to box
+    Drops the shadow tables of tables in database if they exist
     
     Parameters
     ----------
     - credential_file (str): Path to the file with the database and EGA box credentials
-    - table (str): Name of table in database
-    - box (str): EGA box (e.g. ega-box-xxx)
+    - tables (list): List of tables in database
     - database (str): Name of the database
     '''
-
+    
     # connect to database
     conn = connect_to_database(credential_file, database)
     cur = conn.cursor()
-
-    # delete rows corresponding to box
-    cur.execute('DELETE FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(table, box))
+    for table in tables:
+        cur.execute('DROP TABLE IF EXISTS {0}'.format(get_shadow_table(table)))
     conn.commit()
     conn.close()
-    
-    
+
+
 def create_link_table(credential_file, ega_object, database):
     '''
     (str, str) -> None
@@ -3885,20 +6690,47 @@ def create_link_table(credential_file, ega_object, database):
     # because many datasets, runs ebiId are None
     if ega_object == 'datasets':
         cur.execute('CREATE TABLE Datasets_RunsAnalysis (datasetId VARCHAR(100), egaAccessionId VARCHAR(100), egaBox VARCHAR(100), PRIMARY KEY (datasetId, egaAccessionId))')
+        add_table_indexes(cur, 'Datasets_RunsAnalysis')
         conn.commit()            
     elif ega_object == 'analyses':
         cur.execute('CREATE TABLE Analyses_Samples (analysisId VARCHAR(100), sampleId  VARCHAR(100), egaBox VARCHAR(100), PRIMARY KEY (analysisId, sampleId))')
+        add_table_indexes(cur, 'Analyses_Samples')
         conn.commit()
     conn.close()
     
 
-def insert_metadata_table(credential_file, ega_object, metadata, database):
+def insert_rows(cur, table, column_names, rows, batch_size, upsert=False):
+    '''
+    (pymysql.cursors.Cursor, str, list, list, int, bool) -> None
+    
+    Inserts rows into table using parameterised multi-row inserts of at most
+    batch_size rows. Inserted rows are not committed
+    
+    Parameters
+    ----------
+    - cur (pymysql.cursors.Cursor): Cursor of an open connection to the database
+    - table (str): Table in database
+    - column_names (list): List of table columns, in the order of the values in each row
+    - rows (list): List of tuples with the values to insert
+    - batch_size (int): Maximum number of rows inserted in a single statement
+    - upsert (bool): Update the existing rows with the same primary key if True
+    '''
+    
+    cmd = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(table, ', '.join(column_names), ', '.join(['%s'] * len(column_names)))
+    if upsert:
+        cmd += ' ON DUPLICATE KEY UPDATE {0}'.format(', '.join(['{0}=VALUES({0})'.format(i) for i in column_names]))
+    # executemany rewrites the chunk as a single multi-row INSERT statement
+    for i in range(0, len(rows), batch_size):
+        cur.executemany(cmd, rows[i: i + batch_size])
+
+
+def insert_metadata_table(credential_file, ega_object, metadata, database, batch_size=1000, shadow=False, upsert=False):
     '''
-    (str, str, list, str) -> None
+    (str, str, list, str, int, bool, bool) -> None
     
     
     Take a list of dictionaries with Objects metadata and insert it 
-    into the corresponding table
+    into the corresponding table in a single transaction
     
     Parameters
     ----------
@@ -3907,12 +6739,11 @@ def insert_metadata_table(credential_file, ega_object, metadata, database):
                         studies, runs, samples, experiments, datasets, analyses, policies, dacs
     - metadata (list): List of dictionaries with relevant metadata information for ega_object
     - database (str): Name of the database
+    - batch_size (int): Number of records inserted at once
+    - shadow (bool): Insert records into the shadow table if True
+    - upsert (bool): Update existing records with the same ebiId if True
     '''
 
-    # connect to database
-    conn = connect_to_database(credential_file, database)    
-    cur = conn.cursor()
-    
     # get relevant metadata fields
     info = relevant_info()[ega_object]
     # add egaBox
@@ -3920,29 +6751,36 @@ def insert_metadata_table(credential_file, ega_object, metadata, database):
     
     # get table name
     table_name = ega_object.title()
+    if shadow:
+        table_name = get_shadow_table(table_name)
     
+    # make a list of values for each record
+    rows = []
     for d in metadata:
-        # add values to a tuple
-        values = ()
-        for i in info:
-            if d[i] == '' or d[i] == None:
-                values = values.__add__(('NULL',))
-            else:
-                 values = values.__add__((d[i],))
-        assert len(values) == len(info)        
-        # make a string with column names
-        col_names = ', '.join(info)
-        # add values into table
-        cur.execute('INSERT INTO {0} ({1}) VALUES {2}'.format(table_name, col_names, values))
+        values = tuple(['NULL' if d[i] == '' or d[i] == None else d[i] for i in info])
+        assert len(values) == len(info)
+        rows.append(values)
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)    
+    cur = conn.cursor()
+    # add values into table, commit only when all records are inserted
+    try:
+        insert_rows(cur, table_name, info, rows, batch_size, upsert)
         conn.commit()
+    except:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
     
 
-def instert_info_link_table(credential_file, table, D, box, database):
+def instert_info_link_table(credential_file, table, D, box, database, batch_size=1000, shadow=False, upsert=False):
     '''
-    (str, str, dict, str, str) -> None
+    (str, str, dict, str, str, int, bool, bool) -> None
     
     Inserts object accession IDs in D into the junction table for the given box 
+    in a single transaction
     
     Parameters
     ----------
@@ -3951,25 +6789,166 @@ def instert_info_link_table(credential_file, table, D, box, database):
     - D (dict): Dictionary with map of Ids between objects
     - box (str): EGA box (e.g. ega-box-xxx)
     - database (str): Name of the database
+    - batch_size (int): Number of records inserted at once
+    - shadow (bool): Insert records into the shadow table of the junction table if True
+    - upsert (bool): Update existing links if True
     '''
         
-    # connect to database
-    conn = connect_to_database(credential_file, database)
-    cur = conn.cursor()
-    
+    rows = []
     if table == 'Datasets_RunsAnalysis':
+        column_names = ['datasetId', 'egaAccessionId', 'egaBox']
         for i in D:
             for j in D[i]:
-                cur.execute('INSERT INTO Datasets_RunsAnalysis (datasetId, egaAccessionId, egaBox) VALUES {0}'.format((i, j, box)))         
-                conn.commit()
+                rows.append((i, j, box))
     elif table == 'Analyses_Samples':
+        column_names = ['analysisId', 'sampleId', 'egaBox']
         for i in D:
             # the same sample could be linked to the same study multiple times
             # remove duplicate sample Ids
             for j in list(set(D[i])):
-                cur.execute('INSERT INTO Analyses_Samples (analysisId, sampleId, egaBox) VALUES {0}'.format((i, j, box)))
-                conn.commit()
+                rows.append((i, j, box))
+    
+    if shadow:
+        table = get_shadow_table(table)
+    
+    if len(rows) != 0:
+        # connect to database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        try:
+            insert_rows(cur, table, column_names, rows, batch_size, upsert)
+            conn.commit()
+        except:
+            conn.rollback()
+            conn.close()
+            raise
+        conn.close()
+
+
+def extract_registered_files(metadata, ega_object):
+    '''
+    (list, str) -> list
+    
+    Returns a list of tuples with file name, md5sum of the file name, md5sums, alias,
+    accession, box and object for each file listed in the xml of the runs or analyses in metadata
+    
+    Parameters
+    ----------
+    - metadata (list): List of dictionaries with runs or analyses metadata
+    - ega_object (str): Registered object at the EGA. Accepted values: runs, analyses
+    '''
+    
+    rows = []
+    for d in metadata:
+        if d['xml'] in ('', None, 'NULL'):
+            continue
+        # stream the xml and discard each element once parsed
+        for event, element in ET.iterparse(io.BytesIO(d['xml'].encode('utf-8')), events=('end',)):
+            if element.tag == 'FILE' and element.attrib.get('filename'):
+                # file paths are keyed by their md5sum, they may be too long to be indexed
+                filename = element.attrib['filename']
+                rows.append((filename, hashlib.md5(filename.encode('utf-8')).hexdigest(), element.attrib.get('unencrypted_checksum', 'NULL'),
+                             element.attrib.get('checksum', 'NULL'), d['alias'], d['egaAccessionId'], d['egaBox'], ega_object))
+            element.clear()
+    return rows
+
+
+def create_registered_files_table(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Creates the RegisteredFiles table storing the files of registered runs and analyses
+    if it doesn't already exist, and adds the files of the runs and analyses already
+    collected when the table is created. A table without file name md5sums is rebuilt
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    tables = show_tables(credential_file, database)
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    if 'RegisteredFiles' in tables:
+        cur.execute('SHOW COLUMNS FROM RegisteredFiles')
+        if 'fileHash' in [i[0] for i in cur.fetchall()]:
+            conn.close()
+            return
+        # files were keyed by a file name of limited length
+        cur.execute('DROP TABLE RegisteredFiles')
+    cur.execute('CREATE TABLE IF NOT EXISTS RegisteredFiles (fileName TEXT, fileHash CHAR(32), unencryptedChecksum VARCHAR(100), \
+                checksum VARCHAR(100), alias VARCHAR(100), egaAccessionId VARCHAR(100), egaBox VARCHAR(100), object VARCHAR(100), \
+                PRIMARY KEY (egaAccessionId, fileHash), INDEX idx_egaBox_fileHash (egaBox, fileHash))')
+    conn.commit()
     conn.close()
+    
+    # add the files of the objects collected before the table existed
+    for ega_object in ['runs', 'analyses']:
+        if ega_object.title() in tables:
+            conn = connect_to_database(credential_file, database)
+            cur = conn.cursor()
+            cur.execute('SELECT {0}.alias, {0}.xml, {0}.egaAccessionId, {0}.egaBox FROM {0}'.format(ega_object.title()))
+            metadata = [{'alias': i[0], 'xml': i[1], 'egaAccessionId': i[2], 'egaBox': i[3]} for i in cur]
+            conn.close()
+            insert_registered_files(credential_file, ega_object, metadata, database)
+            print('added files of {0} {1} to RegisteredFiles'.format(len(metadata), ega_object))
+
+
+def insert_registered_files(credential_file, ega_object, metadata, database, batch_size=1000, shadow=False):
+    '''
+    (str, str, list, str, int, bool) -> None
+    
+    Inserts the files of the runs or analyses in metadata into the RegisteredFiles table
+    in a single transaction
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - ega_object (str): Registered object at the EGA. Accepted values: runs, analyses
+    - metadata (list): List of dictionaries with runs or analyses metadata
+    - database (str): Name of the database
+    - batch_size (int): Number of records inserted at once
+    - shadow (bool): Insert records into the shadow table of RegisteredFiles if True
+    '''
+    
+    column_names = ['fileName', 'fileHash', 'unencryptedChecksum', 'checksum', 'alias', 'egaAccessionId', 'egaBox', 'object']
+    rows = extract_registered_files(metadata, ega_object)
+    table = get_shadow_table('RegisteredFiles') if shadow else 'RegisteredFiles'
+    
+    if len(rows) != 0:
+        # connect to database
+        conn = connect_to_database(credential_file, database)
+        cur = conn.cursor()
+        # the same file may be listed more than once in an object
+        try:
+            insert_rows(cur, table, column_names, rows, batch_size, True)
+            conn.commit()
+        except:
+            conn.rollback()
+            conn.close()
+            raise
+        conn.close()
+
+
+def get_record_accession(d, ega_object):
+    '''
+    (dict, str) -> str
+    
+    Returns the accession Id of a record downloaded from EGA
+    
+    Parameters
+    ----------
+    - d (dict): Dictionary with metadata downloaded from EGA for an instance of ega_object
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    '''
+    
+    # experiment egaAccessionId can be either egaAccessionId or egaAccessionIds
+    if ega_object == 'experiments' and d['egaAccessionId'] == None:
+        return d['egaAccessionIds'][0]
+    return d['egaAccessionId']
 
 
 def get_unique_records(L, ega_object):
@@ -3987,28 +6966,206 @@ def get_unique_records(L, ega_object):
     '''
 
     D = {}
-    # experiment egaAccessionId can be either egaAccessionId or egaAccessionIds
-    if ega_object != 'experiments':
-        for i in L:
-            accession = i['egaAccessionId']
-            D[accession] = i
-    else:
-        for i in L:
-            if i['egaAccessionId'] != None:
-                accession = i['egaAccessionId']
-            else:
-                accession = i['egaAccessionIds'][0]
-            D[accession] = i
+    for i in L:
+        D[get_record_accession(i, ega_object)] = i
     K = [D[i] for i in D]
     return K
 
 
-def collect_metadata(credential_file, box, ega_object, counts, chunk_size, URL="https://ega-archive.org/submission-api/v1", database='EGA'):
+def create_sync_table(credential_file, database):
+    '''
+    (str, str) -> None
+    
+    Creates the SyncState table storing the high-water mark of the metadata
+    collected for each box and EGA object if it doesn't already exist
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS SyncState (egaBox VARCHAR(100), object VARCHAR(100), \
+                objectCount INT, lastCreationTime BIGINT, syncTime VARCHAR(100), syncMode VARCHAR(100), \
+                PRIMARY KEY (egaBox, object))')
+    conn.commit()
+    conn.close()
+
+
+def get_sync_state(credential_file, database, box, ega_object):
+    '''
+    (str, str, str, str) -> dict
+    
+    Returns a dictionary with the number of objects and the most recent creation time
+    recorded during the last collect of ega_object for box, or an empty dictionary
+    if ega_object was never collected for box
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - box (str): EGA box (e.g. ega-box-xxx)
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT SyncState.objectCount, SyncState.lastCreationTime FROM SyncState WHERE SyncState.egaBox=\"{0}\" AND SyncState.object=\"{1}\"'.format(box, ega_object))
+        data = cur.fetchall()
+    except:
+        data = []
+    conn.close()
+    
+    if len(data) == 0:
+        return {}
+    return {'objectCount': int(data[0][0]), 'lastCreationTime': int(data[0][1])}
+
+
+def record_sync_state(credential_file, database, box, ega_object, object_count, metadata, mode):
+    '''
+    (str, str, str, str, int, list, str) -> None
+    
+    Records the number of collected objects and the most recent creation time
+    of ega_object for box in the SyncState table
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - database (str): Name of the database
+    - box (str): EGA box (e.g. ega-box-xxx)
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - object_count (int): Number of submitted objects reported by the API
+    - metadata (list): List of dictionaries with metadata downloaded from EGA for ega_object
+    - mode (str): Type of collect. Accepted values: full or incremental
+    '''
+    
+    # keep the previous high-water mark if no new object was downloaded
+    previous = get_sync_state(credential_file, database, box, ega_object)
+    creation_times = [int(d['creationTime']) for d in metadata if d['creationTime'] != None]
+    if 'lastCreationTime' in previous:
+        creation_times.append(previous['lastCreationTime'])
+    last_creation_time = max(creation_times) if len(creation_times) != 0 else 0
+    sync_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('REPLACE INTO SyncState (egaBox, object, objectCount, lastCreationTime, syncTime, syncMode) VALUES (%s, %s, %s, %s, %s, %s)',
+                (box, ega_object, object_count, last_creation_time, sync_time, mode))
+    conn.commit()
+    conn.close()
+
+
+def get_collected_accessions(credential_file, table, box, database):
     '''
-    (str, str, dict, int, str, )
+    (str, str, str, str) -> set
+    
+    Returns the set of accessions collected in table for box
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - table (str): Name of table in database
+    - box (str): EGA box (e.g. ega-box-xxx)
+    - database (str): Name of the database
+    '''
+    
+    # connect to database
+    conn = connect_to_database(credential_file, database)
+    cur = conn.cursor()
+    cur.execute('SELECT {0}.egaAccessionId FROM {0} WHERE {0}.egaBox=\"{1}\"'.format(table, box))
+    accessions = set([i[0] for i in cur])
+    conn.close()
+    return accessions
+
+
+def collect_new_metadata(credential_file, box, ega_object, counts, chunk_size, URL, database, batch_size, workers=4):
+    '''
+    (str, str, str, dict, int, str, str, int, int) -> bool
+    
+    Downloads only the instances of ega_object submitted since the last collect for box
+    and upserts them in the EGA database. Returns False if the new objects cannot be 
+    identified from the high-water mark and a full collect is required
+    Precondition: the API lists submitted objects in order of submission
+    
+    Parameters
+    ----------
+    - credential_file (str): Path to the file with the database and EGA box credentials
+    - box (str): EGA box (e.g. ega-box-xxx)
+    - ega_object (str): Registered object at the EGA. Accepted values:
+                        studies, runs, samples, experiments, datasets, analyses, policies, dacs
+    - counts (dict): Counts of registered EGA objects in the given box
+    - chunk_size (int): Size of each chunk of data to download at once
+    - URL (str): URL of the API
+    - database (str): Name of the database
+    - batch_size (int): Number of records inserted at once in the database
+    - workers (int): Maximum number of chunks downloaded at once
+    '''
+    
+    table_name = ega_object.title()
+    state = get_sync_state(credential_file, database, box, ega_object)
+    # full collect if never collected or if objects were removed from the box
+    if len(state) == 0 or table_name not in show_tables(credential_file, database) or counts[ega_object] < state['objectCount']:
+        return False
+    
+    # nothing to download if no new object was submitted since the last collect
+    if counts[ega_object] == state['objectCount']:
+        print('no new {0} since last collect for box {1}'.format(ega_object, box))
+        return True
+    
+    # download pages starting from the page holding the first new object
+    credentials = extract_credentials(credential_file)
+    first_page = state['objectCount'] // chunk_size
+    right = get_upper_limit(counts[ega_object], chunk_size)
+    M = download_pages(box, credentials[box], URL, ega_object, list(range(first_page, right)), chunk_size, workers)
+    print('downloaded {0} {1} records from the API'.format(len(M), ega_object))
+    
+    # keep objects not already collected
+    known = get_collected_accessions(credential_file, table_name, box, database)
+    new = [d for d in M if get_record_accession(d, ega_object) not in known]
+    # objects do not line up with the high-water mark if the listing order changed
+    if len(M) != counts[ega_object] - first_page * chunk_size or len(new) != counts[ega_object] - state['objectCount']:
+        print('cannot identify new {0} from the last collect for box {1}'.format(ega_object, box))
+        return False
+    
+    # keep records with unique accessions and extract relevant information
+    L = get_unique_records(new, ega_object)
+    metadata = extract_info(L, ega_object)
+    insert_metadata_table(credential_file, ega_object, metadata, database, batch_size, False, True)
+    print('upserted {0} new {1} for box {2}'.format(len(metadata), ega_object, box))
+    # add files of new runs and analyses
+    if ega_object in ['runs', 'analyses']:
+        insert_registered_files(credential_file, ega_object, metadata, database, batch_size)
+    clear_accession_index(database)
+    
+    # add links of new objects to junction tables
+    if ega_object == 'datasets':
+        D = map_datasets_to_runs_analyses(credential_file, box, URL, chunk_size, L)
+        instert_info_link_table(credential_file, 'Datasets_RunsAnalysis', D, box, database, batch_size, False, True)
+        print('upserted data in Datasets_RunsAnalysis junction table')
+    elif ega_object == 'analyses':
+        D = map_analyses_to_samples(L)
+        instert_info_link_table(credential_file, 'Analyses_Samples', D, box, database, batch_size, False, True)
+        print('upserted data in Analyses_Samples junction table')
+    
+    record_sync_state(credential_file, database, box, ega_object, counts[ega_object], new, 'incremental')
+    return True
+
+
+def collect_metadata(credential_file, box, ega_object, counts, chunk_size, URL="https://ega-archive.org/submission-api/v1", database='EGA', batch_size=1000, workers=4):
+    '''
+    (str, str, dict, int, str, str, int, int) -> None
     
     Dowonload the EGA object's metadata in chuncks of chunksize for a given box from
-    the EGA API at URL and instert it into the EGA database 
+    the EGA API at URL and instert it into the EGA database. Each chunk is inserted
+    before the next chunk is processed
     
     Parameters
     ----------
@@ -4020,77 +7177,108 @@ def collect_metadata(credential_file, box, ega_object, counts, chunk_size, URL="
     - chunk_size (int): Size of each chunk of data to download at once
     - URL (str): URL of the API Default is: "https://ega-archive.org/submission-api/v1"
     - database (str): Name of the database
+    - batch_size (int): Number of records inserted at once in the database
+    - workers (int): Maximum number of chunks downloaded at once
     '''
     
     # get the database and box credentials
     credentials = extract_credentials(credential_file)
     # process if objects exist
     if counts[ega_object] != 0:
-        # download all metadata for object in chunks
-        M = download_metadata(box, credentials[box], URL, ega_object, counts, chunk_size)
-        print('downloaded {0} metadata from the API'.format(ega_object))
+        # get the table names
+        table_name = ega_object.title()
+        link_table = ''
+        if ega_object == 'datasets':
+            link_table = 'Datasets_RunsAnalysis'
+        elif ega_object == 'analyses':
+            link_table = 'Analyses_Samples'
         
-        # keep records with unique accessions
-        L = get_unique_records(M, ega_object)
-        if len(L) != len(M):
-            print('removed {0} duplicate records'.format(ega_object))
-               
-        # extract relevant information
-        metadata = extract_info(L, ega_object)
-        print('collected relevant {0} information'.format(ega_object))
-
-        # get the table name    
-        table_name = ega_object.title()   
         # make a list of tables
         tables = show_tables(credential_file, database)
         if table_name not in tables:
             # create table
             create_table(credential_file, ega_object, database)
             print('created table {0}'.format(table_name))
-        else:
-            # update table
-            delete_records(credential_file, table_name, box, database)
-            print('deleted rows in table {0} for box {1}'.format(table_name, box))
-        # insert data into table
-        insert_metadata_table(credential_file, ega_object, metadata, database)         
-        print('inserted data in table {0} for box {1}'.format(table_name, box))    
-          
-        # collect data to form Link Tables    
-        if ega_object == 'datasets':
-            # map dataset Ids to runs and analyses Ids
-            D = map_datasets_to_runs_analyses(credential_file, box, URL, chunk_size, L)
-            print('mapped datasets to runs and analyses Ids')
-            # check if link table needs created or updated
-            if 'Datasets_RunsAnalysis' not in tables:
-                create_link_table(credential_file, ega_object)
-                print('created Datasets_RunsAnalysis junction table')
-            else:
-                delete_records(credential_file, 'Datasets_RunsAnalysis', box, database)
-                print('deleted rows in Datasets_RunsAnalysis junction table')
-            # instert data into junction table
-            instert_info_link_table(credential_file, 'Datasets_RunsAnalysis', D, box, database)
-            print('inserted data in Datasets_RunsAnalysis junction table')
-        elif ega_object == 'analyses':
-            # map analyses Ids to sample Ids    
-            D = map_analyses_to_samples(L)
-            print('mapped analyses to samples Ids')
-            # check if link table needs created or updated
-            if 'Analyses_Samples' not in tables:
-                create_link_table(credential_file, ega_object)
-                print('created Analyses_Samples junction table')
-            else:
-                delete_records(credential_file, 'Analyses_Samples', box, database)
-                print('deleted rows in Analyses_Samples junction table')
-            # instert data into junction table
-            instert_info_link_table(credential_file, 'Analyses_Samples', D, box, database)
-            print('inserted data in Analyses_Samples junction table')
+        if link_table != '' and link_table not in tables:
+            create_link_table(credential_file, ega_object, database)
+            print('created {0} junction table'.format(link_table))
+        
+        # rebuild the tables for box in shadow tables. 
+        # tables are left untouched if any step fails
+        rebuilt = [table_name] if link_table == '' else [table_name, link_table]
+        # files of runs and analyses are rebuilt with their objects
+        if ega_object in ['runs', 'analyses']:
+            rebuilt.append('RegisteredFiles')
+        try:
+            for i in rebuilt:
+                if i == 'RegisteredFiles':
+                    create_shadow_table(credential_file, i, box, database, ega_object)
+                else:
+                    create_shadow_table(credential_file, i, box, database)
+            
+            # keep track of accessions to remove duplicate records across chunks
+            accessions, downloaded, duplicates = set(), 0, 0
+            # keep track of the most recent creation time for the high-water mark
+            creation_times = []
+            pages = list(range(0, get_upper_limit(counts[ega_object], chunk_size)))
+            for M in iterate_pages(box, credentials[box], URL, ega_object, pages, chunk_size, workers):
+                # count accessions downloaded from the API
+                for i in M:
+                    if ega_object == 'experiments' and i['egaAccessionId'] == None:
+                        downloaded += len(i['egaAccessionIds'])
+                    else:
+                        downloaded += 1
+                times = [int(i['creationTime']) for i in M if i['creationTime'] != None]
+                if len(times) != 0:
+                    creation_times.append({'creationTime': max(times)})
+                # keep records with unique accessions
+                L = []
+                for i in M:
+                    accession = get_record_accession(i, ega_object)
+                    if accession in accessions:
+                        duplicates += 1
+                    else:
+                        accessions.add(accession)
+                        L.append(i)
+                # extract relevant information and insert data into shadow table
+                metadata = extract_info(L, ega_object)
+                insert_metadata_table(credential_file, ega_object, metadata, database, batch_size, True)
+                # insert files of runs and analyses into shadow table
+                if ega_object in ['runs', 'analyses']:
+                    insert_registered_files(credential_file, ega_object, metadata, database, batch_size, True)
+                # instert data into shadow junction table
+                if ega_object == 'datasets':
+                    # map dataset Ids to runs and analyses Ids
+                    D = map_datasets_to_runs_analyses(credential_file, box, URL, chunk_size, L)
+                    instert_info_link_table(credential_file, link_table, D, box, database, batch_size, True)
+                elif ega_object == 'analyses':
+                    # map analyses Ids to sample Ids    
+                    D = map_analyses_to_samples(L)
+                    instert_info_link_table(credential_file, link_table, D, box, database, batch_size, True)
+            
+            # check that all objects were downloaded before replacing the tables
+            assert downloaded == counts[ega_object], 'downloaded {0} {1}, expected {2}'.format(downloaded, ega_object, counts[ega_object])
+            print('inserted {0} {1} in shadow table {2} for box {3}'.format(len(accessions), ega_object, table_name, box))
+            if duplicates != 0:
+                print('removed {0} duplicate {1} records'.format(duplicates, ega_object))
+            # replace tables with shadow tables
+            swap_shadow_tables(credential_file, rebuilt, database)
+            print('swapped {0} for box {1}'.format(', '.join(rebuilt), box))
+            clear_accession_index(database)
+        except:
+            drop_shadow_tables(credential_file, rebuilt, database)
+            raise
+        # record the high-water mark for the next incremental collect
+        record_sync_state(credential_file, database, box, ega_object, counts[ega_object], creation_times, 'full')
 
 
-def collect_registered_metadata(credential_file, box, chunk_size, URL, metadata_database):
+def collect_registered_metadata(credential_file, box, chunk_size, URL, metadata_database, batch_size, incremental=False, workers=4):
     '''
-    (str, str, int, str, str) -> None
+    (str, str, int, str, str, int, bool, int) -> None
     
-    Downloads registered metadata and adds relevant information to metadata database
+    Downloads registered metadata and adds relevant information to metadata database.
+    Only objects submitted since the last collect are downloaded if incremental is True,
+    with a full collect for objects that cannot be synced incrementally
 
     Parameters
     ----------
@@ -4101,16 +7289,25 @@ def collect_registered_metadata(credential_file, box, chunk_size, URL, metadata_
     - chunk_size (int): Size of each chunk of data to download at once
     - URL (str): URL of the API to download metadata of registered objects
     - metadata_database (str): Database storing information about registered EGA objects
+    - batch_size (int): Number of records inserted at once in the database
+    - incremental (bool): Collect only new objects if True, collect all objects if False
+    - workers (int): Maximum number of chunks downloaded at once
     '''
     
     # count all objects registered in box
     credentials = extract_credentials(credential_file)
     counts = count_objects(box, credentials[box], URL)
+    # create table storing the high-water mark of each collect
+    create_sync_table(credential_file, metadata_database)
+    # create table storing the files of registered runs and analyses
+    create_registered_files_table(credential_file, metadata_database)
         
     ega_objects = ['studies', 'runs', 'samples', 'experiments', 'datasets', 'analyses', 'policies', 'dacs']
     for i in ega_objects:
         try:
-            collect_metadata(credential_file, box, i, counts, chunk_size, URL, metadata_database)
+            if incremental and collect_new_metadata(credential_file, box, i, counts, chunk_size, URL, metadata_database, batch_size, workers):
+                continue
+            collect_metadata(credential_file, box, i, counts, chunk_size, URL, metadata_database, batch_size, workers)
         except:
             print('## ERROR ## Could not add {0} metadata for box {1} into EGA database'.format(i, box))
 
@@ -4631,6 +7828,8 @@ def add_dataset_info(credential_file, submission_database, metadata_database, ta
             # create table with column headers
             cur = conn.cursor()
             cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+            # index columns used to filter rows
+            add_table_indexes(cur, table)
             conn.commit()
         else:
             # get the column headers from the table
@@ -4731,6 +7930,8 @@ def add_experiment_info(credential_file, submission_database, metadata_database,
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -4833,6 +8034,8 @@ def add_sample_info(credential_file, metadata_database, submission_database, tab
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -4917,6 +8120,8 @@ def add_sample_attributes(credential_file, metadata_database, submission_databas
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5006,6 +8211,8 @@ def add_analyses_attributes_projects(credential_file, metadata_database, submiss
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5099,6 +8306,8 @@ def add_analyses_info(credential_file, metadata_database, submission_database, t
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5205,6 +8414,8 @@ def add_study_info(credential_file, metadata_database, submission_database, tabl
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5290,6 +8501,8 @@ def add_dac_info(credential_file, metadata_database, submission_database, table,
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5380,6 +8593,8 @@ def add_policy_info(credential_file, metadata_database, submission_database, tab
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5485,6 +8700,8 @@ def add_runs_info(credential_file, metadata_database, submission_database, table
         # create table with column headers
         cur = conn.cursor()
         cur.execute('CREATE TABLE {0} ({1})'.format(table, columns))
+        # index columns used to filter rows
+        add_table_indexes(cur, table)
         conn.commit()
     else:
         # get the column headers from the table
@@ -5576,7 +8793,8 @@ if __name__ == '__main__':
     RegisterParser.add_argument('-f', '--FootPrint', dest='footprint', default='FootPrint', help='Database Table with footprint of registered and non-registered files. Default is Footprint')
     RegisterParser.add_argument('-w', '--WorkingDir', dest='workingdir', default='/scratch2/groups/gsi/bis/EGA_Submissions', help='Directory where subdirectories used for submissions are written. Default is /scratch2/groups/gsi/bis/EGA_Submissions')
     RegisterParser.add_argument('-mm', '--Mem', dest='memory', default='10', help='Memory allocated to encrypting files. Default is 10G')
-    RegisterParser.add_argument('-mx', '--Max', dest='maxuploads', default=8, type=int, help='Maximum number of files to be uploaded at once. Default is 8')
+    RegisterParser.add_argument('-mx', '--Max', dest='maxuploads', default=8, type=int, help='Maximum number of files of the box to be uploaded at once. Default is 8')
+    RegisterParser.add_argument('-mxt', '--MaxTotal', dest='max_total', default=8, type=int, help='Maximum number of files of all boxes to be uploaded at once. Default is 8')
     RegisterParser.add_argument('-mxf', '--MaxFootPrint', dest='maxfootprint', default=15, type=int, help='Maximum footprint of non-registered files on the box\'s staging sever. Default is 15Tb')
     RegisterParser.add_argument('-p', '--Portal', dest='portal', default='https://ega-archive.org/submission-api/v1', help='EGA submission portal. Default is https://ega-archive.org/submission-api/v1')
     RegisterParser.add_argument('--Remove', dest='remove', action='store_true', help='Delete encrypted and md5 files when analyses are successfully submitted. Do not delete by default')
@@ -5584,6 +8802,14 @@ if __name__ == '__main__':
     RegisterParser.add_argument('-aat', '--AnalysisAttributesTable', dest='analysis_attributes_table', default='AnalysesAttributes', help='Database Table with analyses attributes information. Default is AnalysesAttributes')
     RegisterParser.add_argument('-pt', '--ProjectsTable', dest='projects_table', default='AnalysesProjects', help='Database Table with analyses projects information. Default is AnalysesProjects')
     RegisterParser.add_argument('-ht', '--Host', dest='host', default='xfer1.res.oicr.on.ca', help='Name of the xfer server. Default is xfer1.res.oicr.on.ca')
+    RegisterParser.add_argument('-e', '--Encryption', dest='encryption', choices=['gpg', 'crypt4gh'], default='gpg', help='Encryption method. The key is the gpg keyring or the Crypt4GH public key of the recipient. Default is gpg')
+    RegisterParser.add_argument('-ep', '--EncryptionProcesses', dest='encryption_processes', type=int, default=1, help='Number of processes used for Crypt4GH encryption. Default is 1')
+    RegisterParser.add_argument('-ap', '--AliasParallel', dest='alias_parallel', type=int, default=4, help='Maximum number of files of an alias encrypted at once. Default is 4')
+    RegisterParser.add_argument('-bp', '--BoxParallel', dest='box_parallel', type=int, default=16, help='Maximum number of files of the box encrypted at once. Default is 16')
+    RegisterParser.add_argument('-x', '--Executor', dest='executor', choices=['uge', 'local'], default='uge', help='Backend running the encryption, upload and check jobs. Default is uge')
+    RegisterParser.add_argument('-xw', '--ExecutorWorkers', dest='executor_workers', type=int, default=os.cpu_count() or 1, help='Maximum number of jobs run at once by the local backend. Default is the number of CPUs')
+    RegisterParser.add_argument('--ArrayJobs', dest='array_jobs', action='store_true', help='Launch the encryption and upload jobs of each cycle as array jobs. Not used by default')
+    RegisterParser.add_argument('--Stream', dest='stream', action='store_true', help='Encrypt files straight into their upload to the staging server without writing encrypted files to scratch. Not used by default')
         
     # check encryption
     CheckEncryptionParser = subparsers.add_parser('check_encryption', help='Check that encryption is done for a given alias', parents = [parent_parser])
@@ -5602,6 +8828,19 @@ if __name__ == '__main__':
     CheckUploadParser.add_argument('-w', '--WorkingDir', dest='workingdir', default='/scratch2/groups/gsi/bis/EGA_Submissions', help='Directory where subdirectories used for submissions are written. Default is /scratch2/groups/gsi/bis/EGA_Submissions')
     CheckUploadParser.add_argument('-at', '--Attributes', dest='attributes', default='AnalysesAttributes', help='DataBase table. Default is AnalysesAttributes')
     CheckUploadParser.add_argument('-ht', '--Host', dest='host', default='xfer1.res.oicr.on.ca', help='Name of the xfer server. Default is xfer1.res.oicr.on.ca')
+    CheckUploadParser.add_argument('--Stream', dest='stream', action='store_true', help='Files were encrypted straight into the upload. Records md5sums if upload is successful')
+    
+    # encrypt a file straight into its upload to the staging server
+    StreamUploadParser = subparsers.add_parser('stream_upload', help='Encrypt a file straight into its upload to the staging server and upload md5sums of the original and encrypted files', parents = [parent_parser])
+    StreamUploadParser.add_argument('-f', '--File', dest='file', help='Path to the file to encrypt and upload', required=True)
+    StreamUploadParser.add_argument('-n', '--Name', dest='name', help='Name of the file on the staging server, without encryption extension', required=True)
+    StreamUploadParser.add_argument('-o', '--Outdir', dest='outdir', help='Directory where md5 files are written', required=True)
+    StreamUploadParser.add_argument('-sp', '--StagePath', dest='stagepath', help='Destination directory on the staging server', required=True)
+    StreamUploadParser.add_argument('-k', '--KeyRing', dest='keyring', help='Path to the gpg keyring or to the Crypt4GH public key of the recipient', required=True)
+    StreamUploadParser.add_argument('-e', '--Encryption', dest='encryption', choices=['gpg', 'crypt4gh'], default='gpg', help='Encryption method. Default is gpg')
+    StreamUploadParser.add_argument('-p', '--Processes', dest='processes', type=int, default=1, help='Number of processes used for Crypt4GH encryption. Default is 1')
+    StreamUploadParser.add_argument('-ht', '--Host', dest='host', default='xfer1.res.oicr.on.ca', help='Name of the xfer server. Default is xfer1.res.oicr.on.ca')
+    StreamUploadParser.add_argument('-r', '--Record', dest='record', help='Path to the completion record written when the upload is done')
     
     # re-upload registered files that cannot be archived       
     ReUploadParser = subparsers.add_parser('reupload', help ='Encrypt and re-upload files that are registered but cannot be archived', parents = [parent_parser])
@@ -5610,10 +8849,43 @@ if __name__ == '__main__':
     ReUploadParser.add_argument('-a', '--Alias', dest='aliasfile', help='Two-column tab-delimited file with aliases and egaAccessionId of files that need to be re-uploaded')
     ReUploadParser.add_argument('-w', '--WorkingDir', dest='working_dir', default='/scratch2/groups/gsi/bis/EGA_Submissions', help='Directory containing sub-directories with submission information. Default is /scratch2/groups/gsi/bis/EGA_Submissions')
 
+    # encrypt a file and compute md5sums of the original and encrypted files
+    EncryptFileParser = subparsers.add_parser('encrypt_file', help='Encrypt a file and compute md5sums of the original and encrypted files in a single pass')
+    EncryptFileParser.add_argument('-f', '--File', dest='file', help='Path to the file to encrypt', required=True)
+    EncryptFileParser.add_argument('-o', '--Outfile', dest='outfile', help='Path to the output files, without extension. Writes outfile.gpg (or outfile.c4gh), outfile.md5 and outfile.gpg.md5 (or outfile.c4gh.md5)', required=True)
+    EncryptFileParser.add_argument('-k', '--KeyRing', dest='keyring', help='Path to the gpg keyring or to the Crypt4GH public key of the recipient', required=True)
+    EncryptFileParser.add_argument('-e', '--Encryption', dest='encryption', choices=['gpg', 'crypt4gh'], default='gpg', help='Encryption method. Default is gpg')
+    EncryptFileParser.add_argument('-p', '--Processes', dest='processes', type=int, default=1, help='Number of processes used for Crypt4GH encryption. Default is 1')
+    EncryptFileParser.add_argument('-r', '--Record', dest='record', help='Path to the completion record written when encryption is done')
+
+    # apply schema migrations
+    MigrateParser = subparsers.add_parser('migrate', help ='Apply schema migrations to the EGA and EGASUB databases')
+    MigrateParser.add_argument('-c', '--Credentials', dest='credential', help='file with database credentials', required=True)
+    MigrateParser.add_argument('-md', '--MetadataDb', dest='metadatadb', default='EGA', help='Name of the database collection EGA metadata. Default is EGA')
+    MigrateParser.add_argument('-sd', '--SubDb', dest='subdb', default='EGASUB', help='Name of the database used to object information for submission to EGA. Default is EGASUB')
+
+    # set the upload fair-share weights
+    UploadWeightParser = subparsers.add_parser('upload_weight', help ='Set the upload fair-share weight of a box or project, or the upload priority of an alias')
+    UploadWeightParser.add_argument('-c', '--Credentials', dest='credential', help='file with database credentials', required=True)
+    UploadWeightParser.add_argument('-sd', '--SubDb', dest='subdb', default='EGASUB', help='Name of the database used to object information for submission to EGA. Default is EGASUB')
+    UploadWeightParser.add_argument('-s', '--Scope', dest='scope', choices=['box', 'project', 'alias'], help='Set the weight of a box or project or the priority of an alias', required=True)
+    UploadWeightParser.add_argument('-n', '--Name', dest='name', help='Name of the box, project or alias', required=True)
+    UploadWeightParser.add_argument('-w', '--Weight', dest='weight', type=float, help='Relative share of the upload slots of the box or project (default 1), or priority of the alias (default 0, higher first)', required=True)
+
+    # build or update the index of the UGE accounting files
+    AccountingParser = subparsers.add_parser('accounting_index', help ='Build or update the local index of the UGE accounting files used to check jobs')
+    
+    # refresh the cached EGA enumerations
+    EnumerationsParser = subparsers.add_parser('refresh_enumerations', help ='Download the EGA enumerations and replace the cached enumerations')
+    EnumerationsParser.add_argument('-u', '--URL', dest='URL', default='https://ega-archive.org/submission-api/v1/', help='URL of the API. Default is https://ega-archive.org/submission-api/v1/')
+
     # collect metadata
     CollectParser = subparsers.add_parser('collect', help ='Collect registered metadata and add relevant information in EGA database', parents = [parent_parser])
     CollectParser.add_argument('-ch', '--ChunkSize', dest='chunksize', type=int, default=500, help='Size of each chunk of data to download at once')
     CollectParser.add_argument('-u', '--URL', dest='URL', default="https://ega-archive.org/submission-api/v1", help='URL of the API to download metadata of registered objects')
+    CollectParser.add_argument('-bs', '--BatchSize', dest='batchsize', type=int, default=1000, help='Number of records inserted at once in the EGA database. Default is 1000')
+    CollectParser.add_argument('-w', '--Workers', dest='workers', type=int, default=4, help='Maximum number of chunks downloaded at once. Default is 4')
+    CollectParser.add_argument('--Incremental', dest='incremental', action='store_true', help='Collect only objects submitted since the last collect. Default is False, all objects are collected')
 
     # add samples to Samples Table
     AddSamplesParser = subsubparsers.add_parser('samples', help ='Add sample information to Samples Table', parents=[parent_parser])
@@ -5702,13 +8974,34 @@ if __name__ == '__main__':
     elif args.subparser_name == 'reupload':
         reupload_registered_files(args.credential, args.metadatadb, args.subdb, args.analysistable, args.runstable, args.working_dir, args.aliasfile, args.box)
     elif args.subparser_name == 'register':
-        register_ega_objects(args.credential, args.subdb, args.metadatadb, args.workingdir, args.keyring, args.memory, args.diskspace, args.footprint, args.samples_attributes_table, args.analysis_attributes_table, args.projects_table, args.maxuploads, args.maxfootprint, args.remove, args.portal, args.box, args.host)
+        set_executor(args.executor, args.executor_workers)
+        register_ega_objects(args.credential, args.subdb, args.metadatadb, args.workingdir, args.keyring, args.memory, args.diskspace, args.footprint, args.samples_attributes_table, args.analysis_attributes_table, args.projects_table, args.maxuploads, args.maxfootprint, args.remove, args.portal, args.box, args.host, args.encryption, args.encryption_processes, args.stream, args.alias_parallel, args.box_parallel, args.array_jobs, args.max_total)
+        # jobs of the local backend run within the current process
+        wait_local_jobs()
     elif args.subparser_name == 'check_encryption':
         check_encryption(args.credential, args.subdb, args.table, args.box, args.alias, args.object, args.jobnames, args.workingdir)
     elif args.subparser_name == 'check_upload':
-        check_upload(args.host, args.object, args.credential, args.subdb, args.table, args.box, args.alias, args.jobnames, args.workingdir, args.attributes)
+        check_upload(args.host, args.object, args.credential, args.subdb, args.table, args.box, args.alias, args.jobnames, args.workingdir, args.attributes, args.stream)
+    elif args.subparser_name == 'stream_upload':
+        exit_code = stream_upload_file(args.credential, args.box, args.file, args.name, args.outdir, args.stagepath, args.keyring, args.host, args.encryption, args.processes, args.record)
+        if exit_code != 0:
+            sys.exit(exit_code)
+    elif args.subparser_name == 'encrypt_file':
+        exit_code = encrypt_file(args.file, args.outfile, args.keyring, args.encryption, args.processes, args.record)
+        if exit_code != 0:
+            sys.exit(exit_code)
+    elif args.subparser_name == 'migrate':
+        for database in [args.metadatadb, args.subdb]:
+            migrate_schema(args.credential, database)
+    elif args.subparser_name == 'upload_weight':
+        set_upload_weight(args.credential, args.subdb, args.scope, args.name, args.weight)
+    elif args.subparser_name == 'accounting_index':
+        if update_accounting_index(True) == False:
+            sys.exit(1)
+    elif args.subparser_name == 'refresh_enumerations':
+        refresh_enumerations(args.URL)
     elif args.subparser_name == 'collect':
-        collect_registered_metadata(args.credential, args.box, args.chunksize, args.URL, args.metadatadb)
+        collect_registered_metadata(args.credential, args.box, args.chunksize, args.URL, args.metadatadb, args.batchsize, args.incremental, args.workers)
     elif args.subparser_name == 'add_info':
         if args.subsubparser_name == 'samples':
             add_sample_info(args.credential, args.metadatadb, args.subdb, args.table, args.info, args.attributes, args.box)
@@ -5732,4 +9025,8 @@ if __name__ == '__main__':
             add_analyses_info(args.credential, args.metadatadb, args.subdb, args.table, args.information, args.projects, args.attributes, args.box)
         elif args.subsubparser_name == 'analyses_attributes':
             add_analyses_attributes_projects(args.credential, args.metadatadb, args.subdb, args.table, args.information, args.datatype, args.box)
+
+    # report the number of database connections opened by the registration and collection runs
+    if args.subparser_name in ['register', 'collect']:
+        print('opened {0} database connection(s)'.format(count_database_connections()))
         
@@ -13,6 +13,9 @@ import argparse
 import subprocess
 import uuid
 import sqlite3
+import json
+import time
+import getpass
 
 
 def extract_credentials(credential_file):
@@ -260,7 +263,11 @@ def get_box_footprint(host, box, password):
     - password (str): Password of the ega-box
     '''
     
-    L = subprocess.check_output("ssh {0} \"lftp -u {1},{2} -e \\\"cd to-encrypt;ls -l;bye;\\\" sftp://inbox.ega-archive.org\"".format(host, box, password), shell=True).rstrip().decode('utf-8').split('\n')
+    # reuse the ssh connection to the xfer host kept open by Gaea and previous runs
+    control_path = os.path.join(os.path.expanduser('~'), '.gaea', 'ssh', '%C')
+    os.makedirs(os.path.dirname(control_path), mode=0o700, exist_ok=True)
+    ssh = 'ssh -o ControlMaster=auto -o ControlPath={0} -o ControlPersist=600 {1}'.format(control_path, host)
+    L = subprocess.check_output("{0} \"lftp -u {1},{2} -e \\\"cd to-encrypt;ls -l;bye;\\\" sftp://inbox.ega-archive.org\"".format(ssh, box, password), shell=True).rstrip().decode('utf-8').split('\n')
     
     if len(L) == 1 and L[0] == '':
         footprint = 0
@@ -296,11 +303,48 @@ def update_message_status(database, table, new_status, alias, box, file, column)
     conn.close()
 
    
+def get_completion_record_file(workingdir, jobname):
+    '''
+    (str, str) -> str
+    
+    Returns the path to the completion record written by the upload job when it finishes
+    
+    Parameters
+    ----------
+    - workingdir (str): Path to the working directory of the file
+    - jobname (str): Name of the upload job
+    '''
+    
+    return os.path.join(workingdir, 'completions', jobname + '.json')
+
+
+def read_completion_record(record_file):
+    '''
+    (str) -> dict or None
+    
+    Returns the completion record of an upload job or None if the record doesn't exist.
+    The record of a job that did not finish running does not have an exit code
+    
+    Parameters
+    ----------
+    - record_file (str): Path to the completion record
+    '''
+    
+    if os.path.isfile(record_file) == False:
+        return None
+    try:
+        with open(record_file) as infile:
+            return json.load(infile)
+    except ValueError:
+        return {}
+
+
 def write_qsubs(alias, file, box, workingdir, mem, run_time, host, database, credential_file, table):
     '''
     (str, str, str, str, int, int, str, str, str, str) -> None
         
-    Write and launch qsubs to upload the files
+    Write and launch qsubs to upload the files. The upload job writes a completion
+    record when done, checked by the next run of upload_files
         
     Parameters
     ----------
@@ -334,19 +378,28 @@ def write_qsubs(alias, file, box, workingdir, mem, run_time, host, database, cre
     job_exits, job_names = [], []
     
     uploadcmd = "ssh {0} \"lftp -u {1},{2} -e \\\"cd to-encrypt;mput {3};bye;\\\" sftp://inbox.ega-archive.org\""
+    # record the exit code of the upload when done
+    recordcmd = "exitcode=$?; echo \"{{\\\"exitCode\\\": $exitcode, \\\"time\\\": $(date +%s)}}\" > {0}.part && mv {0}.part {0}; exit $exitcode"
     qsubcmd = "qsub -b y -P gsi -l h_vmem={0}g,h_rt={1}:0:0 -N {2} -e {3} -o {3} \"bash {4}\""
     
     # write bash script
     filename = os.path.basename(file)
+    jobname = alias + '.upload.' + filename
+    record_file = get_completion_record_file(workingdir, jobname)
     bashscript = os.path.join(qsubdir, alias + '.' + filename + '.upload.sh')
     with open(bashscript, 'w') as newfile:
-        newfile.write(uploadcmd.format(host, box, box_pwd, file))
+        newfile.write(uploadcmd.format(host, box, box_pwd, file) + '\n')
+        newfile.write(recordcmd.format(record_file) + '\n')
     qsubscript = os.path.join(qsubdir, alias + '.' + filename + '.upload.qsub')
-    jobname = alias + '.upload.' + filename
     myqsubcmd = qsubcmd.format(mem, run_time, jobname, logdir, bashscript)
     with open(qsubscript, 'w') as newfile:
         newfile.write(myqsubcmd)
     
+    # replace the record of a previous upload with a pending record stamped with the launch time
+    os.makedirs(os.path.dirname(record_file), exist_ok=True)
+    with open(record_file, 'w') as newfile:
+        json.dump({'time': int(time.time())}, newfile)
+    
     # launch job and collect job exit status and job name
     job = subprocess.call(myqsubcmd, shell=True)
     job_exits.append(job)
@@ -357,24 +410,6 @@ def write_qsubs(alias, file, box, workingdir, mem, run_time, host, database, cre
     # update error message
     update_message_status(database, table, 'NULL', alias, box, file, 'error')         
     
-    # launch check upload job
-    checkcmd = 'sleep 60; module load ega-upload; egaUpload check_upload -w {0} -b {1} -f {2} -db {3} -t {4} -a {5} -c {6}'.format(workingdir, box, file, database, table, alias, credential_file)  
-    bashscript2 = os.path.join(qsubdir, alias + '.' + filename + '.check_upload.sh')
-    with open(bashscript2, 'w') as newfile:
-        newfile.write(checkcmd)
-    
-    jobname2 = alias + '.checkupload.' + filename 
-    # launch job when previous job is done
-    
-    qsubcmd2 = "qsub -b y -P gsi -hold_jid {0} -l h_vmem={1}g -N {2} -e {3} -o {3} \"bash {4}\"".format(jobname, mem, jobname2, logdir, bashscript2)
-    qsubscript2 = os.path.join(qsubdir, alias + '.' + filename + '.check_upload.qsub')
-    with open(qsubscript2, 'w') as newfile:
-        newfile.write(qsubcmd2)
-    
-    job = subprocess.call(qsubcmd2, shell=True)
-    # store the exit code (but not the job name)
-    job_exits.append(job)          
-    
     # check if upload launched properly
     if not (len(set(job_exits)) == 1 and list(set(job_exits))[0] == 0):
          # record error message, reset status same uploading --> upload
@@ -451,13 +486,30 @@ def get_job_exit_status(jobnum):
     (int) -> str
     
     Returns the exit code and the error message of a job number after it finished running 
-    ('0' indicates a normal, error-free run and '1' or another value inicates an error)
+    ('0' indicates a normal, error-free run and '1' or another value inicates an error).
+    The job is looked up in the local index of the accounting files maintained by Gaea
+    before scanning the accounting file with qacct
     
     Parameters
     ----------
     - jobnum (int): Job number
     '''
     
+    # look up the job in the accounting index
+    accounting_index = os.environ.get('GAEA_ACCOUNTING_INDEX', os.path.join('/var/tmp', 'gaea-' + getpass.getuser(), 'accounting.sqlite'))
+    if os.path.isfile(accounting_index):
+        try:
+            conn = sqlite3.connect(accounting_index, timeout=60)
+            data = conn.execute('SELECT failed, exitStatus FROM Jobs WHERE jobId=? ORDER BY endTime DESC LIMIT 1', (int(jobnum),)).fetchall()
+            conn.close()
+        except (sqlite3.Error, ValueError):
+            data = []
+        if len(data) != 0:
+            failed, exit_status = data[0]
+            if exit_status == '0' and failed == '0':
+                return exit_status, ''
+            return exit_status if exit_status != '0' else failed, 'failed {0}'.format(failed)
+    
     try:
         content = subprocess.check_output('qacct -j {0}'.format(jobnum), shell=True).decode('utf-8').rstrip().split('\n')
     except:
@@ -576,6 +628,10 @@ def upload_files(args):
     credentials = extract_credentials(args.credential_file)
     box_pwd = credentials[args.box]
     
+    # check the files uploaded since the last run
+    args.alias, args.file = None, None
+    check_upload_files(args)
+    
     # get the files to upload
     # count the number of uploading files
     uploading_files = count_uploading_files(args.database, args.table, args.box)
@@ -601,63 +657,100 @@ def upload_files(args):
                 write_qsubs(alias, filepath, args.box, workingdir, args.mem, run_time, args.host, args.database, args.credential_file, args.table)
 
 
-def check_upload_files(args):
+def check_uploaded_file(database, table, box, alias, file, workingdir):
     '''
     (str, str, str, str, str, str) -> None
     
-    Check that file was successfully uploaded
+    Check that file was successfully uploaded from the completion record of its
+    upload job and update its status. Files still uploading are left unchanged
        
     Parameters
     ----------
-    - box (str): EGA submission box
     - database (str): Name of the database
     - table (str): Table storing the file information in the database
+    - box (str): EGA submission box
     - alias (str): Unique identifier associated with file
-    - file (str): Pato the file to upload
+    - file (str): Path to the uploaded file
     - workingdir (str): Path to the working directory containing logs and qsubs
     '''
     
-    # set up boolean to be updated if uploading is not complete
-    uploaded = True
-    
-    # get the log directory
-    logdir = os.path.join(args.workingdir, 'qsubs/log')
-    # get the most recent logfiles
-    errorlog, outlog = get_most_recent_log(logdir)
-
-    # check the out logs for each file
-    if outlog and errorlog:
-        content = check_logfiles(outlog, errorlog)
-        if content:
-            uploaded = False
-            exit_code = '1'
-            error_message = content
-            
-        # get the jobnumber
+    jobname = alias + '.upload.' + os.path.basename(file)
+    record = read_completion_record(get_completion_record_file(workingdir, jobname))
+    # files uploaded before completion records were written are not checked
+    if record == None:
+        return
+    
+    # get the most recent logfiles of the upload job
+    logdir = os.path.join(workingdir, 'qsubs/log')
+    errorlog, outlog = get_most_recent_log(logdir) if os.path.isdir(logdir) else ('', '')
+    # ignore the logs of a previous upload
+    if outlog and os.path.getmtime(outlog) < record.get('time', 0):
+        errorlog, outlog = '', ''
+    
+    if 'exitCode' in record:
+        exit_code = str(record['exitCode'])
+        error_message = '' if exit_code == '0' else 'upload exited with code {0}'.format(exit_code)
+    elif outlog and errorlog:
+        # the job may have finished without writing its record
         jobnum = os.path.basename(outlog)
         jobnum = jobnum[jobnum.rfind('.')+2:]
         exit_code, error_message = get_job_exit_status(jobnum)
-        if exit_code != '0':
-            uploaded = False
+        # job is still running
+        if error_message == 'cannot check job':
+            return
+        if exit_code == '0':
+            exit_code, error_message = '1', 'upload did not complete'
     else:
-        exit_code = '1'
-        error_message = 'cannot check log files'
-        uploaded = False
+        # job is still queued
+        return
     
-    if uploaded:
+    # errors reported by lftp are written to the logs
+    if exit_code == '0' and outlog and errorlog:
+        content = check_logfiles(outlog, errorlog)
+        if content:
+            exit_code, error_message = '1', content
+    
+    if exit_code == '0':
         # update status uploading --> uploaded
-        update_message_status(args.database, args.table, 'uploaded', args.alias, args.box, args.file, 'status')
+        update_message_status(database, table, 'uploaded', alias, box, file, 'status')
         # update error message
-        update_message_status(args.database, args.table, '', args.alias, args.box, args.file, 'error')
+        update_message_status(database, table, '', alias, box, file, 'error')
     else:
         # update status uploading -- > upload
-        update_message_status(args.database, args.table, 'upload', args.alias, args.box, args.file, 'status')
+        update_message_status(database, table, 'upload', alias, box, file, 'status')
         # update error message
-        update_message_status(args.database, args.table, error_message, args.alias, args.box, args.file, 'error')
+        update_message_status(database, table, error_message, alias, box, file, 'error')
         # increase running time in hours
-        runtime = get_run_time(args.database, args.table, args.box, args.file, args.alias)
+        runtime = get_run_time(database, table, box, file, alias)
         new_runtime = runtime + 5
-        update_message_status(args.database, args.table, new_runtime, args.alias, args.box, args.file, 'run_time')
+        update_message_status(database, table, new_runtime, alias, box, file, 'run_time')
+
+
+def check_upload_files(args):
+    '''
+    (str, str, str, str | None, str | None) -> None
+    
+    Check that the files uploading to the box were successfully uploaded
+       
+    Parameters
+    ----------
+    - box (str): EGA submission box
+    - database (str): Name of the database
+    - table (str): Table storing the file information in the database
+    - alias (str | None): Check only the file with this alias if defined
+    - file (str | None): Check only this file if defined
+    '''
+    
+    conn = connect_to_db(args.database)
+    data = conn.execute('SELECT * FROM {0} WHERE ega_box=\"{1}\" AND status = \"uploading\"'.format(args.table, args.box)).fetchall()
+    conn.close()
+    
+    for i in data:
+        if args.alias and i['alias'] != args.alias:
+            continue
+        if args.file and i['filepath'] != args.file:
+            continue
+        check_uploaded_file(args.database, args.table, args.box, i['alias'], i['filepath'], i['directory'])
 
 
 
@@ -697,14 +790,13 @@ if __name__ == '__main__':
     upload_parser.set_defaults(func=upload_files)
 
     # check upload parser
-    check_parser = subparsers.add_parser('check_upload', help="Check upload succeess")
-    check_parser.add_argument('-w', '--workingdir', dest='workingdir', help='Directory used for the submission and containing the qsubs and log directory', required=True)
+    check_parser = subparsers.add_parser('check_upload', help="Check upload succeess of the uploading files")
     check_parser.add_argument('-db', '--database', dest='database', default = '/.mounts/labs/gsiprojects/gsi/Data_Transfer/Release/PROJECTS/EGA/Submission_Tools/EGA_upload_database/EGA_uploads.db', \
                              help='Path to the EGA submission database. Default is /.mounts/labs/gsiprojects/gsi/Data_Transfer/Release/PROJECTS/EGA/Submission_Tools/EGA_upload_database/EGA_uploads.db')
     check_parser.add_argument('-t', '--table', dest='table', default = 'ega_uploads', help='Table storing the files for upload')
     check_parser.add_argument('-b', '--box', dest='box', help='EGA submission box', required=True)
-    check_parser.add_argument('-a', '--alias', dest='alias', help='Alias of the file to upload', required=True)
-    check_parser.add_argument('-f', '--file', dest='file', help='Path to the file to upload', required=True)
+    check_parser.add_argument('-a', '--alias', dest='alias', help='Check only the file with this alias')
+    check_parser.add_argument('-f', '--file', dest='file', help='Check only this file')
     check_parser.set_defaults(func=check_upload_files)
 
     # get arguments from the command line
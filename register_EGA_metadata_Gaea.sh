@@ -14,16 +14,22 @@ EncryptionKeys=/.mounts/labs/gsiprojects/gsi/Data_Transfer/Release/PROJECTS/EGA/
 submission_portal=https://ega.crg.eu/submitterportal/v1
 metadata_portal=https://ega-archive.org/submission-api/v1
 
+# build or update the index of the job accounting used to check encryption and upload jobs
+Gaea accounting_index;
+
+# collect only new metadata, except for a full collect on sundays
+if [ $(date +%u) -eq 7 ]; then collect_mode=""; else collect_mode="--Incremental"; fi
+
 for boxname in "${boxes[@]}"; do
 	# download EGA metadata
 	echo "downloading metadata for "$boxname""
-	Gaea collect -c $credentials -b $boxname -md EGA -sd EGASUB -ch 500 -u $metadata_portal;
+	Gaea collect -c $credentials -b $boxname -md EGA -sd EGASUB -ch 500 -u $metadata_portal $collect_mode;
         # list files on the staging server
 	echo "listing files in staging server for "$boxname""
 	Gaea staging_server -c $credentials -b $boxname -md EGA -sd EGASUB -rt Runs -at Analyses -st StagingServer -ft FootPrint;
 	# register all EGA objects 
 	echo "register EGA objects in "$boxname""
-	Gaea register -c $credentials -md EGA -sd EGASUB -b $boxname -k $EncryptionKeys -d 15 -f FootPrint -mm 10 -mx 8 -mxf 15 -p $submission_portal --Remove -sat SamplesAttributes -aat AnalysesAttributes -pt AnalysesProjects;
+	Gaea register -c $credentials -md EGA -sd EGASUB -b $boxname -k $EncryptionKeys -d 15 -f FootPrint -mm 10 -mx 8 -mxt 8 -mxf 15 -p $submission_portal --Remove -sat SamplesAttributes -aat AnalysesAttributes -pt AnalysesProjects;
 done;
 
 
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Crypt4GH encryption by decrypting the encrypted files
+with the reference implementation of crypt4gh
+"""
+
+
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+import Gaea
+
+try:
+    import crypt4gh.keys
+    import crypt4gh.keys.c4gh
+    import crypt4gh.lib
+except ImportError:
+    crypt4gh = None
+
+
+@unittest.skipIf(crypt4gh == None or Gaea.crypto_aead_chacha20poly1305_ietf_encrypt == None, 'crypt4gh and pynacl are required')
+class TestCrypt4ghEncryption(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # make a key pair of the recipient
+        self.public_key = os.path.join(self.tmpdir.name, 'recipient.pub')
+        self.private_key = os.path.join(self.tmpdir.name, 'recipient.sec')
+        crypt4gh.keys.c4gh.generate(self.private_key, self.public_key, b'passphrase', b'test')
+        # make a file spanning several segments, the last one being partial
+        self.file_path = os.path.join(self.tmpdir.name, 'file.fastq.gz')
+        self.data = os.urandom(65536 * 5 + 1000)
+        with open(self.file_path, 'wb') as newfile:
+            newfile.write(self.data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def decrypt(self, encrypted):
+        seckey = crypt4gh.keys.get_private_key(self.private_key, lambda: 'passphrase')
+        outfile = io.BytesIO()
+        crypt4gh.lib.decrypt([(0, seckey, None)], io.BytesIO(encrypted), outfile)
+        return outfile.getvalue()
+
+    def test_encrypt_stream(self):
+        # encrypt each segment in a separate task
+        blocks = []
+        exit_code, original_md5, encrypted_md5 = Gaea.crypt4gh_encrypt_stream(self.file_path, self.public_key, blocks.append, 2, 1)
+        encrypted = b''.join(blocks)
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(original_md5, hashlib.md5(self.data).hexdigest())
+        self.assertEqual(encrypted_md5, hashlib.md5(encrypted).hexdigest())
+        self.assertEqual(self.decrypt(encrypted), self.data)
+
+    def test_encrypt_file(self):
+        outfile = os.path.join(self.tmpdir.name, 'encrypted')
+        self.assertEqual(Gaea.encrypt_file(self.file_path, outfile, self.public_key, 'crypt4gh', 2), 0)
+        with open(outfile + '.c4gh', 'rb') as infile:
+            encrypted = infile.read()
+        self.assertEqual(self.decrypt(encrypted), self.data)
+        with open(outfile + '.md5') as infile:
+            self.assertEqual(infile.read().strip(), hashlib.md5(self.data).hexdigest())
+        with open(outfile + '.c4gh.md5') as infile:
+            self.assertEqual(infile.read().strip(), hashlib.md5(encrypted).hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the staging server listings and directory creation
+against the local stand-in for the staging server
+"""
+
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import Gaea
+
+
+class SqliteCursor:
+    '''
+    A cursor of the submission database backed by sqlite
+    '''
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, query, params=()):
+        return self.cursor.execute(query.replace('%s', '?'), params)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class SqliteConnection:
+    '''
+    A connection to the submission database backed by sqlite
+    '''
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+
+    def cursor(self):
+        return SqliteCursor(self.conn)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class TestLocalStagingServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'staging')
+        self.box = 'ega-box-test'
+        # serve the staging server of box from a local directory
+        Gaea.close_staging_sessions()
+        self.patches = [mock.patch.dict(Gaea.staging_root, {'path': self.root}),
+                        mock.patch.object(Gaea, 'connect_to_database', lambda *args: SqliteConnection(os.path.join(self.tmpdir.name, 'EGASUB.sqlite'))),
+                        mock.patch.object(Gaea, 'extract_credentials', lambda credential_file: {self.box: 'password'})]
+        for i in self.patches:
+            i.start()
+
+    def tearDown(self):
+        Gaea.close_staging_sessions()
+        for i in self.patches:
+            i.stop()
+        self.tmpdir.cleanup()
+
+    def write_file(self, path, size):
+        path = os.path.join(self.root, self.box, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as newfile:
+            newfile.write(b'x' * size)
+
+    def test_make_directory(self):
+        self.assertEqual(Gaea.make_directory_staging_server('xfer', self.box, 'password', '/project/run1'), 0)
+        self.assertTrue(os.path.isdir(os.path.join(self.root, self.box, 'project', 'run1')))
+
+    def test_parse_listing(self):
+        self.write_file('root.bam.gpg', 10)
+        self.write_file('project/run1/file.fastq.gz.gpg', 20)
+        self.write_file('project/run1/file.fastq.gz.md5', 33)
+        self.write_file('metadata/report.txt', 5)
+        lines = Gaea.get_staging_session('xfer', self.box, 'password').run('find -l')
+        self.assertEqual(Gaea.parse_staging_server_listing(lines),
+                         {'/root.bam.gpg': 10, 'project/run1/file.fastq.gz.gpg': 20, 'project/run1/file.fastq.gz.md5': 33})
+
+    def test_stage_path_files(self):
+        Gaea.make_directory_staging_server('xfer', self.box, 'password', '/project/run1')
+        self.write_file('project/run1/file.fastq.gz.gpg', 20)
+        self.assertEqual(Gaea.get_stage_path_files('credentials', 'EGASUB', 'xfer', self.box, 'project/run1'), ['file.fastq.gz.gpg'])
+        # a recent listing is shared
+        self.write_file('project/run1/file.fastq.gz.md5', 33)
+        self.assertEqual(Gaea.get_stage_path_files('credentials', 'EGASUB', 'xfer', self.box, 'project/run1'), ['file.fastq.gz.gpg'])
+        # the stage path is listed again for files uploaded after the listing
+        self.assertEqual(Gaea.get_stage_path_files('credentials', 'EGASUB', 'xfer', self.box, 'project/run1', int(time.time()) + 1),
+                         ['file.fastq.gz.gpg', 'file.fastq.gz.md5'])
+
+    def test_missing_stage_path(self):
+        with self.assertRaises(Gaea.subprocess.CalledProcessError):
+            Gaea.get_stage_path_files('credentials', 'EGASUB', 'xfer', self.box, 'project/missing')
+
+
+class TestStagingSession(unittest.TestCase):
+
+    def make_session(self, command):
+        # the session runs command instead of lftp through the xfer host
+        session = Gaea.StagingSession.__new__(Gaea.StagingSession)
+        session.command = command
+        session.process = None
+        session.lock = Gaea.threading.Lock()
+        return session
+
+    def test_run(self):
+        session = self.make_session('sh')
+        self.assertEqual(session.run('echo listing'), ['listing'])
+        with self.assertRaises(Gaea.subprocess.CalledProcessError):
+            session.run('false')
+        session.close()
+
+    def test_stalled_session(self):
+        session = self.make_session('cat > /dev/null')
+        with mock.patch.object(Gaea, 'staging_timeout', 1):
+            start = time.time()
+            with self.assertRaises(Gaea.subprocess.CalledProcessError):
+                session.run('find -l')
+        self.assertLess(time.time() - start, 10)
+        self.assertIsNone(session.process)
+
+
+if __name__ == '__main__':
+    unittest.main()